@@ -1,49 +1,122 @@
 import pandas as pd
-import numpy as np
-# Artık canlı uygulamada eğitime gerek olmadığı için aşağıdaki kütüphaneler silinebilir
-# ama kodun kalanında bir sorun yaratmadığı için şimdilik kalabilirler.
-from sklearn.metrics import classification_report, confusion_matrix
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-import joblib # YENİ: Modeli yüklemek için eklendi
+import json
+import os
+import sys
+
+# Tahmin motoru backend ile ortak (backend/core/model.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from core.cache import TTLCache
+from core.model import DiseaseClassifier
+
+# train_model.py tarafından yazılan veri seti ve performans istatistikleri
+STATS_PATH = 'model_stats.json'
+# Arama indeksindeki en uzun n-gram (daha uzun aramalar bu uzunluktaki parçaların kesişimiyle bulunur)
+MAX_NGRAM = 3
+# İndeks başına önbelleğe alınan arama sonucu sayısı
+SEARCH_CACHE_SIZE = 1024
 
 # ==================== ÖNCEDEN EĞİTİLMİŞ MODELİ YÜKLEME =====================
 @st.cache_resource
 def load_assets():
     """
-    Önceden eğitilmiş modeli ve gerekli diğer varlıkları (semptom listesi, dataframe) yükler.
+    Önceden eğitilmiş modeli (backend'in DiseaseClassifier motoruyla), semptom arama indeksini ve istatistik dosyasını yükler.
+    Veri seti (cleaned_data.parquet) yüklenmez; kayıt sayıları, doğruluk ve metrikler model_stats.json'dan gelir.
     Bu fonksiyon @st.cache_resource sayesinde sadece uygulama ilk başladığında bir kez çalışır.
     """
-    model = joblib.load('trained_model.joblib')
-    symptom_names = joblib.load('symptom_names.joblib')
-    df = pd.read_parquet('cleaned_data.parquet')
-    diseases = df.iloc[:, 0]
-    
-    # Modelin doğruluk skorunu train_model.py çıktısından alarak buraya sabit yazıyoruz.
-    score = 0.87 # Senin belirttiğin %87'lik doğruluk oranı
-    
-    return model, score, symptom_names, diseases, df
-
-
-# ==================== TAHMİN VE GÖRSELLEŞTİRME FONKSİYONLARI (DEĞİŞİKLİK YOK) ====================
-def predict_diseases(selected_symptoms, symptom_names, model, threshold=0.01, top_k=5):
-    symptom_vector = np.zeros(len(symptom_names))
-    for symptom in selected_symptoms:
-        if symptom in symptom_names:
-            idx = symptom_names.index(symptom)
-            symptom_vector[idx] = 1
-    probabilities = model.predict_proba([symptom_vector])[0]
-    disease_classes = model.classes_
-    results = []
-    for disease, prob in zip(disease_classes, probabilities):
-        if prob >= threshold:
-            results.append({
-                'hastalık': disease,
-                'olasılık': prob * 100,
-                'olasılık_str': f'%{prob * 100:.1f}'
-            })
-    results = sorted(results, key=lambda x: x['olasılık'], reverse=True)[:top_k]
+    # train_model.py çıktıları: varsa 'nb_model/' (mmap), yoksa joblib dosyaları
+    classifier = DiseaseClassifier(model_path='trained_model.joblib', symptoms_path='symptom_names.joblib',
+                                   artifact_dir='nb_model')
+    index = SymptomIndex(classifier.symptom_names)
+    stats = None
+    if os.path.exists(STATS_PATH):
+        with open(STATS_PATH, encoding='utf-8') as f:
+            stats = json.load(f)
+    return classifier, index, stats
+
+
+class SymptomIndex:
+    """
+    Semptom arama kutusu için önceden kurulmuş n-gram indeksi.
+
+    Her semptom adının 1..MAX_NGRAM uzunluğundaki tüm parçaları, adı içeren semptomların
+    (alfabetik sıradaki) numaralarına eşlenir. Kısa bir arama doğrudan indeksten okunur; uzun
+    aramalarda parçaların kesişimi sadece birkaç adaya indirger ve bunlar `in` ile doğrulanır.
+    Sonuç, eski doğrusal taramayla (`search.lower() in s.lower()`) aynıdır.
+    """
+
+    def __init__(self, symptom_names):
+        self.names = sorted(symptom_names)
+        self.lowered = [name.lower() for name in self.names]
+        self.position = {name: i for i, name in enumerate(self.names)}
+        postings = {}
+        for i, name in enumerate(self.lowered):
+            for n in range(1, MAX_NGRAM + 1):
+                for start in range(len(name) - n + 1):
+                    postings.setdefault(name[start:start + n], set()).add(i)
+        self.postings = {gram: sorted(ids) for gram, ids in postings.items()}
+        # Sonuçlar indeksin kendisinde tutulur; metoda lru_cache koymak `self`i önbellekte canlı tutardı
+        self.searches = TTLCache(maxsize=SEARCH_CACHE_SIZE)
+
+    def search_ids(self, query):
+        """Adında `query` geçen semptomların numaraları (alfabetik sırada)."""
+        query = query.lower()
+        ids = self.searches.get(query)
+        if ids is None:
+            ids = self._search_ids(query)
+            self.searches.set(query, ids)
+        return ids
+
+    def _search_ids(self, query):
+        if len(query) <= MAX_NGRAM:
+            return tuple(self.postings.get(query, ()))
+        grams = {query[start:start + MAX_NGRAM] for start in range(len(query) - MAX_NGRAM + 1)}
+        lists = sorted((self.postings.get(gram, []) for gram in grams), key=len)
+        candidates = set(lists[0]).intersection(*lists[1:])
+        return tuple(i for i in sorted(candidates) if query in self.lowered[i])
+
+    def options(self, query, selected):
+        """Çoklu seçim listesi: aramaya uyanlar + zaten seçilmiş olanlar, alfabetik sırada."""
+        if not query:
+            return self.names
+        ids = self.search_ids(query)
+        missing = {self.position[s] for s in selected if s in self.position} - set(ids)
+        if missing:
+            ids = sorted(set(ids) | missing)
+        return [self.names[i] for i in ids]
+
+
+def class_report_frame(stats):
+    """Sınıf bazında precision / recall / f1 / destek tablosu (destek sayısına göre sıralı)."""
+    report = pd.DataFrame(stats['per_class'], index=stats['classes'])
+    return report.sort_values('support', ascending=False)
+
+
+def confused_pairs_frame(stats, top_n=20):
+    """Karmaşıklık matrisinin köşegen dışındaki en büyük hücreleri: en sık karıştırılan hastalık çiftleri."""
+    classes = stats['classes']
+    pairs = [(classes[t], classes[p], n) for t, p, n in stats['confusion'] if t != p]
+    pairs.sort(key=lambda x: x[2], reverse=True)
+    return pd.DataFrame(pairs[:top_n], columns=['Gerçek', 'Tahmin', 'Sayı'])
+
+
+# ==================== TAHMİN VE GÖRSELLEŞTİRME FONKSİYONLARI ====================
+@st.cache_data(max_entries=1024)
+def predict_diseases(_classifier, symptoms, threshold=0.01, top_k=5, model_fingerprint=None):
+    """
+    Backend'in DiseaseClassifier motoruyla tahmin yapar; sonuç (semptom kümesi, eşik, top_k, model dosyalarının
+    parmak izi) için önbelleğe alınır. `symptoms` sıralı bir tuple olmalıdır. Parmak izi dosyaların mtime/boyutudur;
+    joblib dosyalarıyla yeniden eğitimde sürüm hep "joblib" kaldığından anahtar sürüm değil parmak izidir.
+    """
+    predictions, _ = _classifier.predict(list(symptoms), top_k=top_k)
+    # Olasılığa göre azalan sırada gelir; eşiği geçenler ilk top_k içindedir
+    results = [{
+        'hastalık': p['disease'],
+        'olasılık': p['probability'],
+        'olasılık_str': p['probability_str']
+    } for p in predictions if p['probability'] >= threshold * 100]
     max_prob = results[0]['olasılık'] if results else 0
     return results, max_prob
 
@@ -75,46 +148,39 @@ def main():
     st.markdown("---")
 
     # DEĞİŞİKLİK: Veri ve model artık doğrudan yükleniyor, dosya yükleme arayüzü kaldırıldı.
-    model, score, symptom_names, diseases, df = load_assets()
+    classifier, symptom_index, stats = load_assets()
+    symptom_names = classifier.symptom_names
+    score = stats['accuracy'] if stats else None
 
     st.sidebar.header("✅ Veri ve Model")
-    st.sidebar.success(f"Model ve {len(df)} kayıt başarıyla yüklendi.")
+    if stats:
+        st.sidebar.success(f"Model ve {stats['records']} kayıt başarıyla yüklendi.")
+    else:
+        st.sidebar.warning("İstatistik dosyası (model_stats.json) bulunamadı. `train_model.py` betiğini çalıştırın.")
     st.sidebar.info(f"📊 {len(symptom_names)} semptom")
-    st.sidebar.info(f"🦠 {diseases.nunique()} farklı hastalık")
+    st.sidebar.info(f"🦠 {len(classifier.classes)} farklı hastalık")
     st.sidebar.header("⚙️ Model Bilgileri")
-    st.sidebar.metric("Model Doğruluğu (Accuracy)", f"%{score * 100:.1f}")
+    st.sidebar.metric("Model Doğruluğu (Accuracy)", f"%{score * 100:.1f}" if score is not None else "-")
 
     if 'selected_symptoms' not in st.session_state:
         st.session_state.selected_symptoms = []
     
-    # YENİ: Gelişmiş Performans Analizi Paneli (Statik Bilgilerle Güncellendi)
-    with st.sidebar.expander("🔬 Gelişmiş Performans Analizi"):
-        st.markdown("#### Sınıf Dengesizliği Grafiği")
-        st.info("Veri setindeki en yaygın 20 hastalığın dağılımı.")
-        disease_counts = diseases.value_counts().head(20)
-        st.bar_chart(disease_counts)
-
-        st.markdown("#### Sınıflandırma Raporu")
-        st.info(
-            "`train_model.py` betiğini çalıştırdıktan sonra terminalde çıkan raporu aşağıdaki kod bloğuna yapıştırabilirsiniz."
-        )
-        # DEĞİŞİKLİK: Bu rapor artık canlı hesaplanmıyor. Offline eğitim sonrası çıkan sonucu buraya yapıştırın.
-        classification_report_str = """
-              precision    recall  f1-score   support
-
-     Asthma       0.89      0.92      0.90        12
-  Depression      0.95      0.95      0.95        20
-   Diabetes       0.88      0.91      0.89        23
-      GERD        0.91      0.87      0.89        15
-      ...         ...       ...       ...       ...
-   (ÖRNEKTİR, KENDİ SONUCUNUZU YAPIŞTIRIN)
-        """
-        st.code(classification_report_str)
-
-        st.markdown("#### Karmaşıklık Matrisi (Confusion Matrix)")
-        st.info(
-            "Bu matris, modelin hangi hastalıkları birbiriyle karıştırdığını gösterir. Bu grafiği lokalde oluşturup ekran görüntüsü olarak buraya ekleyebilirsiniz: `st.image('confusion_matrix.png')`"
-        )
+    # Gelişmiş Performans Analizi Paneli (train_model.py'nin test seti sonuçlarından)
+    if stats:
+        with st.sidebar.expander("🔬 Gelişmiş Performans Analizi"):
+            st.markdown("#### Sınıf Dengesizliği Grafiği")
+            st.info("Veri setindeki en yaygın 20 hastalığın dağılımı.")
+            disease_counts = pd.Series(stats['class_counts'], index=stats['classes']).nlargest(20)
+            st.bar_chart(disease_counts)
+
+            st.markdown("#### Sınıflandırma Raporu")
+            st.info(f"Test seti: {stats['test_records']} kayıt. "
+                    f"Makro F1: {stats['macro_avg']['f1']:.2f}, ağırlıklı F1: {stats['weighted_avg']['f1']:.2f}")
+            st.dataframe(class_report_frame(stats), use_container_width=True)
+
+            st.markdown("#### Karmaşıklık Matrisi (Confusion Matrix)")
+            st.info("Modelin en sık birbiriyle karıştırdığı hastalıklar (test setinde).")
+            st.dataframe(confused_pairs_frame(stats), use_container_width=True, hide_index=True)
 
     st.sidebar.header("⚙️ Analiz Ayarları")
     threshold = st.sidebar.slider("Minimum Olasılık Eşiği (%)", 1, 20, 1, 1) / 100
@@ -124,8 +190,7 @@ def main():
     with col1:
         st.header("🩺 Semptom Seçimi")
         search = st.text_input("🔍 Semptom Ara", placeholder="Örn: fever, headache, cough...")
-        filtered_symptoms = [s for s in symptom_names if search.lower() in s.lower()] if search else symptom_names
-        options_for_multiselect = sorted(list(set(st.session_state.selected_symptoms + filtered_symptoms)))
+        options_for_multiselect = symptom_index.options(search, st.session_state.selected_symptoms)
         selected_symptoms = st.multiselect(f"Semptomlarınızı seçin ({len(options_for_multiselect)} semptom)",
                                            options=options_for_multiselect,
                                            default=st.session_state.selected_symptoms,
@@ -138,8 +203,11 @@ def main():
                 st.warning("⚠️ Lütfen en az bir semptom seçin!")
             else:
                 with st.spinner('🔍 Analiz yapılıyor...'):
-                    results, max_prob = predict_diseases(st.session_state.selected_symptoms, symptom_names, model,
-                                                         threshold=threshold, top_k=top_k)
+                    # Dosyalar değiştiyse önce yeniden yüklensin ki anahtar yüklü modelin parmak izi olsun
+                    classifier.reload_if_changed()
+                    results, max_prob = predict_diseases(classifier, tuple(sorted(st.session_state.selected_symptoms)),
+                                                         threshold=threshold, top_k=top_k,
+                                                         model_fingerprint=classifier.fingerprint)
                     st.session_state['results'] = results
                     st.session_state['max_prob'] = max_prob
 
@@ -171,7 +239,7 @@ def main():
                 - **Bulunan Hastalık Sayısı:** {len(results)}
                 - **En Yüksek Olasılık:** %{max_prob:.1f}
                 - **Kullanılan Model:** Naive Bayes (SMOTE ile dengelenmiş veri)
-                - **Model Doğruluğu:** %{score * 100:.1f}
+                - **Model Doğruluğu:** {f"%{score * 100:.1f}" if score is not None else "-"}
                 """)
         else:
             st.info("👈 Soldaki panelden semptomlarınızı seçin ve 'Analiz Et' butonuna basın")
@@ -0,0 +1,57 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Sequence
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(samples: List[float], scale: float = 1000.0) -> Dict:
+    """p50/p95/p99/mean/max of durations in seconds, reported in seconds * scale (ms by default)."""
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values) * scale, 3) if values else 0.0,
+        "p50": round(percentile(values, 50) * scale, 3),
+        "p95": round(percentile(values, 95) * scale, 3),
+        "p99": round(percentile(values, 99) * scale, 3),
+        "max": round(values[-1] * scale, 3) if values else 0.0,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def save_results(kind: str, params: Dict, results: List[Dict], out_dir: str = RESULTS_DIR) -> str:
+    """Writes <kind>-<commit>-<timestamp>.json and returns its path."""
+    os.makedirs(out_dir, exist_ok=True)
+    commit = git_commit()
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(out_dir, f"{kind}-{commit}-{stamp}.json")
+    data = {
+        "kind": kind,
+        "commit": commit,
+        "created_at": time.time(),
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    return path
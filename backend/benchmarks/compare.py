@@ -0,0 +1,56 @@
+"""
+Compares two result files written by load_test.py or microbench.py (same kind).
+
+    python -m benchmarks.compare benchmarks/results/load-OLD.json benchmarks/results/load-NEW.json
+
+Exits with status 1 if any p50/p95/p99 got slower by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+METRICS = ("p50", "p95", "p99")
+
+def load(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def result_key(result: Dict) -> Tuple:
+    return (result["name"], result.get("concurrency"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline["kind"] != candidate["kind"]:
+        sys.exit(f"cannot compare {baseline['kind']} results with {candidate['kind']} results")
+    print(f"{baseline['kind']}: {baseline['commit']} -> {candidate['commit']}")
+
+    old = {result_key(r): r for r in baseline["results"]}
+    regressions = 0
+    for result in candidate["results"]:
+        key = result_key(result)
+        before = old.get(key)
+        label = key[0] if key[1] is None else f"{key[0]} c={key[1]}"
+        if before is None:
+            print(f"{label:<28} (new)")
+            continue
+        cells = []
+        for metric in METRICS:
+            change = (result[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            flag = "!" if change > args.threshold else " "
+            regressions += change > args.threshold
+            cells.append(f"{metric} {before[metric]:>9.1f} -> {result[metric]:>9.1f} {result['unit']} ({change:+6.1f}%){flag}")
+        print(f"{label:<28} " + "  ".join(cells))
+
+    if regressions:
+        print(f"{regressions} metric(s) slower by more than {args.threshold}%")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
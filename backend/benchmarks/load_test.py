@@ -0,0 +1,189 @@
+"""
+Offline load test: starts the stub OpenAI server and the API (uvicorn, throwaway SQLite
+database and LLM cache), then drives /diagnosis, /history and /users/me at each
+concurrency level and reports p50/p95/p99 latency, throughput and errors.
+
+    python -m benchmarks.load_test --concurrency 1 8 32 --requests 200 --llm-latency-ms 400
+
+No Supabase or OpenAI access is needed: auth uses locally signed HS256 tokens (the same
+path as SUPABASE_JWT_SECRET in production, with the remote fallback off) and the LLM is
+benchmarks/stub_openai.py. Run from backend/. Results go to benchmarks/results/.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+from jose import jwt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import BACKEND_DIR, RESULTS_DIR, save_results, summarize
+
+JWT_SECRET = "load-test-secret"
+SAMPLES_PATH = os.path.join(BACKEND_DIR, "assets", "retrieval_samples.json")
+ENDPOINTS = ("diagnosis", "history", "users_me")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_token(i: int) -> str:
+    claims = {"sub": f"load-{i}", "email": f"load-{i}@example.com", "aud": "authenticated",
+              "exp": int(time.time()) + 24 * 3600}
+    return jwt.encode(claims, JWT_SECRET, algorithm="HS256")
+
+def load_texts() -> List[str]:
+    with open(SAMPLES_PATH, encoding="utf-8") as f:
+        return [sample["text"] for sample in json.load(f)]
+
+def start_servers(args, workdir: str):
+    stub_port, api_port = free_port(), free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_openai", "--port", str(stub_port),
+         "--latency-ms", str(args.llm_latency_ms), "--jitter-ms", str(args.llm_jitter_ms)],
+        cwd=BACKEND_DIR,
+    )
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "AUTH_REMOTE_FALLBACK": "0",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'load_test.db')}",
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.db"),
+        "DIAGNOSIS_SPOOL_DIR": os.path.join(workdir, "spool"),
+        # The stub's made-up translations must not end up in the shipped table or the learned store
+        "TRANSLATIONS_PATH": os.path.join(workdir, "disease_translations.json"),
+        "TRANSLATIONS_LEARNED_PATH": os.path.join(workdir, "translations_learned.db"),
+        "LOG_LEVEL": args.log_level,
+    }
+    if not args.keep_user_limits:
+        env["LLM_USER_RATE"] = "0"  # A few simulated users would exhaust their buckets at once
+    # The API only checks the schema; create it like a deployment would
+    subprocess.run([sys.executable, "migrations.py"], cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(api_port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    return stub, api, f"http://127.0.0.1:{api_port}"
+
+async def wait_ready(client: httpx.AsyncClient, api: subprocess.Popen, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if api.poll() is not None:
+            raise RuntimeError(f"API exited with code {api.returncode}")
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("API did not become ready in time")
+
+def request_factory(endpoint: str, tokens: List[str], texts: List[str], unique: bool):
+    sequence = itertools.count()  # Keeps counting across concurrency levels
+
+    def make(i: int):
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        if endpoint == "diagnosis":
+            text = texts[i % len(texts)]
+            # A suffix the matcher ignores, so each request misses the LLM cache
+            body = {"text": f"{text} ({next(sequence)})" if unique else text}
+            return "POST", "/diagnosis", {"json": body, "headers": headers}
+        if endpoint == "history":
+            return "GET", "/history", {"headers": headers}
+        return "GET", "/users/me", {"headers": headers}
+    return make
+
+async def run_level(client: httpx.AsyncClient, make, total: int, concurrency: int) -> Dict:
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            method, path, kwargs = make(i)
+            t0 = time.perf_counter()
+            try:
+                status = (await client.request(method, path, **kwargs)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - t0)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+    return {"requests": total, "concurrency": concurrency, "seconds": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 2), "errors": errors, "statuses": statuses,
+            "unit": "ms", **summarize(latencies)}
+
+async def run(args) -> List[Dict]:
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    stub, api, base_url = start_servers(args, workdir)
+    results = []
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, api)
+            tokens = [make_token(i) for i in range(args.users)]
+            texts = load_texts()
+            # Creates the users, so the first level does not measure sign-up
+            await asyncio.gather(*(client.get("/users/me", headers={"Authorization": f"Bearer {t}"}) for t in tokens))
+
+            # /diagnosis first: it also fills the history the /history levels read
+            for endpoint in args.endpoints:
+                make = request_factory(endpoint, tokens, texts, args.unique_texts)
+                for concurrency in args.concurrency:
+                    result = {"name": endpoint, **await run_level(client, make, args.requests, concurrency)}
+                    results.append(result)
+                    print(f"{endpoint:<10} c={concurrency:<4} p50 {result['p50']:>9.1f}ms  p95 {result['p95']:>9.1f}ms  "
+                          f"p99 {result['p99']:>9.1f}ms  {result['throughput_rps']:>8.1f} req/s  errors {result['errors']}")
+                if endpoint == "diagnosis":
+                    await asyncio.sleep(1.0)  # Let the write-behind queue flush before reading history
+    finally:
+        for process in (api, stub):
+            process.terminate()
+        for process in (api, stub):
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--users", type=int, default=20, help="distinct signed-in users")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--llm-latency-ms", type=float, default=400)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--unique-texts", action="store_true", help="make every diagnosis miss the LLM cache")
+    parser.add_argument("--keep-user-limits", action="store_true", help="keep the per-user LLM rate limit")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--out", default=RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if not args.no_save:
+        print(f"saved {save_results('load', vars(args), results, args.out)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+In-process micro-benchmarks of the hot paths that do not touch the network:
+DiseaseClassifier.predict (cached and uncached), predict_batch, and the /history
+serialization path (rows -> DiagnosisResponse -> JSON).
+
+    python -m benchmarks.microbench --repeat 2000
+
+Run from backend/. Results are printed and saved to benchmarks/results/ (see compare.py).
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from pydantic import TypeAdapter
+
+from benchmarks.common import RESULTS_DIR, save_results, summarize
+from core.alerts import get_alert_level
+from core.model import get_classifier
+from main import history_item
+import schemas
+
+def bench(name: str, fn: Callable[[int], object], repeat: int, ops_per_call: int = 1) -> Dict:
+    """Calls fn(i) `repeat` times; latencies are reported in microseconds per call."""
+    fn(0)  # Warm-up (imports, first allocation of caches)
+    samples = []
+    start = time.perf_counter()
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    result = {"name": name, "unit": "us", "ops_per_call": ops_per_call,
+              "ops_per_sec": round(repeat * ops_per_call / elapsed, 1), **summarize(samples, scale=1e6)}
+    print(f"{name:<32} p50 {result['p50']:>10.1f}us  p95 {result['p95']:>10.1f}us  "
+          f"p99 {result['p99']:>10.1f}us  {result['ops_per_sec']:>12.1f} ops/s")
+    return result
+
+def random_symptom_sets(symptom_names: List[str], count: int, rng: random.Random) -> List[List[str]]:
+    return [rng.sample(symptom_names, rng.randint(2, 6)) for _ in range(count)]
+
+def history_rows(classifier, count: int, rng: random.Random) -> List[SimpleNamespace]:
+    """Rows shaped like the columns /history selects."""
+    rows = []
+    now = datetime.datetime.utcnow()
+    for i, symptoms in enumerate(random_symptom_sets(classifier.symptom_names, count, rng)):
+        predictions, max_prob = classifier.predict(symptoms)
+        rows.append(SimpleNamespace(
+            id=i, created_at=now - datetime.timedelta(minutes=i), probability=max_prob,
+            mapped_symptoms=symptoms, alert_level=get_alert_level(max_prob), predictions=predictions,
+            reasoning="Belirtileriniz bu tanıyla uyumlu görünüyor.",
+            advice="Bol sıvı tüketin.\nDinlenin.\nŞikayetler sürerse doktora başvurun.",
+            confirmed_disease=None,
+        ))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="timed calls per benchmark")
+    parser.add_argument("--batch-size", type=int, default=1000, help="symptom lists per predict_batch call")
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[50, 200], help="/history page sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    classifier = get_classifier()
+    symptom_sets = random_symptom_sets(classifier.symptom_names, args.repeat, rng)
+    results = []
+
+    hot = symptom_sets[0]
+    results.append(bench("predict_cached", lambda i: classifier.predict(hot), args.repeat))
+
+    maxsize = classifier.cache.maxsize
+    classifier.cache.clear()
+    classifier.cache.maxsize = 0  # Every call computes
+    try:
+        results.append(bench("predict_uncached", lambda i: classifier.predict(symptom_sets[i]), args.repeat))
+    finally:
+        classifier.cache.maxsize = maxsize
+
+    batch = random_symptom_sets(classifier.symptom_names, args.batch_size, rng)
+    results.append(bench(f"predict_batch_{args.batch_size}", lambda i: classifier.predict_batch(batch),
+                         max(1, args.repeat // 100), ops_per_call=args.batch_size))
+
+    adapter = TypeAdapter(List[schemas.DiagnosisResponse])
+    for page_size in args.page_sizes:
+        rows = history_rows(classifier, page_size, rng)
+        results.append(bench(f"history_items_{page_size}", lambda i: [history_item(r) for r in rows],
+                             max(1, args.repeat // 10), ops_per_call=page_size))
+        results.append(bench(f"history_json_{page_size}",
+                             lambda i: adapter.dump_json([history_item(r) for r in rows]),
+                             max(1, args.repeat // 10), ops_per_call=page_size))
+
+    if not args.no_save:
+        params = {**vars(args), "model_version": classifier.version}
+        print(f"saved {save_results('microbench', params, results, args.out)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+OpenAI-compatible stand-in for load tests: POST /v1/chat/completions answers the
+backend's three prompts (symptom extraction, translation, advice) with canned JSON
+after a configurable latency, so benchmarks never call (or pay for) the real API.
+
+    python -m benchmarks.stub_openai --port 8901 --latency-ms 400 --jitter-ms 100
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8901/v1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Characters per streamed content delta
+STREAM_CHUNK_SIZE = 8
+
+ADVICE = {
+    "reasoning": "Belirtileriniz bu tanıyla uyumlu görünüyor.",
+    "advice": "Bol sıvı tüketin.\nDinlenin.\nAteşinizi takip edin.\nŞikayetler sürerse doktora başvurun.",
+}
+
+app = FastAPI()
+app.state.latency = 0.4
+app.state.jitter = 0.1
+app.state.token_delay = 0.005
+app.state.requests = 0
+
+def pick_symptoms(system_prompt: str, user_text: str):
+    """Symptoms from the prompt's valid list that share a word with the user text (two at most)."""
+    listed = system_prompt.split("Valid Symptoms List:", 1)[1]
+    valid = [s.strip() for s in listed.split(",") if s.strip()]
+    words = set(re.findall(r"\w+", user_text.lower()))
+    matches = [s for s in valid if words & set(s.split())]
+    return (matches or valid[:1])[:2]
+
+def answer(system_prompt: str, user_content: str) -> dict:
+    if "Valid Symptoms List:" in system_prompt:
+        return {"symptoms": pick_symptoms(system_prompt, user_content)}
+    if "Translate the following list" in system_prompt:
+        try:
+            diseases = json.loads(user_content)
+        except ValueError:
+            diseases = []
+        return {"translations": [f"TR {d}" for d in diseases]}
+    return ADVICE
+
+def usage(prompt: str, completion: str) -> dict:
+    # Rough token counts, close enough for the token metrics
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(completion) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+async def delay():
+    await asyncio.sleep(max(0.0, app.state.latency + random.uniform(-app.state.jitter, app.state.jitter)))
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.requests += 1
+    messages = body.get("messages", [])
+    system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+    user_content = next((m["content"] for m in messages if m["role"] == "user"), "")
+    content = json.dumps(answer(system_prompt, user_content), ensure_ascii=False)
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model")}
+    token_usage = usage(system_prompt + user_content, content)
+
+    if not body.get("stream"):
+        await delay()
+        return JSONResponse({
+            **base, "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": token_usage,
+        })
+
+    async def events():
+        await delay()  # Time to first token
+        for start in range(0, len(content), STREAM_CHUNK_SIZE):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": content[start:start + STREAM_CHUNK_SIZE]},
+                                  "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(app.state.token_delay)
+        yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': token_usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/stats")
+def stats():
+    return {"requests": app.state.requests}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency-ms", type=float, default=400, help="mean response (or first token) latency")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="latency varies uniformly by +/- this much")
+    parser.add_argument("--token-ms", type=float, default=5, help="delay between streamed chunks")
+    args = parser.parse_args()
+    app.state.latency = args.latency_ms / 1000
+    app.state.jitter = args.jitter_ms / 1000
+    app.state.token_delay = args.token_ms / 1000
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
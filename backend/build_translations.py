@@ -0,0 +1,43 @@
+"""
+Offline job: translates every disease class of the model once into the versioned
+translation table (assets/disease_translations.json) used by /diagnosis.
+
+    python build_translations.py [--force] [--chunk-size 40]
+
+Run it after training a model with new classes. Existing entries are kept unless --force.
+"""
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from core.llm import translate_diseases
+from core.model import get_classifier
+from core.translations import TranslationTable
+
+async def build(force: bool, chunk_size: int):
+    table = TranslationTable()
+    classes = [str(c) for c in get_classifier().classes]
+    todo = classes if force else [c for c in classes if c not in table.translations]
+    print(f"📚 {len(classes)} classes, {len(todo)} to translate (table version {table.version}).")
+
+    for start in range(0, len(todo), chunk_size):
+        chunk = todo[start:start + chunk_size]
+        translated = await translate_diseases(chunk)
+        if len(translated) != len(chunk):
+            print(f"⚠️ Skipping chunk at {start}: got {len(translated)} names for {len(chunk)}.")
+            continue
+        table.update({name: t for name, t in zip(chunk, translated) if isinstance(t, str) and t})
+        print(f"   {min(start + chunk_size, len(todo))}/{len(todo)}")
+
+    missing = [c for c in classes if c not in table.translations]
+    print(f"✅ Table version {table.version}: {len(classes) - len(missing)}/{len(classes)} classes translated.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--force", action="store_true", help="re-translate classes already in the table")
+    parser.add_argument("--chunk-size", type=int, default=40, help="disease names per LLM request")
+    args = parser.parse_args()
+    asyncio.run(build(args.force, args.chunk_size))
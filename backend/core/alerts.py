@@ -0,0 +1,6 @@
+def get_alert_level(max_prob: float) -> str:
+    """Alert level for the top prediction's probability (percent). Stored with each diagnosis."""
+    alert_level = "Low"
+    if max_prob > 50: alert_level = "Medium"
+    if max_prob > 80: alert_level = "High"
+    return alert_level
@@ -0,0 +1,5 @@
+import os
+
+# Paths shared by the backend modules; runtime state files default to the backend directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(BASE_DIR, "assets")
@@ -0,0 +1,229 @@
+import json
+import os
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+ARTIFACT_FORMAT = "multinomial_nb/v1"
+MANIFEST_NAME = "manifest.json"
+# Probabilities are ranked after rounding to this many decimals. Classes tied in exact
+# arithmetic can differ by ~1e-13 depending on summation order; rounding makes them tie
+# again, so they fall back to class order like a stable sort of predict_proba.
+RANK_DECIMALS = 12
+
+
+class NaiveBayesEngine:
+    """
+    Lightweight inference engine for a fitted MultinomialNB over binary symptom vectors.
+
+    All lookup structures are built once: a symptom -> column map and the model's
+    log-probabilities as contiguous arrays. Scoring a request only touches the rows of
+    the active symptoms instead of multiplying a dense vector against every feature.
+    """
+
+    def __init__(self, classes: Sequence[str], symptom_names: Sequence[str],
+                 feature_log_prob_t: np.ndarray, class_log_prior: np.ndarray):
+        self.classes = np.asarray(classes, dtype=object)
+        self.symptom_names = list(symptom_names)
+        self.symptom_index: Dict[str, int] = {name: i for i, name in enumerate(self.symptom_names)}
+        # (n_symptoms, n_classes): one row per symptom so active rows can be gathered directly
+        self.feature_log_prob_t = np.ascontiguousarray(feature_log_prob_t, dtype=np.float64)
+        self.class_log_prior = np.ascontiguousarray(class_log_prior, dtype=np.float64)
+
+        if self.feature_log_prob_t.shape != (len(self.symptom_names), len(self.classes)):
+            raise ValueError("Feature log-probabilities do not match symptom/class counts.")
+
+    @classmethod
+    def from_estimator(cls, model, symptom_names: Sequence[str]) -> "NaiveBayesEngine":
+        """Builds the engine from a fitted sklearn MultinomialNB."""
+        return cls(model.classes_, symptom_names, model.feature_log_prob_.T, model.class_log_prior_)
+
+    def active_indices(self, selected_symptoms: Iterable[str]) -> np.ndarray:
+        """Maps symptom names to sorted, unique column indices. Unknown names are ignored."""
+        index = self.symptom_index
+        return np.array(sorted({index[s] for s in selected_symptoms if s in index}), dtype=np.intp)
+
+    def predict_log_proba(self, active: np.ndarray) -> np.ndarray:
+        """Class log-probabilities for a single binary vector given by its active columns."""
+        jll = self.class_log_prior + self.feature_log_prob_t[active].sum(axis=0)
+        # Normalize in log space like MultinomialNB.predict_proba (logsumexp)
+        jll_max = jll.max()
+        return jll - (jll_max + np.log(np.exp(jll - jll_max).sum()))
+
+    def predict(self, selected_symptoms: Iterable[str], top_k: int = 5) -> Tuple[List[Dict], float]:
+        probabilities = np.exp(self.predict_log_proba(self.active_indices(selected_symptoms)))
+        top = top_k_indices(probabilities, top_k)
+        return self.format_results(probabilities, top)
+
+    def predict_batch_proba(self, symptom_lists: Sequence[Iterable[str]]) -> np.ndarray:
+        """Class probabilities for N symptom lists, scored as one (N x symptoms) matrix."""
+        index = self.symptom_index
+        X = np.zeros((len(symptom_lists), len(self.symptom_names)))
+        for row, symptoms in enumerate(symptom_lists):
+            for s in symptoms:
+                if s in index:
+                    X[row, index[s]] = 1
+
+        jll = X @ self.feature_log_prob_t + self.class_log_prior
+        jll -= jll.max(axis=1, keepdims=True)
+        jll -= np.log(np.exp(jll).sum(axis=1, keepdims=True))
+        return np.exp(jll)
+
+    def predict_batch(self, symptom_lists: Sequence[Iterable[str]], top_k: int = 5) -> List[Tuple[List[Dict], float]]:
+        probabilities = self.predict_batch_proba(symptom_lists)
+        top = top_k_batch_indices(probabilities, top_k)
+        return [self.format_results(row, row_top) for row, row_top in zip(probabilities, top)]
+
+    def format_results(self, probabilities: np.ndarray, top: np.ndarray) -> Tuple[List[Dict], float]:
+        results = []
+        for idx in top:
+            prob = float(probabilities[idx])
+            if prob > 0.0:  # Filter out zero probabilities
+                results.append({
+                    'disease': self.classes[idx],
+                    'probability': prob * 100,
+                    'probability_str': f"%{prob * 100:.1f}"
+                })
+        max_prob = results[0]['probability'] if results else 0.0
+        return results, max_prob
+
+
+def top_k_indices(probabilities: np.ndarray, k: int) -> List[int]:
+    """
+    Indices of the k largest probabilities, in descending order.
+
+    Uses a partial sort; ties (after rounding to RANK_DECIMALS) are broken by class
+    order so the result matches a stable full sort of every class.
+    """
+    probabilities = np.round(probabilities, RANK_DECIMALS)
+    n_classes = len(probabilities)
+    k = max(0, min(k, n_classes))
+    if k == 0:
+        return []
+    if k < n_classes:
+        part = np.argpartition(probabilities, n_classes - k)[n_classes - k:]
+        if np.count_nonzero(probabilities >= probabilities[part].min()) > k:
+            return np.argsort(-probabilities, kind="stable")[:k].tolist()
+    else:
+        part = np.arange(n_classes)
+    return sorted(part.tolist(), key=lambda i: (-probabilities[i], i))
+
+
+
+def top_k_batch_indices(probabilities: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise top_k_indices for an (N x classes) probability matrix."""
+    probabilities = np.round(probabilities, RANK_DECIMALS)
+    n_rows, n_classes = probabilities.shape
+    k = max(0, min(k, n_classes))
+    if k == 0:
+        return np.empty((n_rows, 0), dtype=np.intp)
+    if k == n_classes:
+        return np.argsort(-probabilities, axis=1, kind="stable")
+
+    part = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(probabilities, part, axis=1)
+    top = np.take_along_axis(part, np.lexsort((part, -values), axis=1), axis=1)
+
+    # Rows with ties straddling the k-th place fall back to a stable full sort
+    tied = (probabilities >= values.min(axis=1, keepdims=True)).sum(axis=1) > k
+    if tied.any():
+        top[tied] = np.argsort(-probabilities[tied], axis=1, kind="stable")[:, :k]
+    return top
+
+
+def save_artifact(out_dir: str, model, symptom_names: Sequence[str]) -> Dict:
+    """
+    Exports a fitted MultinomialNB as plain .npy arrays plus a JSON manifest (no pickle).
+    Array files of older versions are deleted, except the replaced version's.
+    """
+    arrays = {
+        "feature_log_prob_t": model.feature_log_prob_.T,
+        "class_log_prior": model.class_log_prior_,
+        # Raw counts allow incremental updates without the original training data
+        "feature_count": model.feature_count_,
+        "class_count": model.class_count_,
+    }
+    fields = {
+        "alpha": float(np.atleast_1d(model.alpha)[0]),
+        "classes": [str(c) for c in model.classes_],
+        "symptom_names": list(symptom_names),
+    }
+    try:
+        previous = read_manifest(out_dir)["version"]
+    except (OSError, ValueError):
+        previous = None
+    manifest = write_artifact(out_dir, arrays, fields)
+    # Keep the replaced version's files for workers that have not reloaded yet
+    prune_artifact(out_dir, [manifest["version"], previous])
+    return manifest
+
+
+def write_artifact(out_dir: str, arrays: Dict[str, np.ndarray], fields: Dict) -> Dict:
+    """
+    Writes a new artifact version: the arrays as .npy files and a manifest with `fields`.
+
+    Array files carry a version suffix and the manifest is replaced last, so processes
+    that have the previous arrays memory-mapped keep reading intact files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    now = time.time()
+    version = time.strftime("%Y%m%d%H%M%S", time.localtime(now)) + f".{int(now % 1 * 1e6):06d}-{os.getpid()}"
+    files = {}
+    for name, array in arrays.items():
+        files[name] = f"{name}-{version}.npy"
+        np.save(os.path.join(out_dir, files[name]), np.ascontiguousarray(array, dtype=np.float64))
+
+    manifest = {"format": ARTIFACT_FORMAT, "version": version, **fields, "arrays": files}
+    _replace_manifest(out_dir, manifest)
+    return manifest
+
+
+def update_manifest(out_dir: str, fields: Dict) -> Dict:
+    """Replaces manifest fields of the current version; its version and array files are kept."""
+    manifest = read_manifest(out_dir)
+    manifest.update({key: value for key, value in fields.items() if key not in ("format", "version", "arrays")})
+    _replace_manifest(out_dir, manifest)
+    return manifest
+
+
+def _replace_manifest(out_dir: str, manifest: Dict):
+    tmp_path = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+
+
+def read_manifest(artifact_dir: str) -> Dict:
+    with open(os.path.join(artifact_dir, MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported model artifact format: {manifest.get('format')}")
+    return manifest
+
+
+def prune_artifact(artifact_dir: str, keep_versions: Iterable[str]):
+    """
+    Deletes array files of versions not in keep_versions. Workers that still have a deleted
+    file memory-mapped keep their mapping until they reload (POSIX unlink semantics).
+    """
+    keep = set(keep_versions)
+    for name in os.listdir(artifact_dir):
+        if name.endswith(".npy") and "-" in name and name[:-4].split("-", 1)[1] not in keep:
+            os.remove(os.path.join(artifact_dir, name))
+
+
+def load_artifact(artifact_dir: str, mmap: bool = True) -> Tuple[NaiveBayesEngine, Dict]:
+    """
+    Loads an exported artifact. With mmap the arrays are mapped read-only, so every
+    worker process on the host shares a single page-cache copy.
+    """
+    manifest = read_manifest(artifact_dir)
+    mmap_mode = "r" if mmap else None
+    files = manifest["arrays"]
+    engine = NaiveBayesEngine(
+        manifest["classes"],
+        manifest["symptom_names"],
+        np.load(os.path.join(artifact_dir, files["feature_log_prob_t"]), mmap_mode=mmap_mode),
+        np.load(os.path.join(artifact_dir, files["class_log_prior"]), mmap_mode=mmap_mode),
+    )
+    return engine, manifest
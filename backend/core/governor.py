@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+
+from core.cache import TTLCache
+from core.metrics import LLM_CALLS
+
+# Upstream LLM calls in flight at once, per worker
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+# Calls allowed to wait for a free slot; beyond this callers get an immediate 429
+LLM_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", "64"))
+# Longest wait (seconds) for a free slot before giving up with a 429
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "10"))
+# Per-user token bucket: sustained LLM calls per second and burst size (0 rate disables it)
+LLM_USER_RATE = float(os.environ.get("LLM_USER_RATE", "1.0"))
+LLM_USER_BURST = float(os.environ.get("LLM_USER_BURST", "15"))
+LLM_USER_BUCKETS = int(os.environ.get("LLM_USER_BUCKETS", "10000"))
+
+# Who the current request's LLM calls are for (set by get_current_user)
+llm_user: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("llm_user", default=None)
+
+class LLMOverloaded(HTTPException):
+    """No LLM capacity for this call; reaches the client as 429 with Retry-After."""
+
+    def __init__(self, detail: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes one token. Returns 0 on success, otherwise the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class LLMGovernor:
+    """
+    Admission control for upstream LLM calls: a per-user token bucket, then a global
+    concurrency limit with a bounded wait queue. Callers that cannot be admitted fail
+    fast with LLMOverloaded instead of piling up behind the upstream rate limits.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, queue_size: int = LLM_QUEUE_SIZE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, user_rate: float = LLM_USER_RATE,
+                 user_burst: float = LLM_USER_BURST):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # Idle buckets are full again after burst / rate seconds, so they can be forgotten then
+        self.buckets = TTLCache(maxsize=LLM_USER_BUCKETS,
+                                ttl=user_burst / user_rate if user_rate > 0 else 0)
+        self._buckets_lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_user = 0
+        self.rejected_queue = 0
+        self.timed_out = 0
+        # Moving average of call duration, used for Retry-After when the queue is full
+        self.avg_call_seconds = 1.0
+
+    def check_user(self):
+        """Takes a token from the current user's bucket or raises LLMOverloaded."""
+        user_id = llm_user.get()
+        if user_id is None or self.user_rate <= 0:
+            return
+        with self._buckets_lock:
+            bucket = self.buckets.get(user_id) or TokenBucket(self.user_rate, self.user_burst)
+            wait = bucket.take()
+            # Re-set on every call so the entry expires burst / rate seconds after last use
+            self.buckets.set(user_id, bucket)
+        if wait:
+            self.rejected_user += 1
+            LLM_CALLS.labels("rejected").inc()
+            raise LLMOverloaded("Too many requests, please slow down.", wait)
+
+    def _retry_after(self) -> float:
+        return self.avg_call_seconds * (self.waiting + 1) / self.max_concurrency
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one of the global upstream slots for the duration of the block."""
+        # waiting counts callers from the moment they ask, so a burst cannot overshoot the queue
+        if self.active + self.waiting >= self.max_concurrency + self.queue_size:
+            self.rejected_queue += 1
+            LLM_CALLS.labels("rejected").inc()
+            raise LLMOverloaded("The service is busy, please try again shortly.", self._retry_after())
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            LLM_CALLS.labels("rejected").inc()
+            raise LLMOverloaded("The service is busy, please try again shortly.", self._retry_after())
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+            self.avg_call_seconds = 0.9 * self.avg_call_seconds + 0.1 * (time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_user": self.rejected_user,
+            "rejected_queue": self.rejected_queue,
+            "timed_out": self.timed_out,
+            "avg_call_seconds": round(self.avg_call_seconds, 3),
+        }
+
+_governor: Optional[LLMGovernor] = None
+
+def get_governor() -> LLMGovernor:
+    global _governor
+    if _governor is None:
+        _governor = LLMGovernor()
+    return _governor
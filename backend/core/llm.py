@@ -1,13 +1,208 @@
+import asyncio
 import os
-from openai import OpenAI
-from typing import List
+from functools import lru_cache
+from openai import AsyncOpenAI
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
 import json
+import logging
+import re
 
-# Initialize OpenAI Client
-# Expects OPENAI_API_KEY in environment variables
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from core.governor import LLMOverloaded, get_governor
+from core.llm_cache import get_llm_cache, make_key
+from core.metrics import LLM_CALLS, record_llm_usage
 
-def extract_symptoms(user_text: str, valid_symptoms: List[str]) -> List[str]:
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = "gpt-4o-mini"
+# Coalesce identical in-flight calls across the workers on this host too (needs the SQLite cache tier)
+LLM_SHARED_SINGLEFLIGHT = os.environ.get("LLM_SHARED_SINGLEFLIGHT", "0") == "1"
+# How long another worker's in-flight call is waited for before calling upstream anyway
+LLM_LEASE_TTL = float(os.environ.get("LLM_LEASE_TTL", "30"))
+LEASE_POLL_INTERVAL = 0.05
+
+@lru_cache(maxsize=None)
+def get_client() -> AsyncOpenAI:
+    """
+    Async OpenAI client, created on first use. Calls never block the event loop.
+    Expects OPENAI_API_KEY in environment variables.
+    """
+    return AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls in this worker: the first caller of a key starts
+    the call, later callers await the same task. The task is shielded, so a caller that goes
+    away does not cancel the call for the others.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.coalesced_remote = 0  # Served by a call another worker made (shared mode)
+
+    async def do(self, key: str, call: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            LLM_CALLS.labels("coalesced").inc()
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        total = self.calls + self.coalesced
+        return {
+            "shared": LLM_SHARED_SINGLEFLIGHT,
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_remote": self.coalesced_remote,
+            "coalesced_rate": self.coalesced / total if total else 0.0,
+        }
+
+_single_flight = SingleFlight()
+
+def coalescing_stats() -> Dict:
+    return _single_flight.stats()
+
+async def _complete_json(system_prompt: str, user_content: str, temperature: float, key: str) -> str:
+    """One upstream JSON-mode completion. Returns the raw content, cached once it parses."""
+    async with get_governor().slot():
+        response = await get_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content}
+            ],
+            response_format={"type": "json_object"},
+            temperature=temperature
+        )
+    LLM_CALLS.labels("upstream").inc()
+    record_llm_usage(response.usage)
+    content = response.choices[0].message.content
+    json.loads(content)
+    await get_llm_cache().set(key, content)
+    return content
+
+async def _complete_json_shared(system_prompt: str, user_content: str, temperature: float, key: str) -> str:
+    """
+    _complete_json coordinated across workers through the SQLite cache tier: the worker
+    holding the key's lease calls upstream, the others wait for its result to land in the cache.
+    """
+    disk = get_llm_cache().disk
+    if disk is None:
+        return await _complete_json(system_prompt, user_content, temperature, key)
+
+    owner = str(os.getpid())
+    if await asyncio.to_thread(disk.acquire_lease, key, owner, LLM_LEASE_TTL):
+        try:
+            return await _complete_json(system_prompt, user_content, temperature, key)
+        finally:
+            await asyncio.to_thread(disk.release_lease, key, owner)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_LEASE_TTL
+    while loop.time() < deadline:
+        await asyncio.sleep(LEASE_POLL_INTERVAL)
+        content, leased = await asyncio.to_thread(disk.poll, key)
+        if content is not None:
+            _single_flight.coalesced_remote += 1
+            LLM_CALLS.labels("coalesced").inc()
+            return content
+        if not leased:
+            break  # The other worker failed, call upstream ourselves
+    return await _complete_json(system_prompt, user_content, temperature, key)
+
+async def _chat_json(system_prompt: str, user_content: str, temperature: float) -> dict:
+    """
+    JSON-mode chat completion behind the response cache (keyed by model, prompts and
+    temperature). Concurrent identical misses share one upstream call. Only responses
+    that parse as JSON are cached; errors propagate (to every coalesced caller).
+    """
+    cache = get_llm_cache()
+    key = make_key(LLM_MODEL, system_prompt, user_content, temperature)
+    content = await cache.get(key)
+    if content is not None:
+        LLM_CALLS.labels("cache_hit").inc()
+    else:
+        get_governor().check_user()
+        complete = _complete_json_shared if LLM_SHARED_SINGLEFLIGHT else _complete_json
+        content = await _single_flight.do(key, lambda: complete(system_prompt, user_content, temperature, key))
+    # Parsed per caller, so coalesced callers never share a mutable result
+    return json.loads(content)
+
+async def _chat_json_stream(system_prompt: str, user_content: str, temperature: float) -> AsyncIterator[str]:
+    """
+    Streaming variant of _chat_json: yields the raw JSON text as it arrives (a cached
+    response comes out as a single chunk). The complete response is cached if it parses.
+    """
+    cache = get_llm_cache()
+    key = make_key(LLM_MODEL, system_prompt, user_content, temperature)
+    content = await cache.get(key)
+    if content is not None:
+        LLM_CALLS.labels("cache_hit").inc()
+        yield content
+        return
+
+    governor = get_governor()
+    governor.check_user()
+    parts = []
+    # The slot is held until the whole stream has been read
+    async with governor.slot():
+        stream = await get_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content}
+            ],
+            response_format={"type": "json_object"},
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        LLM_CALLS.labels("upstream").inc()
+        async for chunk in stream:
+            # The last chunk carries the token usage and no choices
+            record_llm_usage(getattr(chunk, "usage", None))
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    content = "".join(parts)
+    json.loads(content)
+    await cache.set(key, content)
+
+_PARTIAL_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{0,3})?$')
+
+def partial_json_strings(buffer: str, keys: Tuple[str, ...]) -> Dict[str, str]:
+    """
+    Decoded (possibly still incomplete) string values of the given top-level keys of a
+    JSON object that is still being streamed. Keys whose value has not started, or is
+    not a string, are left out.
+    """
+    values = {}
+    for key in keys:
+        match = re.search(r'"%s"\s*:\s*"' % re.escape(key), buffer)
+        if not match:
+            continue
+        i = match.end()
+        raw_end = i
+        while raw_end < len(buffer) and buffer[raw_end] != '"':
+            raw_end += 2 if buffer[raw_end] == "\\" else 1
+        raw = buffer[i:min(raw_end, len(buffer))]
+        # Drop an escape sequence that is cut off at the end of the buffer
+        raw = _PARTIAL_ESCAPE.sub("", raw) if raw_end >= len(buffer) else raw
+        try:
+            values[key] = json.loads(f'"{raw}"')
+        except ValueError:
+            pass
+    return values
+
+async def extract_symptoms(user_text: str, valid_symptoms: List[str]) -> List[str]:
     """
     Uses OpenAI to map user text to the list of valid symptoms.
     """
@@ -29,24 +224,16 @@ def extract_symptoms(user_text: str, valid_symptoms: List[str]) -> List[str]:
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_text}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0
-        )
-        
-        content = response.choices[0].message.content
-        data = json.loads(content)
+        data = await _chat_json(system_prompt, user_text, temperature=0.0)
         return data.get("symptoms", [])
+    except LLMOverloaded:
+        raise
     except Exception as e:
-        print(f"❌ Error in LLM symptom extraction: {e}")
+        LLM_CALLS.labels("error").inc()
+        logger.error("LLM symptom extraction failed", extra={"error": str(e)})
         return []
 
-def translate_diseases(diseases: List[str]) -> List[str]:
+async def translate_diseases(diseases: List[str]) -> List[str]:
     """
     Translates a list of disease names from English to Turkish using OpenAI.
     """
@@ -69,25 +256,16 @@ def translate_diseases(diseases: List[str]) -> List[str]:
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(diseases)}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0
-        )
-        
-        content = response.choices[0].message.content
-        data = json.loads(content)
+        data = await _chat_json(system_prompt, json.dumps(diseases), temperature=0.0)
         return data.get("translations", diseases) # Fallback to original if key missing
+    except LLMOverloaded:
+        raise
     except Exception as e:
-        print(f"❌ Error in LLM translation: {e}")
+        LLM_CALLS.labels("error").inc()
+        logger.error("LLM translation failed", extra={"error": str(e)})
         return diseases # Fallback to original on error
 
-def generate_advice(disease: str, symptoms: str) -> dict:
-    system_prompt = """
+ADVICE_PROMPT = """
     Sen uzman bir doktorsun. Hastanın semptomlarına ve olası teşhise göre kısa bir açıklama ve evde uygulanabilecek tavsiyeler ver.
     Yanıtın JSON formatında olmalı ve şu anahtarları içermeli:
     {
@@ -96,23 +274,47 @@ def generate_advice(disease: str, symptoms: str) -> dict:
     }
     Yanıtın Türkçe olsun.
     """
-    
+
+ADVICE_FALLBACK = {
+    "reasoning": "Detaylı analiz oluşturulamadı.",
+    "advice": "Lütfen bir sağlık kuruluşuna başvurun."
+}
+
+async def generate_advice(disease: str, symptoms: str) -> dict:
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Teşhis: {disease}\nSemptomlar: {symptoms}"}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.7
-        )
-        
-        content = response.choices[0].message.content
-        return json.loads(content)
+        return await _chat_json(ADVICE_PROMPT, f"Teşhis: {disease}\nSemptomlar: {symptoms}", temperature=0.7)
+    except LLMOverloaded:
+        raise
     except Exception as e:
-        print(f"❌ Error in LLM advice generation: {e}")
-        return {
-            "reasoning": "Detaylı analiz oluşturulamadı.",
-            "advice": "Lütfen bir sağlık kuruluşuna başvurun."
-        }
+        LLM_CALLS.labels("error").inc()
+        logger.error("LLM advice generation failed", extra={"error": str(e)})
+        return dict(ADVICE_FALLBACK)
+
+class AdviceStreamInterrupted(Exception):
+    """The advice stream failed after part of it was already sent."""
+
+async def generate_advice_stream(disease: str, symptoms: str) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Streams the advice as it is generated. Yields ("reasoning" | "advice", text delta) while
+    the string values grow, then ("done", advice dict) with the same content generate_advice returns.
+    A failure before the first delta yields the fallback advice; after it, the fallback would
+    be appended to partial text, so AdviceStreamInterrupted is raised instead.
+    """
+    buffer, sent = "", {}
+    try:
+        async for chunk in _chat_json_stream(ADVICE_PROMPT, f"Teşhis: {disease}\nSemptomlar: {symptoms}", temperature=0.7):
+            buffer += chunk
+            for key, value in partial_json_strings(buffer, ("reasoning", "advice")).items():
+                done = sent.get(key, "")
+                if len(value) > len(done):
+                    sent[key] = value
+                    yield key, value[len(done):]
+        yield "done", json.loads(buffer)
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        LLM_CALLS.labels("error").inc()
+        logger.error("LLM advice generation failed", extra={"error": str(e), "streamed": bool(sent)})
+        if sent:
+            raise AdviceStreamInterrupted("advice generation failed mid-stream") from e
+        yield "done", dict(ADVICE_FALLBACK)
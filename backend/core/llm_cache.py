@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from core.cache import TTLCache
+from core.config import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+# In-memory tier (per worker)
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "2048"))
+# Entry lifetime in seconds, for both tiers (0 = no expiry)
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Shared on-disk tier: a SQLite file all workers on the host read and write ("" disables it)
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(BASE_DIR, "llm_cache.db"))
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_DISK_MAX_ENTRIES", "100000"))
+# Run the disk tier's expiry/size pruning every this many writes
+PRUNE_EVERY = 500
+# A hit refreshes an entry's access time (the LRU order for pruning) at most once per this many seconds
+TOUCH_INTERVAL = 3600
+
+def make_key(model: str, system_prompt: str, user_content: str, temperature: float) -> str:
+    payload = json.dumps([model, system_prompt, user_content, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SQLiteCacheTier:
+    """Key/value table in a SQLite file (WAL mode) shared by all worker processes."""
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+            # Cross-worker single-flight: the worker holding a key's lease is making that upstream call
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_inflight ("
+                " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, accessed_at FROM llm_cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now),
+            ).fetchone()
+            # Hits are mostly reads; writing on each one would serialize the workers on the WAL lock
+            if row is not None and now - row[1] >= TOUCH_INTERVAL:
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("LLM cache read failed", extra={"error": str(e)})
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl if self.ttl else None, now),
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self.prune()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("LLM cache write failed", extra={"error": str(e)})
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """True if this owner now holds the key's in-flight lease (expired leases are taken over)."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("DELETE FROM llm_inflight WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO llm_inflight (key, owner, expires_at) VALUES (?, ?, ?)",
+                                  (key, owner, now + ttl))
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("LLM in-flight lease failed", extra={"error": str(e)})
+            return True  # Behave as if nothing else were in flight
+
+    def release_lease(self, key: str, owner: str):
+        try:
+            self._conn().execute("DELETE FROM llm_inflight WHERE key = ? AND owner = ?", (key, owner))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("LLM in-flight lease release failed", extra={"error": str(e)})
+
+    def poll(self, key: str) -> Tuple[Optional[str], bool]:
+        """(cached value, whether a live lease is still held) for a key, without touching the stats."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+            ).fetchone()
+            leased = conn.execute(
+                "SELECT 1 FROM llm_inflight WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error:
+            return None, False
+        return (row[0] if row else None), leased is not None
+
+    def prune(self):
+        """Drops expired entries, then the least recently used ones above max_entries."""
+        conn = self._conn()
+        conn.execute("DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class LLMResponseCache:
+    """
+    Two-tier cache of raw LLM responses: an in-memory LRU per worker in front of
+    a SQLite tier shared by the workers on the host. Disk access runs in a thread.
+    """
+
+    def __init__(self):
+        self.memory = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+        self.disk = SQLiteCacheTier(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_DISK_MAX_ENTRIES) if LLM_CACHE_PATH else None
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    def stats(self) -> Dict:
+        return {"memory": self.memory.stats(), "disk": self.disk.stats() if self.disk else None}
+
+_llm_cache: Optional[LLMResponseCache] = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMResponseCache:
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResponseCache()
+    return _llm_cache
@@ -0,0 +1,99 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+# DEBUG, INFO, WARNING, ERROR or OFF
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Share of DEBUG/INFO records that are written (warnings and errors are always kept)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = {k: v for k, v in vars(record).items() if k not in _RESERVED}
+        return f"{line} {json.dumps(extra, ensure_ascii=False, default=str)}" if extra else line
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+_records = None
+_listener = None
+_listener_pid = None
+
+def setup_logging():
+    """
+    Configures the root logger once per process. Records are formatted and written to
+    stdout by a background thread (QueueHandler/QueueListener), so request handlers never
+    block on stdout.
+    """
+    global _records
+    if _records is not None:
+        return
+    root = logging.getLogger()
+    if LOG_LEVEL == "OFF":
+        logging.disable(logging.CRITICAL)
+        return
+
+    _records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(_records)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    # The OpenAI client logs every HTTP request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    start_log_listener()
+    atexit.register(stop_log_listener)
+
+def start_log_listener():
+    """
+    Starts the thread that writes queued records, unless this process already runs it.
+    A forked worker (gunicorn preload) inherits the queue but not the parent's thread, so
+    it calls this again (main.py's lifespan); records logged meanwhile wait in the queue.
+    """
+    global _listener, _listener_pid
+    if _records is None or _listener_pid == os.getpid():
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(_records, stream, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+def stop_log_listener():
+    """Writes the remaining queued records and stops this process's listener thread."""
+    global _listener, _listener_pid
+    if _listener is None or _listener_pid != os.getpid():
+        return
+    _listener.stop()
+    _listener, _listener_pid = None, None
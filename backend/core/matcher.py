@@ -0,0 +1,150 @@
+import difflib
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from core.llm import extract_symptoms
+from core.retrieval import candidate_symptoms
+from core.text import STOPWORDS, is_negation, load_synonyms, normalize
+
+# Minimum confidence for the local matcher's result to be used instead of the LLM
+SYMPTOM_MATCH_THRESHOLD = float(os.environ.get("SYMPTOM_MATCH_THRESHOLD", "0.8"))
+# Minimum similarity for a misspelled word to count as a known word
+FUZZY_CUTOFF = 0.8
+# Shortest known word that may match as the stem of a longer (suffixed) word
+MIN_STEM_LENGTH = 4
+
+class SymptomMatcher:
+    """
+    Local symptom extractor: a token n-gram index over symptom names and synonyms,
+    with stem and fuzzy matching of single words.
+
+    match() returns the found symptoms and a confidence: the share of non-filler words
+    explained by a symptom phrase, weighted by how exactly those words matched. A negation
+    outside the matched phrases ("öksürüğüm yok") sets the confidence to 0, since the
+    matcher cannot tell which symptom it denies.
+    """
+
+    def __init__(self, symptom_names: Sequence[str], synonyms: Dict[str, List[str]]):
+        self.symptom_names = symptom_names
+        self.phrases: Dict[Tuple[str, ...], str] = {}
+        known = set(symptom_names)
+        for name in symptom_names:
+            self._add(name, name)
+        for name, variants in synonyms.items():
+            if name in known:
+                for variant in variants:
+                    self._add(variant, name)
+
+        self.max_len = max((len(p) for p in self.phrases), default=0)
+        self.vocabulary = {t for phrase in self.phrases for t in phrase if t not in STOPWORDS}
+        self._by_initial: Dict[str, List[str]] = {}
+        for token in self.vocabulary:
+            self._by_initial.setdefault(token[0], []).append(token)
+        self._token_cache: Dict[str, Optional[Tuple[str, float]]] = {}
+
+        self._stats_lock = threading.Lock()
+        self.counts = {"local": 0, "llm": 0}
+
+    def _add(self, phrase: str, symptom: str):
+        tokens = tuple(normalize(phrase))
+        if tokens:
+            self.phrases.setdefault(tokens, symptom)
+
+    def _match_token(self, token: str) -> Optional[Tuple[str, float]]:
+        """Maps a word to a known word: exact, known stem (Turkish suffixes) or fuzzy."""
+        if token in self.vocabulary:
+            return token, 1.0
+        if token in self._token_cache:
+            return self._token_cache[token]
+
+        candidates = self._by_initial.get(token[0], [])
+        stems = [v for v in candidates if len(v) >= MIN_STEM_LENGTH and token.startswith(v)]
+        if stems:
+            result = (max(stems, key=len), 0.9)
+        else:
+            close = difflib.get_close_matches(token, candidates, n=1, cutoff=FUZZY_CUTOFF)
+            result = (close[0], difflib.SequenceMatcher(None, token, close[0]).ratio()) if close else None
+
+        if len(self._token_cache) < 50000:
+            self._token_cache[token] = result
+        return result
+
+    def match(self, text: str) -> Tuple[List[str], float]:
+        tokens = normalize(text or "")
+        content = [i for i, t in enumerate(tokens) if t not in STOPWORDS]
+        if not content:
+            return [], 0.0
+
+        resolved = []
+        for token in tokens:
+            if token in STOPWORDS:
+                resolved.append((token, 1.0))
+            else:
+                resolved.append(self._match_token(token) or (token, 0.0))
+
+        symptoms, covered, similarities = [], set(), []
+        i = 0
+        while i < len(tokens):
+            for length in range(min(self.max_len, len(tokens) - i), 0, -1):
+                symptom = self.phrases.get(tuple(t for t, _ in resolved[i:i + length]))
+                if symptom is not None:
+                    if symptom not in symptoms:
+                        symptoms.append(symptom)
+                    span = range(i, i + length)
+                    covered.update(span)
+                    similarities.append(min(resolved[j][1] for j in span))
+                    i += length
+                    break
+            else:
+                i += 1
+
+        if not symptoms:
+            return [], 0.0
+        # Phrases like "iştahım yok" (decreased appetite) carry their own negation; a negated
+        # word that only matched a symptom by stem ("ateşsizim" -> "ateş") does not count
+        exact = {i for i in covered if resolved[i][0] == tokens[i]}
+        if any(is_negation(tokens, i) for i in range(len(tokens)) if i not in exact):
+            return symptoms, 0.0
+        coverage = sum(1 for i in content if i in covered) / len(content)
+        return symptoms, coverage * sum(similarities) / len(similarities)
+
+    def record(self, path: str):
+        with self._stats_lock:
+            self.counts[path] += 1
+
+    def stats(self) -> Dict:
+        total = sum(self.counts.values())
+        return {**self.counts, "local_rate": self.counts["local"] / total if total else 0.0,
+                "threshold": SYMPTOM_MATCH_THRESHOLD}
+
+_matcher: Optional[SymptomMatcher] = None
+_matcher_lock = threading.Lock()
+
+def get_symptom_matcher(symptom_names: Sequence[str]) -> SymptomMatcher:
+    """Matcher for the given symptom list; rebuilt only when the model's symptom list changes."""
+    global _matcher
+    if _matcher is None or _matcher.symptom_names is not symptom_names:
+        with _matcher_lock:
+            if _matcher is None or _matcher.symptom_names is not symptom_names:
+                counts = _matcher.counts if _matcher else None
+                _matcher = SymptomMatcher(symptom_names, load_synonyms())
+                if counts:
+                    _matcher.counts = counts
+    return _matcher
+
+async def extract_symptoms_fast(user_text: str, valid_symptoms: Sequence[str]) -> Tuple[List[str], str, float]:
+    """
+    Extracts symptoms locally when the matcher is confident enough, otherwise via the LLM.
+    Returns (symptoms, path, confidence) where path is "local" or "llm".
+    """
+    matcher = get_symptom_matcher(valid_symptoms)
+    symptoms, confidence = matcher.match(user_text)
+    if symptoms and confidence >= SYMPTOM_MATCH_THRESHOLD:
+        path = "local"
+    else:
+        candidates = candidate_symptoms(user_text, valid_symptoms, found=symptoms)
+        symptoms = await extract_symptoms(user_text, candidates)
+        path = "llm"
+    matcher.record(path)
+    return symptoms, path, confidence
@@ -0,0 +1,135 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, TypeVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Set (to an empty, writable directory) when running several gunicorn workers, so
+# counters and histograms are aggregated over all of them
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "diagnosis_stage_seconds", "Time spent in each stage of a diagnosis",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the last body byte)",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+# outcome: cache_hit, upstream, coalesced, rejected (governor) or error
+LLM_CALLS = Counter("llm_calls_total", "LLM completions by outcome", ["outcome"])
+# kind: prompt or completion
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens used by upstream LLM calls", ["kind"])
+
+T = TypeVar("T")
+
+@contextmanager
+def stage(name: str):
+    """Records the block's duration in diagnosis_stage_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+async def timed(name: str, awaitable: Awaitable[T]) -> T:
+    """stage() for one awaitable, so concurrently awaited stages are timed separately."""
+    with stage(name):
+        return await awaitable
+
+async def timed_iter(name: str, iterator: AsyncIterator[T]) -> AsyncIterator[T]:
+    """
+    stage() for an async iterator: records only the time spent waiting for its items, not
+    the time the consumer takes between them (e.g. a client reading a stream).
+    """
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        STAGE_SECONDS.labels(name).observe(elapsed)
+
+def record_llm_usage(usage):
+    if usage is not None:
+        LLM_TOKENS.labels("prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+        LLM_TOKENS.labels("completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+class CacheStatsCollector:
+    """
+    Exposes the in-process caches' own counters (their stats() dicts) at scrape time.
+    These are per worker, also in multiprocess mode.
+    """
+
+    def __init__(self):
+        self.sources: Dict[str, Callable[[], Dict]] = {}
+
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        evictions = CounterMetricFamily("cache_evictions", "Cache evictions (expired or over capacity)", labels=["cache"])
+        hit_rate = GaugeMetricFamily("cache_hit_rate", "Cache hit rate since start", labels=["cache"])
+        entries = GaugeMetricFamily("cache_entries", "Entries currently cached", labels=["cache"])
+        for name, source in self.sources.items():
+            try:
+                stats = source()
+            except Exception:
+                continue  # e.g. the model is not loaded yet
+            if stats is None:
+                continue
+            for family, key in ((hits, "hits"), (misses, "misses"), (evictions, "evictions"),
+                                (hit_rate, "hit_rate"), (entries, "size")):
+                if key in stats:
+                    family.add_metric([name], stats[key])
+        yield from (hits, misses, evictions, hit_rate, entries)
+
+_cache_stats = CacheStatsCollector()
+REGISTRY.register(_cache_stats)
+
+def register_cache_stats(name: str, source: Callable[[], Dict]):
+    _cache_stats.sources[name] = source
+
+def render_metrics() -> bytes:
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(_cache_stats)
+    return generate_latest(registry)
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and their latency per route template (not raw path)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUESTS.labels(scope["method"], path, str(status)).inc()
+            REQUEST_SECONDS.labels(scope["method"], path).observe(time.perf_counter() - start)
@@ -1,62 +1,152 @@
 import joblib
-import numpy as np
+import logging
 import os
-from typing import List, Dict, Tuple
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+from core.cache import TTLCache
+from core.config import ASSETS_DIR
+from core.engine import MANIFEST_NAME, NaiveBayesEngine, load_artifact, read_manifest
+
+logger = logging.getLogger(__name__)
 
 # Paths
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-ASSETS_DIR = os.path.join(BASE_DIR, "assets")
 MODEL_PATH = os.path.join(ASSETS_DIR, "trained_model.joblib")
 SYMPTOMS_PATH = os.path.join(ASSETS_DIR, "symptom_names.joblib")
+# Pickle-free export written by train_model.py; preferred over the joblib files when present
+ARTIFACT_DIR = os.path.join(ASSETS_DIR, "nb_model")
+ARTIFACT_MANIFEST = os.path.join(ARTIFACT_DIR, MANIFEST_NAME)
+
+# Prediction cache settings (size 0 disables the cache, TTL 0 means no expiry)
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+# How often (seconds) to check whether the model files on disk have changed
+MODEL_CHECK_INTERVAL = float(os.environ.get("MODEL_CHECK_INTERVAL", "10"))
+
+def artifact_fingerprint(paths: List[str]) -> Tuple:
+    """(mtime, size) of each artifact file; changes whenever a file is replaced."""
+    fingerprint = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            fingerprint.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
 
 class DiseaseClassifier:
-    def __init__(self):
+    def __init__(self, model_path: str = MODEL_PATH, symptoms_path: str = SYMPTOMS_PATH,
+                 artifact_dir: str = ARTIFACT_DIR):
+        # Defaults are the backend's assets; the Streamlit app passes the files train_model.py writes
+        self.model_path = model_path
+        self.symptoms_path = symptoms_path
+        self.artifact_dir = artifact_dir
+        self.artifact_manifest = os.path.join(artifact_dir, MANIFEST_NAME)
         self.model = None
         self.symptom_names = []
+        self.engine = None
+        self.classes = []
+        self.version = None
+        self.fingerprint = None
+        self.cache = TTLCache(maxsize=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+        self._reload_lock = threading.Lock()
+        self._next_check = 0.0
         self.load_model()
 
+    def artifact_paths(self) -> List[str]:
+        return [self.artifact_manifest, self.model_path, self.symptoms_path]
+
+    def manifest_version(self) -> Optional[str]:
+        try:
+            return read_manifest(self.artifact_dir)["version"]
+        except (OSError, ValueError):
+            return None
+
     def load_model(self):
-        """Loads the pre-trained model and symptom names."""
+        """
+        Loads the pre-trained model and symptom names.
+        Uses the memory-mapped numpy artifact if it exists, otherwise the joblib files.
+        """
         try:
-            self.model = joblib.load(MODEL_PATH)
-            self.symptom_names = joblib.load(SYMPTOMS_PATH)
-            print("✅ Model and assets loaded successfully.")
+            fingerprint = artifact_fingerprint(self.artifact_paths())
+            if os.path.exists(self.artifact_manifest):
+                self.engine, manifest = load_artifact(self.artifact_dir, mmap=True)
+                self.model = None
+                self.version = manifest["version"]
+            else:
+                self.model = joblib.load(self.model_path)
+                self.engine = NaiveBayesEngine.from_estimator(self.model, joblib.load(self.symptoms_path))
+                self.version = "joblib"
+            self.symptom_names = self.engine.symptom_names
+            self.classes = list(self.engine.classes)
+            self.fingerprint = fingerprint
+            self.cache.clear()
+            logger.info("model loaded", extra={"version": self.version})
         except Exception as e:
-            print(f"❌ Error loading model: {e}")
+            logger.error("model loading failed", extra={"error": str(e)})
             raise e
 
+    def reload_if_changed(self):
+        """Reloads the model (and drops cached predictions) if the files on disk changed."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._reload_lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + MODEL_CHECK_INTERVAL
+            fingerprint = artifact_fingerprint(self.artifact_paths())
+            if fingerprint != self.fingerprint:
+                if self.manifest_version() == self.version:
+                    # Only manifest fields changed (e.g. the learner's watermark), the arrays are the same
+                    self.fingerprint = fingerprint
+                    return
+                logger.info("model artifact changed on disk, reloading")
+                try:
+                    self.load_model()
+                except Exception:
+                    pass  # Keep serving the previously loaded model
+
     def predict(self, selected_symptoms: List[str], top_k: int = 5) -> Tuple[List[Dict], float]:
         """
         Predicts diseases based on the list of selected symptoms.
+        Results are cached per canonical (sorted, deduplicated) symptom set and top_k.
         """
-        if not self.model or not self.symptom_names:
+        if not self.engine:
             raise ValueError("Model not loaded.")
 
-        # Create input vector
-        symptom_vector = np.zeros(len(self.symptom_names))
-        for symptom in selected_symptoms:
-            if symptom in self.symptom_names:
-                idx = self.symptom_names.index(symptom)
-                symptom_vector[idx] = 1
-        
-        # Predict
-        probabilities = self.model.predict_proba([symptom_vector])[0]
-        disease_classes = self.model.classes_
-        
-        results = []
-        for disease, prob in zip(disease_classes, probabilities):
-            if prob > 0.0: # Filter out zero probabilities
-                results.append({
-                    'disease': disease,
-                    'probability': float(prob * 100),
-                    'probability_str': f"%{prob * 100:.1f}"
-                })
-        
-        # Sort and get top K
-        results = sorted(results, key=lambda x: x['probability'], reverse=True)[:top_k]
-        max_prob = results[0]['probability'] if results else 0.0
-        
-        return results, max_prob
-
-# Singleton instance
-classifier = DiseaseClassifier()
+        self.reload_if_changed()
+        engine = self.engine
+        key = (tuple(sorted({s for s in selected_symptoms if s in engine.symptom_index})), top_k)
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = engine.predict(key[0], top_k)
+            self.cache.set(key, cached)
+
+        # Callers may modify the result dicts (e.g. translated names), so hand out copies
+        results, max_prob = cached
+        return [dict(r) for r in results], max_prob
+
+    def predict_batch(self, symptom_lists: List[List[str]], top_k: int = 5) -> List[Tuple[List[Dict], float]]:
+        """
+        Predicts diseases for many symptom lists in a single vectorized pass.
+        Returns one (results, max_prob) pair per input list, in order.
+        """
+        if not self.engine:
+            raise ValueError("Model not loaded.")
+
+        self.reload_if_changed()
+        return self.engine.predict_batch(symptom_lists, top_k)
+
+# Singleton instance, created on first use (or preloaded by gunicorn.conf.py)
+_classifier = None
+_classifier_lock = threading.Lock()
+
+def get_classifier() -> DiseaseClassifier:
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = DiseaseClassifier()
+    return _classifier
@@ -0,0 +1,71 @@
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from core.text import load_synonyms, normalize
+
+# Number of candidate symptoms sent to the LLM (0 sends the full list). Off by default: held-out
+# recall is 72% at 40 and only reaches 100% with the full list (eval_retrieval.py)
+SYMPTOM_CANDIDATES = int(os.environ.get("SYMPTOM_CANDIDATES", "0"))
+
+class SymptomRetriever:
+    """
+    Ranks model symptoms against free text with a character n-gram TF-IDF index.
+
+    Each symptom is one document made of its name and its synonyms, so Turkish
+    wording can still retrieve the English symptom name. Built once, queried in memory.
+    """
+
+    def __init__(self, symptom_names: Sequence[str], synonyms: Dict[str, List[str]]):
+        self.symptom_names = symptom_names
+        documents = []
+        for name in symptom_names:
+            variants = [name] + synonyms.get(name, [])
+            documents.append(" | ".join(" ".join(normalize(v)) for v in variants))
+
+        self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 4), sublinear_tf=True)
+        # (n_symptoms, n_ngrams), rows L2-normalized, so a dot product is a cosine similarity
+        self.matrix = self.vectorizer.fit_transform(documents).tocsr()
+
+    def scores(self, text: str) -> np.ndarray:
+        query = self.vectorizer.transform([" ".join(normalize(text or ""))])
+        return (self.matrix @ query.T).toarray().ravel()
+
+    def top_n(self, text: str, n: int = SYMPTOM_CANDIDATES) -> List[str]:
+        """The n symptoms most similar to the text, best first."""
+        if n <= 0 or n >= len(self.symptom_names):
+            return list(self.symptom_names)
+        scores = self.scores(text)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.symptom_names[i] for i in top]
+
+_retriever: Optional[SymptomRetriever] = None
+_retriever_lock = threading.Lock()
+
+def get_symptom_retriever(symptom_names: Sequence[str]) -> SymptomRetriever:
+    """Retriever for the given symptom list; rebuilt only when the model's symptom list changes."""
+    global _retriever
+    if _retriever is None or _retriever.symptom_names is not symptom_names:
+        with _retriever_lock:
+            if _retriever is None or _retriever.symptom_names is not symptom_names:
+                _retriever = SymptomRetriever(symptom_names, load_synonyms())
+    return _retriever
+
+def candidate_symptoms(user_text: str, symptom_names: Sequence[str], found: Sequence[str] = ()) -> List[str]:
+    """
+    Candidate list for the LLM prompt: symptoms the local matcher already found,
+    followed by the best retrieval hits.
+    """
+    if SYMPTOM_CANDIDATES <= 0:
+        return list(symptom_names)
+    candidates = list(found)
+    for name in get_symptom_retriever(symptom_names).top_n(user_text, SYMPTOM_CANDIDATES):
+        if len(candidates) >= SYMPTOM_CANDIDATES:
+            break
+        if name not in candidates:
+            candidates.append(name)
+    return candidates
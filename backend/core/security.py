@@ -1,32 +1,171 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass
+from typing import Dict, Optional
 from supabase import create_client, Client
 from fastapi import HTTPException, status
+from jose import jwt
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+from core.cache import TTLCache
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("⚠️ Supabase credentials missing in environment variables!")
+logger = logging.getLogger(__name__)
 
-# Initialize Supabase Client
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    print(f"Failed to initialize Supabase client: {e}")
-    supabase = None
+# Local JWT verification: HS256 tokens need the project's JWT secret, asymmetric
+# tokens (RS256/ES256) are checked against the project's JWKS, fetched and cached.
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_TTL = float(os.environ.get("SUPABASE_JWKS_TTL", "3600"))
+# Ask Supabase (network round trip) when a token cannot be verified locally
+AUTH_REMOTE_FALLBACK = os.environ.get("AUTH_REMOTE_FALLBACK", "1") == "1"
+# Verified tokens are remembered this long (never beyond their expiry)
+AUTH_TOKEN_CACHE_TTL = float(os.environ.get("AUTH_TOKEN_CACHE_TTL", "60"))
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
 
-def verify_supabase_token(token: str):
+_supabase: Optional[Client] = None
+_supabase_lock = threading.Lock()
+
+def get_supabase() -> Optional[Client]:
+    """Supabase client, created on first use. Returns None if it cannot be initialized."""
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                url = os.environ.get("SUPABASE_URL")
+                key = os.environ.get("SUPABASE_KEY")
+                if not url or not key:
+                    logger.warning("Supabase credentials missing in environment variables")
+                try:
+                    _supabase = create_client(url, key)
+                except Exception as e:
+                    logger.error("failed to initialize Supabase client", extra={"error": str(e)})
+    return _supabase
+
+@dataclass(frozen=True)
+class VerifiedUser:
+    id: str
+    email: Optional[str]
+
+class LocalVerificationUnavailable(Exception):
+    """The token uses a key or algorithm this process cannot check on its own."""
+
+class JWKSRefreshNeeded(LocalVerificationUnavailable):
+    """The cached JWKS is stale or lacks the token's key, so checking it needs a (blocking) fetch."""
+
+_token_cache = TTLCache(maxsize=AUTH_TOKEN_CACHE_SIZE, ttl=AUTH_TOKEN_CACHE_TTL)
+_jwks: Dict[str, dict] = {}
+_jwks_fetched_at = 0.0
+_jwks_lock = threading.Lock()
+
+def _fetch_jwks(force: bool = False) -> Dict[str, dict]:
+    """Signing keys by kid, cached for JWKS_TTL (refetched at most every 60s on unknown kids)."""
+    global _jwks, _jwks_fetched_at
+    age = time.time() - _jwks_fetched_at
+    if _jwks and age < JWKS_TTL and not (force and age > 60):
+        return _jwks
+    url = os.environ.get("SUPABASE_URL")
+    if not url:
+        raise LocalVerificationUnavailable("SUPABASE_URL not set, cannot fetch JWKS")
+    with _jwks_lock:
+        try:
+            with urllib.request.urlopen(f"{url.rstrip('/')}/auth/v1/.well-known/jwks.json", timeout=5) as resp:
+                keys = json.load(resp).get("keys", [])
+        except Exception as e:
+            raise LocalVerificationUnavailable(f"JWKS fetch failed: {e}")
+        _jwks = {k.get("kid"): k for k in keys}
+        _jwks_fetched_at = time.time()
+    return _jwks
+
+def _cached_jwks_key(kid: Optional[str]) -> dict:
+    if _jwks and time.time() - _jwks_fetched_at < JWKS_TTL and kid in _jwks:
+        return _jwks[kid]
+    raise JWKSRefreshNeeded(f"Signing key {kid} is not cached")
+
+def _verify_locally(token: str, fetch: bool = True) -> dict:
+    """
+    Checks signature, expiry and audience. Raises JWTError for invalid tokens.
+    Without fetch only cached signing keys are used (JWKSRefreshNeeded otherwise).
+    """
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get("alg")
+    if algorithm == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            raise LocalVerificationUnavailable("SUPABASE_JWT_SECRET not set")
+        key = SUPABASE_JWT_SECRET
+    elif algorithm in ("RS256", "ES256"):
+        kid = header.get("kid")
+        if not fetch:
+            key = _cached_jwks_key(kid)
+        else:
+            key = _fetch_jwks().get(kid) or _fetch_jwks(force=True).get(kid)
+            if key is None:
+                raise LocalVerificationUnavailable(f"Unknown signing key {kid}")
+    else:
+        raise LocalVerificationUnavailable(f"Unsupported algorithm {algorithm}")
+    return jwt.decode(token, key, algorithms=[algorithm], audience=SUPABASE_JWT_AUDIENCE)
+
+def _verify_remotely(token: str) -> VerifiedUser:
+    supabase = get_supabase()
     if not supabase:
         raise HTTPException(status_code=500, detail="Supabase client not initialized")
-        
+    # Verify the token by getting the user
+    user = supabase.auth.get_user(token).user
+    return VerifiedUser(id=str(user.id), email=user.email)
+
+async def verify_supabase_token(token: str) -> VerifiedUser:
+    """
+    Verifies a Supabase access token and returns its user.
+    Uses the token cache, then local JWT verification, then (optionally) Supabase itself.
+    The JWKS refresh and the Supabase call block, so they run in a thread.
+    """
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = _token_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        # Verify the token by getting the user
-        user_response = supabase.auth.get_user(token)
-        return user_response
+        try:
+            try:
+                claims = _verify_locally(token, fetch=False)
+            except JWKSRefreshNeeded:
+                claims = await asyncio.to_thread(_verify_locally, token)
+            user = VerifiedUser(id=str(claims.get("sub")), email=claims.get("email"))
+            ttl = min(AUTH_TOKEN_CACHE_TTL, claims.get("exp", 0) - time.time())
+        except LocalVerificationUnavailable as e:
+            if not AUTH_REMOTE_FALLBACK:
+                raise
+            logger.info("local token verification unavailable, asking Supabase", extra={"reason": str(e)})
+            user = await asyncio.to_thread(_verify_remotely, token)
+            ttl = AUTH_TOKEN_CACHE_TTL
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Token verification failed: {e}")
+        logger.info("token verification failed", extra={"error": str(e)})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    if ttl > 0:
+        _token_cache.set(cache_key, user, ttl=ttl)
+    return user
+
+def init_auth():
+    """
+    Readiness check: tokens can be verified locally or through Supabase. Also prefetches
+    the JWKS, so the first requests with asymmetric tokens do not wait for it.
+    """
+    try:
+        _fetch_jwks()
+    except LocalVerificationUnavailable as e:
+        if not SUPABASE_JWT_SECRET and not AUTH_REMOTE_FALLBACK:
+            raise
+        logger.info("JWKS not prefetched", extra={"reason": str(e)})
+    if not SUPABASE_JWT_SECRET and AUTH_REMOTE_FALLBACK and get_supabase() is None:
+        raise RuntimeError("Supabase client not initialized")
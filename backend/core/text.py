@@ -0,0 +1,53 @@
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List
+
+from core.config import ASSETS_DIR
+
+# Shared text normalization for the local symptom matcher and retriever
+
+# Turkish/English synonyms for model symptom names
+SYNONYMS_PATH = os.path.join(ASSETS_DIR, "symptom_synonyms.json")
+
+_FOLD = str.maketrans("çğıöşüâîû", "cgiosuaiu")
+
+# Filler words (already folded) that do not need to be explained by a symptom
+STOPWORDS = {
+    "i", "im", "ive", "have", "has", "had", "a", "an", "the", "and", "or", "but", "my", "me",
+    "with", "of", "in", "on", "at", "for", "to", "is", "am", "are", "was", "been", "some",
+    "very", "really", "severe", "mild", "bad", "lot", "since", "day", "days", "week", "weeks",
+    "also", "feel", "feeling", "get", "getting", "keep", "it", "this", "that", "all", "time",
+    "ve", "ile", "bir", "cok", "biraz", "var", "da", "de", "ben", "benim", "bende",
+    "gibi", "daha", "en", "sonra", "beri", "gun", "gundur", "hafta", "haftadir", "ayrica",
+    "oldu", "oluyor", "hissediyorum", "siddetli", "hafif", "surekli", "sik", "arada", "bazen",
+    "ayni", "zamanda", "dun", "bugun", "sabah", "aksam", "gece", "geceleri", "mi", "mu",
+}
+
+# Negations (already folded). Filler-like, but they turn the symptom next to them around, so
+# a text with a negation the symptom phrases do not account for always goes to the LLM.
+NEGATORS = {"yok", "degil", "no", "not", "without", "never", "none", "nor", "neither", "deny", "denies"}
+# Turkish negated forms: -sız/-siz/-suz/-süz ("ateşsiz"), negative verbs ("ağrımıyor",
+# "gelmedi") and -madan/-meden ("öksürmeden")
+NEGATED_WORD = re.compile(r"\w\w(siz|suz)|\wm[iu]yor|\wm[ae]d[iu]|\wm[ae]d[ae]n$")
+
+def is_negation(tokens: List[str], i: int) -> bool:
+    """Whether the i-th normalized token negates something ("don't" normalizes to "don", "t")."""
+    token = tokens[i]
+    if token in NEGATORS or NEGATED_WORD.search(token):
+        return True
+    return token == "t" and i > 0 and tokens[i - 1].endswith("n")
+
+def normalize(text: str) -> List[str]:
+    """Lowercases (Turkish-aware), folds diacritics and splits into word tokens."""
+    text = text.replace("I", "ı").replace("İ", "i").lower().translate(_FOLD)
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return [t for t in re.findall(r"[a-z0-9]+", text) if not t.isdigit()]
+
+def load_synonyms(path: str = SYNONYMS_PATH) -> Dict[str, List[str]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,189 @@
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.metrics import precision_recall_fscore_support
+from sklearn.model_selection import StratifiedKFold
+from sklearn.naive_bayes import MultinomialNB
+from typing import Dict, List, Sequence, Tuple
+
+# Validation rows scored per matrix product (bounds the (rows x classes) buffer)
+SCORE_CHUNK_ROWS = 16384
+STATS_FORMAT = "model_stats/v1"
+
+
+def load_symptom_matrix(path: str) -> Tuple[sparse.csr_matrix, np.ndarray, List[str]]:
+    """
+    Reads the training parquet (disease column, then one 0/1 column per symptom) straight
+    into a CSR matrix, one column at a time, so the dense table is never materialized.
+    The pandas index that to_parquet stores as a column (__index_level_0__) is not read.
+    """
+    import pyarrow.parquet as pq  # Only needed for training (root requirements.txt)
+
+    schema = pq.read_schema(path)
+    pandas_index = {c for c in (schema.pandas_metadata or {}).get("index_columns", []) if isinstance(c, str)}
+    columns = [name for name in schema.names if name not in pandas_index and not name.startswith("__index_level_")]
+    table = pq.read_table(path, columns=columns)
+    symptom_names = table.column_names[1:]
+    y = np.asarray(table.column(0).to_pylist(), dtype=object)
+    rows, cols, values = [], [], []
+    for j, name in enumerate(symptom_names):
+        column = table.column(name).to_numpy()
+        nonzero = np.flatnonzero(column)
+        rows.append(nonzero)
+        cols.append(np.full(len(nonzero), j, dtype=np.int64))
+        values.append(column[nonzero].astype(np.int64))
+    X = sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(y), len(symptom_names)),
+    )
+    return X, y, symptom_names
+
+
+def count_matrix(X: sparse.csr_matrix, y_codes: np.ndarray, n_classes: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-class feature sums (classes x features) and class sizes, as MultinomialNB.fit computes them."""
+    Y = sparse.csr_matrix((np.ones(len(y_codes)), (y_codes, np.arange(len(y_codes)))),
+                          shape=(n_classes, len(y_codes)))
+    feature_count = np.asarray((Y @ X.astype(np.float64)).todense())
+    class_count = np.bincount(y_codes, minlength=n_classes).astype(np.float64)
+    return feature_count, class_count
+
+
+def log_probabilities(feature_count: np.ndarray, class_count: np.ndarray, alpha: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Closed-form MultinomialNB parameters for one alpha: (feature_log_prob, class_log_prior)."""
+    smoothed_fc = feature_count + alpha
+    smoothed_cc = smoothed_fc.sum(axis=1)
+    feature_log_prob = np.log(smoothed_fc) - np.log(smoothed_cc.reshape(-1, 1))
+    with np.errstate(divide="ignore"):  # A class missing from a fold is never predicted
+        class_log_prior = np.log(class_count) - np.log(class_count.sum())
+    return feature_log_prob, class_log_prior
+
+
+def model_from_counts(classes: Sequence, feature_count: np.ndarray, class_count: np.ndarray,
+                      alpha: float) -> MultinomialNB:
+    """A fitted MultinomialNB built from counts, identical to fitting it on the rows they came from."""
+    model = MultinomialNB(alpha=alpha)
+    model.classes_ = np.asarray(classes, dtype=object)
+    model.feature_count_ = np.asarray(feature_count, dtype=np.float64)
+    model.class_count_ = np.asarray(class_count, dtype=np.float64)
+    model.n_features_in_ = model.feature_count_.shape[1]
+    model.feature_log_prob_, model.class_log_prior_ = log_probabilities(model.feature_count_, model.class_count_, alpha)
+    return model
+
+
+class ScoringSet:
+    """
+    Validation rows collapsed to their distinct symptom patterns.
+
+    Binary symptom rows repeat a lot (SMOTE with integer inputs keeps them binary), so each
+    pattern is scored once and its accuracy contribution is weighted by how often each
+    label occurs with it.
+    """
+
+    def __init__(self, X: sparse.csr_matrix, y_codes: np.ndarray):
+        X = X.tocsr()
+        patterns: Dict[bytes, int] = {}
+        pattern_of_row = np.empty(X.shape[0], dtype=np.int64)
+        for i in range(X.shape[0]):
+            start, end = X.indptr[i], X.indptr[i + 1]
+            key = X.indices[start:end].tobytes() + X.data[start:end].tobytes()
+            pattern_of_row[i] = patterns.setdefault(key, len(patterns))
+        first_row = np.zeros(len(patterns), dtype=np.int64)
+        first_row[pattern_of_row[::-1]] = np.arange(X.shape[0])[::-1]
+
+        self.X = X[first_row].astype(np.float64)
+        # Distinct (pattern, label) pairs and how many rows have them
+        pairs, self.weights = np.unique(np.stack([pattern_of_row, y_codes]), axis=1, return_counts=True)
+        self.pair_pattern, self.pair_label = pairs
+        self.n_rows = X.shape[0]
+
+    def accuracy(self, feature_log_prob: np.ndarray, class_log_prior: np.ndarray) -> float:
+        predicted = np.empty(self.X.shape[0], dtype=np.int64)
+        for start in range(0, self.X.shape[0], SCORE_CHUNK_ROWS):
+            jll = self.X[start:start + SCORE_CHUNK_ROWS] @ feature_log_prob.T + class_log_prior
+            predicted[start:start + SCORE_CHUNK_ROWS] = jll.argmax(axis=1)
+        correct = self.weights[predicted[self.pair_pattern] == self.pair_label].sum()
+        return float(correct) / self.n_rows
+
+
+def _score(scoring: ScoringSet, feature_count: np.ndarray, class_count: np.ndarray, alpha: float) -> float:
+    return scoring.accuracy(*log_probabilities(feature_count, class_count, alpha))
+
+
+def alpha_sweep(X: sparse.csr_matrix, y_codes: np.ndarray, n_classes: int, alphas: Sequence[float],
+                n_splits: int = 3, n_jobs: int = -1) -> np.ndarray:
+    """
+    Cross-validated accuracy of MultinomialNB for every alpha, shape (n_splits, n_alphas).
+
+    Uses the same folds as GridSearchCV(cv=n_splits) (StratifiedKFold, no shuffle). The data
+    is counted once per fold block; a fold's training counts are the other blocks' sum, and
+    each alpha only re-derives the log-probabilities from them. (fold, alpha) pairs are scored
+    in parallel.
+    """
+    folds = [val for _, val in StratifiedKFold(n_splits=n_splits).split(np.zeros(len(y_codes)), y_codes)]
+    block_counts = [count_matrix(X[val], y_codes[val], n_classes) for val in folds]
+    total_fc = sum(fc for fc, _ in block_counts)
+    total_cc = sum(cc for _, cc in block_counts)
+    scoring_sets = [ScoringSet(X[val], y_codes[val]) for val in folds]
+
+    tasks = [
+        delayed(_score)(scoring_sets[k], total_fc - fc, total_cc - cc, alpha)
+        for k, (fc, cc) in enumerate(block_counts)
+        for alpha in alphas
+    ]
+    scores = Parallel(n_jobs=n_jobs)(tasks)
+    return np.array(scores, dtype=np.float64).reshape(n_splits, len(alphas))
+
+
+def train_naive_bayes(X: sparse.csr_matrix, y: np.ndarray, alphas: Sequence[float], n_splits: int = 3,
+                      n_jobs: int = -1) -> Tuple[MultinomialNB, float, np.ndarray]:
+    """
+    Selects alpha by cross-validation like GridSearchCV (highest mean accuracy, first on ties)
+    and returns (model refit on all rows, best alpha, per-fold scores).
+    """
+    classes, y_codes = np.unique(y, return_inverse=True)
+    scores = alpha_sweep(X, y_codes, len(classes), alphas, n_splits, n_jobs)
+    best_alpha = float(alphas[int(np.argmax(scores.mean(axis=0)))])
+    feature_count, class_count = count_matrix(X, y_codes, len(classes))
+    return model_from_counts(classes, feature_count, class_count, best_alpha), best_alpha, scores
+
+
+def model_stats(model: MultinomialNB, y: np.ndarray, X_test: sparse.csr_matrix, y_test: np.ndarray,
+                **extra) -> Dict:
+    """
+    Compact, JSON-serializable summary of the dataset and the model's test performance, so
+    dashboards never need the dataset itself: per-class counts and metrics (lists in
+    `classes` order) and the confusion matrix as its non-zero [true, predicted, count] cells.
+    """
+    classes = [str(c) for c in model.classes_]
+    y_pred = model.predict(X_test)
+    precision, recall, f1, support = precision_recall_fscore_support(y_test, y_pred, labels=model.classes_,
+                                                                     zero_division=0)
+    index = {c: i for i, c in enumerate(model.classes_)}
+    true_codes = np.array([index[c] for c in y_test])
+    pred_codes = np.array([index[c] for c in y_pred])
+    cells, counts = np.unique(np.stack([true_codes, pred_codes]), axis=1, return_counts=True)
+    class_counts = np.bincount([index[c] for c in y], minlength=len(classes))
+
+    def average(weights):
+        return {name: round(float(np.average(values, weights=weights)), 4)
+                for name, values in (("precision", precision), ("recall", recall), ("f1", f1))}
+
+    return {
+        "format": STATS_FORMAT,
+        **extra,
+        "accuracy": round(float((true_codes == pred_codes).mean()), 4),
+        "records": int(len(y)),
+        "test_records": int(len(y_test)),
+        "n_symptoms": int(model.n_features_in_),
+        "classes": classes,
+        "class_counts": class_counts.tolist(),
+        "per_class": {
+            "precision": np.round(precision, 4).tolist(),
+            "recall": np.round(recall, 4).tolist(),
+            "f1": np.round(f1, 4).tolist(),
+            "support": support.tolist(),
+        },
+        "macro_avg": average(None),
+        "weighted_avg": average(support) if support.sum() else average(None),
+        "confusion": np.column_stack([cells.T, counts]).tolist(),
+    }
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from core.llm import translate_diseases
+from core.config import ASSETS_DIR, BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Precomputed English -> Turkish disease names, built by build_translations.py (read-only at runtime)
+TRANSLATIONS_PATH = os.environ.get("TRANSLATIONS_PATH", os.path.join(ASSETS_DIR, "disease_translations.json"))
+# Names missing from the table that the LLM translated at runtime: a SQLite file shared by all
+# workers on the host ("" keeps them in memory only)
+TRANSLATIONS_LEARNED_PATH = os.environ.get("TRANSLATIONS_LEARNED_PATH", os.path.join(BASE_DIR, "translations_learned.db"))
+TABLE_FORMAT = "disease_translations/v1"
+
+class TranslationTable:
+    """
+    Versioned disease-name translation table stored as JSON next to the model assets.
+
+    Lookups are plain dict reads. The JSON file is only written by the offline builder
+    (update); translations learned at runtime go to a separate SQLite store instead (learn),
+    so serving never modifies the shipped asset.
+    """
+
+    def __init__(self, path: str = TRANSLATIONS_PATH, learned_path: str = TRANSLATIONS_LEARNED_PATH):
+        self.path = path
+        self.learned_path = learned_path
+        self.version = 0
+        self.translations: Dict[str, str] = {}
+        self.learned: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._reverse: Optional[Dict[str, Optional[str]]] = None
+        self._reverse_key = None
+        self.load()
+
+    def load(self):
+        data = self._read()
+        self.version = data.get("version", 0)
+        self.translations = data.get("translations", {})
+
+    def _read(self) -> Dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("could not read translation table", extra={"path": self.path, "error": str(e)})
+            return {}
+        if data.get("format") != TABLE_FORMAT:
+            logger.warning("ignoring translation table with unknown format", extra={"format": data.get("format")})
+            return {}
+        return data
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.learned_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS learned_translations ("
+                " name TEXT PRIMARY KEY, translated TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, names: List[str]) -> List[Optional[str]]:
+        """Table entries first, then learned ones (including those other workers learned)."""
+        found = [self.translations.get(name) or self.learned.get(name) for name in names]
+        missing = sorted({name for name, t in zip(names, found) if t is None})
+        if missing and self.learned_path:
+            try:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._conn().execute(
+                    f"SELECT name, translated FROM learned_translations WHERE name IN ({placeholders})", missing
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning("could not read learned translations", extra={"error": str(e)})
+                rows = []
+            if rows:
+                self.learned.update(rows)
+                found = [t if t is not None else self.learned.get(name) for name, t in zip(names, found)]
+        return found
+
+    def source_name(self, translated: str) -> Optional[str]:
+        """English name for a translated one (case-insensitive), or None if unknown or ambiguous."""
+        key = (self.version, len(self.learned))
+        if self._reverse_key != key or self._reverse is None:
+            reverse: Dict[str, Optional[str]] = {}
+            for name, t in {**self.learned, **self.translations}.items():
+                folded = t.casefold()
+                reverse[folded] = name if reverse.get(folded, name) == name else None
+            self._reverse, self._reverse_key = reverse, key
+        return self._reverse.get(translated.casefold())
+
+    def learn(self, new_translations: Dict[str, str]):
+        """
+        Stores runtime translations in the learned store. The first translation stored for a
+        name wins (INSERT OR IGNORE), so concurrent workers never overwrite each other.
+        """
+        if not new_translations:
+            return
+        if self.learned_path:
+            now = time.time()
+            self._conn().executemany(
+                "INSERT OR IGNORE INTO learned_translations (name, translated, created_at) VALUES (?, ?, ?)",
+                [(name, t, now) for name, t in new_translations.items()],
+            )
+        self.learned.update({name: t for name, t in new_translations.items() if name not in self.learned})
+
+    def update(self, new_translations: Dict[str, str]):
+        """Adds translations to the table file (offline builder) and bumps its version."""
+        if not new_translations:
+            return
+        with self._lock:
+            on_disk = self._read()
+            merged = {**on_disk.get("translations", {}), **self.translations, **new_translations}
+            version = max(self.version, on_disk.get("version", 0)) + 1
+            data = {"format": TABLE_FORMAT, "version": version, "source": "en", "target": "tr",
+                    "translations": dict(sorted(merged.items()))}
+
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+            self.translations = merged
+            self.version = version
+
+_table: Optional[TranslationTable] = None
+_table_lock = threading.Lock()
+
+def get_translation_table() -> TranslationTable:
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = TranslationTable()
+    return _table
+
+async def translate_disease_names(diseases: List[str]) -> List[str]:
+    """
+    Translates disease names via the precomputed table; only misses go to the LLM,
+    and their results are kept in the learned store.
+    """
+    table = get_translation_table()
+    translated = table.lookup(diseases)
+    misses = [name for name, t in zip(diseases, translated) if t is None]
+    if not misses:
+        return translated
+
+    logger.info("translation table miss, asking the LLM", extra={"misses": len(misses)})
+    llm_names = await translate_diseases(misses)
+    if len(llm_names) != len(misses):
+        llm_names = misses  # Unusable answer, keep the English names
+    # translate_diseases falls back to the input on errors, so unchanged names are not stored
+    learned = {name: t for name, t in zip(misses, llm_names) if isinstance(t, str) and t and t != name}
+    if learned:
+        try:
+            await asyncio.to_thread(table.learn, learned)
+        except Exception as e:
+            logger.warning("could not store learned translations", extra={"error": str(e)})
+
+    fallback = dict(zip(misses, llm_names))
+    return [t if t is not None else fallback[name] for name, t in zip(diseases, translated)]
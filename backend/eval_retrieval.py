@@ -0,0 +1,54 @@
+"""
+Recall/latency check for the candidate retrieval in front of extract_symptoms.
+
+    python eval_retrieval.py [--sizes 10 20 40 80]
+
+For each labeled sample, measures how many expected symptoms are inside the top-N
+candidates, and how long ranking takes. A symptom missing from the candidates can no
+longer be extracted by the LLM, so pick the smallest N whose recall is acceptable
+(SYMPTOM_CANDIDATES).
+
+assets/retrieval_samples.json was used to add missing synonyms to the lexicon, so its
+recall is optimistic. Choose N by the held-out set (assets/retrieval_holdout.json); never
+edit the lexicon to make held-out samples pass, add new samples instead.
+"""
+import argparse
+import json
+import os
+import time
+
+from core.config import ASSETS_DIR
+from core.model import get_classifier
+from core.retrieval import get_symptom_retriever
+
+SAMPLES_PATH = os.path.join(ASSETS_DIR, "retrieval_samples.json")
+HOLDOUT_PATH = os.path.join(ASSETS_DIR, "retrieval_holdout.json")
+
+def evaluate(sizes):
+    symptom_names = get_classifier().symptom_names
+    retriever = get_symptom_retriever(symptom_names)
+    for title, path in (("Tuning set (lexicon edited against it)", SAMPLES_PATH), ("Held-out set", HOLDOUT_PATH)):
+        with open(path, encoding="utf-8") as f:
+            samples = json.load(f)
+        print(f"== {title}: {os.path.basename(path)}")
+        report(samples, symptom_names, retriever, sizes)
+        print()
+
+def report(samples, symptom_names, retriever, sizes):
+    start = time.perf_counter()
+    rankings = [retriever.top_n(s["text"], len(symptom_names) - 1) for s in samples]
+    latency_ms = (time.perf_counter() - start) / len(samples) * 1000
+
+    expected_total = sum(len(s["symptoms"]) for s in samples)
+    print(f"{len(samples)} samples, {expected_total} expected symptoms, {len(symptom_names)} symptoms in model")
+    print(f"Ranking latency: {latency_ms:.2f} ms/query\n")
+    print(f"{'N':>5} {'recall':>8} {'all found':>10} {'prompt share':>13}")
+    for n in sizes:
+        hits = sum(len(set(s["symptoms"]) & set(r[:n])) for s, r in zip(samples, rankings))
+        complete = sum(set(s["symptoms"]) <= set(r[:n]) for s, r in zip(samples, rankings))
+        print(f"{n:>5} {hits / expected_total:>8.1%} {complete:>5}/{len(samples):<4} {n / len(symptom_names):>13.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20, 40, 80, 120])
+    evaluate(parser.parse_args().sizes)
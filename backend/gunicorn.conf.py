@@ -0,0 +1,33 @@
+import os
+
+# Used by start.sh: gunicorn -c gunicorn.conf.py main:app
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:10000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# With GUNICORN_PRELOAD=1 the master loads the model once before forking, so workers
+# start warm and share its memory. API clients and DB connections are always created
+# per worker (in the app lifespan), since they must not be shared across a fork.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+# Schema migrations run here, once in the master before any worker starts (workers only
+# check the schema). Set to 0 when a deploy step runs `python migrations.py` instead.
+migrate_on_start = os.environ.get("DB_MIGRATE_ON_START", "1") == "1"
+
+def on_starting(server):
+    if migrate_on_start:
+        from dotenv import load_dotenv
+        load_dotenv()
+        from database import engine
+        from migrations import migrate
+        migrate(engine)
+        engine.dispose()  # No pooled connections may be inherited by the workers
+    if preload_app:
+        from core.model import get_classifier
+        get_classifier()
+
+def child_exit(server, worker):
+    # Multiprocess Prometheus metrics: drop the exited worker's live gauges
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
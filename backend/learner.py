@@ -0,0 +1,267 @@
+"""
+Incremental learner: folds diagnoses confirmed by clinicians into the model's class/feature
+counts and publishes a new model artifact version, without retraining on the original data.
+
+    python learner.py            # one update
+    python learner.py --loop     # every LEARNER_INTERVAL seconds
+
+Run a single learner per deployment. Workers pick up a published version through
+DiseaseClassifier.reload_if_changed.
+"""
+import argparse
+import datetime
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import select, tuple_
+
+load_dotenv()
+
+from core.engine import MANIFEST_NAME, NaiveBayesEngine, prune_artifact, read_manifest, update_manifest, write_artifact
+from core.log import setup_logging
+from core.model import ARTIFACT_DIR, MODEL_PATH, SYMPTOMS_PATH
+from core.training import log_probabilities
+from database import SessionLocal
+import models
+
+logger = logging.getLogger(__name__)
+
+# Confirmed diagnoses whose id is a multiple of this are never learned; they are the held-out set
+LEARNER_HOLDOUT_MODULO = int(os.environ.get("LEARNER_HOLDOUT_MODULO", "10"))
+# Most recent held-out rows a candidate version is evaluated on (bounds the cost of the check)
+LEARNER_HOLDOUT_SIZE = int(os.environ.get("LEARNER_HOLDOUT_SIZE", "2000"))
+# Fewer held-out rows than this cannot vouch for a candidate, so nothing is published yet
+LEARNER_MIN_HOLDOUT = int(os.environ.get("LEARNER_MIN_HOLDOUT", "20"))
+# Largest held-out accuracy drop (absolute, e.g. 0.01 = one point) a candidate may have
+LEARNER_MAX_REGRESSION = float(os.environ.get("LEARNER_MAX_REGRESSION", "0.0"))
+# Confirmed rows folded in per update at most
+LEARNER_BATCH_SIZE = int(os.environ.get("LEARNER_BATCH_SIZE", "5000"))
+# Confirmations younger than this are left for the next update, so a slow transaction
+# committing an earlier confirmed_at is not skipped by the watermark
+LEARNER_SETTLE_SECONDS = float(os.environ.get("LEARNER_SETTLE_SECONDS", "60"))
+# Seconds between updates with --loop
+LEARNER_INTERVAL = float(os.environ.get("LEARNER_INTERVAL", "3600"))
+
+class ModelCounts:
+    """The published model as mutable arrays: raw counts plus the log-probabilities derived from them."""
+
+    def __init__(self, manifest: Dict, feature_count: np.ndarray, class_count: np.ndarray,
+                 feature_log_prob_t: np.ndarray, class_log_prior: np.ndarray):
+        self.manifest = manifest
+        self.classes: List[str] = manifest["classes"]
+        self.symptom_names: List[str] = manifest["symptom_names"]
+        self.alpha: float = manifest["alpha"]
+        self.feature_count = feature_count
+        self.class_count = class_count
+        self.feature_log_prob_t = feature_log_prob_t
+        self.class_log_prior = class_log_prior
+
+    @property
+    def watermark(self) -> Optional[Tuple[datetime.datetime, int]]:
+        learned = self.manifest.get("learned_through")
+        if not learned:
+            return None
+        return datetime.datetime.fromisoformat(learned["confirmed_at"]), learned["id"]
+
+    def engine(self) -> NaiveBayesEngine:
+        return NaiveBayesEngine(self.classes, self.symptom_names, self.feature_log_prob_t, self.class_log_prior)
+
+class IncrementalLearner:
+    """
+    Folds confirmed diagnoses into the published model (MultinomialNB count updates).
+    Only confirmations by current clinicians (users.is_clinician) are read, learned and held out alike.
+
+    Each update reads only the confirmations after the manifest's (confirmed_at, id)
+    watermark, adds their symptom vectors to their class's counts and recomputes the
+    log-probabilities of just those classes (plus the class priors). A candidate is only
+    published if its accuracy on held-out confirmations does not regress; a batch that
+    regresses is skipped and recorded as rejected_through/rejected_rows in the manifest.
+    """
+
+    def __init__(self, artifact_dir: str = ARTIFACT_DIR, session_factory=SessionLocal,
+                 holdout_modulo: int = LEARNER_HOLDOUT_MODULO, holdout_size: int = LEARNER_HOLDOUT_SIZE,
+                 min_holdout: int = LEARNER_MIN_HOLDOUT, max_regression: float = LEARNER_MAX_REGRESSION,
+                 batch_size: int = LEARNER_BATCH_SIZE, settle_seconds: float = LEARNER_SETTLE_SECONDS):
+        self.artifact_dir = artifact_dir
+        self.session_factory = session_factory
+        self.holdout_modulo = holdout_modulo
+        self.holdout_size = holdout_size
+        self.min_holdout = min_holdout
+        self.max_regression = max_regression
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+
+    def load(self) -> ModelCounts:
+        """The current artifact, or the joblib model (bootstrap) if none was published yet."""
+        if os.path.exists(os.path.join(self.artifact_dir, MANIFEST_NAME)):
+            manifest = read_manifest(self.artifact_dir)
+            files = manifest["arrays"]
+            if "feature_count" not in files:
+                raise ValueError("Model artifact has no raw counts; re-export it with train_model.py")
+            arrays = {name: np.load(os.path.join(self.artifact_dir, path)) for name, path in files.items()}
+            return ModelCounts(manifest, arrays["feature_count"], arrays["class_count"],
+                               arrays["feature_log_prob_t"], arrays["class_log_prior"])
+
+        model = joblib.load(MODEL_PATH)
+        manifest = {"version": "joblib", "alpha": float(np.atleast_1d(model.alpha)[0]),
+                    "classes": [str(c) for c in model.classes_], "symptom_names": list(joblib.load(SYMPTOMS_PATH))}
+        return ModelCounts(manifest, model.feature_count_.astype(np.float64), model.class_count_.astype(np.float64),
+                           model.feature_log_prob_.T.copy(), model.class_log_prior_.copy())
+
+    @staticmethod
+    def confirmed():
+        """Diagnoses confirmed by a clinician."""
+        D = models.Diagnosis
+        clinicians = select(models.User.id).where(models.User.is_clinician.is_(True))
+        return (D.confirmed_at.is_not(None), D.confirmed_by.in_(clinicians))
+
+    def new_rows(self, db, watermark) -> List:
+        D = models.Diagnosis
+        settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.settle_seconds)
+        query = (select(D.id, D.confirmed_at, D.confirmed_disease, D.mapped_symptoms)
+                 .where(*self.confirmed(), D.confirmed_at <= settled,
+                        D.id % self.holdout_modulo != 0))
+        if watermark:
+            query = query.where(tuple_(D.confirmed_at, D.id) > tuple_(*watermark))
+        return db.execute(query.order_by(D.confirmed_at, D.id).limit(self.batch_size)).all()
+
+    def holdout_rows(self, db) -> List:
+        D = models.Diagnosis
+        query = (select(D.confirmed_disease, D.mapped_symptoms)
+                 .where(*self.confirmed(), D.id % self.holdout_modulo == 0)
+                 .order_by(D.confirmed_at.desc(), D.id.desc()).limit(self.holdout_size))
+        return db.execute(query).all()
+
+    def fold_in(self, current: ModelCounts, rows) -> Tuple[ModelCounts, int]:
+        """A candidate with the rows' counts added. Returns it and the number of rows used."""
+        class_index = {c: i for i, c in enumerate(current.classes)}
+        symptom_index = {s: i for i, s in enumerate(current.symptom_names)}
+        row_classes, cells_class, cells_symptom = [], [], []
+        for row in rows:
+            c = class_index.get(row.confirmed_disease)
+            active = {symptom_index[s] for s in row.mapped_symptoms or [] if s in symptom_index}
+            if c is None or not active:
+                continue  # Unknown class, or nothing the model can learn from
+            row_classes.append(c)
+            cells_class.extend([c] * len(active))
+            cells_symptom.extend(active)
+
+        feature_count = current.feature_count.copy()
+        class_count = current.class_count.copy()
+        np.add.at(feature_count, (np.array(cells_class, dtype=np.intp), np.array(cells_symptom, dtype=np.intp)), 1)
+        class_count += np.bincount(row_classes, minlength=len(current.classes))
+
+        # Only the touched classes' feature log-probabilities change; every prior does
+        touched = np.unique(row_classes).astype(np.intp)
+        feature_log_prob_t = current.feature_log_prob_t.copy()
+        touched_log_prob, class_log_prior = log_probabilities(feature_count[touched], class_count, current.alpha)
+        feature_log_prob_t[:, touched] = touched_log_prob.T
+        candidate = ModelCounts(dict(current.manifest), feature_count, class_count, feature_log_prob_t, class_log_prior)
+        return candidate, len(row_classes)
+
+    @staticmethod
+    def accuracy(model: ModelCounts, rows) -> float:
+        labels = [row.confirmed_disease for row in rows]
+        probabilities = model.engine().predict_batch_proba([row.mapped_symptoms or [] for row in rows])
+        predicted = np.asarray(model.classes, dtype=object)[probabilities.argmax(axis=1)]
+        return float(np.mean(predicted == np.asarray(labels, dtype=object)))
+
+    def run_once(self) -> Dict:
+        """
+        One update. Returns what happened: idle, blocked (retried next time), published (with
+        the new version), rejected (the batch regressed and is skipped) or advanced (no row was
+        usable). Rejected and advanced batches only move the manifest's watermark on.
+        """
+        current = self.load()
+        with self.session_factory() as db:
+            rows = self.new_rows(db, current.watermark)
+            if not rows:
+                return {"status": "idle", "version": current.manifest["version"]}
+            holdout = self.holdout_rows(db)
+
+        candidate, used = self.fold_in(current, rows)
+        result = {"rows": len(rows), "used": used, "holdout": len(holdout), "parent": current.manifest["version"]}
+        if not used:
+            result["version"] = self.advance(current, rows, {})
+            logger.info("no usable confirmations, advanced the learner watermark", extra=result)
+            return {"status": "advanced", **result}
+        if len(holdout) < self.min_holdout:
+            logger.warning("not enough held-out confirmations to check a new model version", extra=result)
+            return {"status": "blocked", "reason": "holdout_too_small", **result}
+
+        result["holdout_accuracy"] = {"current": self.accuracy(current, holdout),
+                                      "candidate": self.accuracy(candidate, holdout)}
+        if result["holdout_accuracy"]["candidate"] < result["holdout_accuracy"]["current"] - self.max_regression:
+            # Skipped for good, otherwise the same batch would block every later update
+            result["version"] = self.advance(current, rows, {
+                "rejected_through": self.position(rows[-1]),
+                "rejected_rows": current.manifest.get("rejected_rows", 0) + used,
+            })
+            logger.warning("new model version regresses on held-out confirmations, batch rejected", extra=result)
+            return {"status": "rejected", "reason": "regression", **result}
+
+        manifest = self.publish(current, candidate, {
+            "learned_through": self.position(rows[-1]),
+            "learned_rows": current.manifest.get("learned_rows", 0) + used,
+        })
+        result["version"] = manifest["version"]
+        logger.info("published incrementally updated model", extra=result)
+        return {"status": "published", **result}
+
+    @staticmethod
+    def position(row) -> Dict:
+        return {"confirmed_at": row.confirmed_at.isoformat(), "id": row.id}
+
+    def publish(self, current: ModelCounts, candidate: ModelCounts, fields: Dict) -> Dict:
+        """Writes the candidate as a new artifact version whose manifest carries `fields`."""
+        fields = {**{key: value for key, value in current.manifest.items()
+                     if key not in ("format", "version", "arrays")},
+                  "parent": current.manifest["version"], **fields}
+        manifest = write_artifact(self.artifact_dir, {
+            "feature_log_prob_t": candidate.feature_log_prob_t,
+            "class_log_prior": candidate.class_log_prior,
+            "feature_count": candidate.feature_count,
+            "class_count": candidate.class_count,
+        }, fields)
+        # Keep the parent's files for workers that have not reloaded yet
+        prune_artifact(self.artifact_dir, [manifest["version"], current.manifest["version"]])
+        return manifest
+
+    def advance(self, current: ModelCounts, rows, fields: Dict) -> str:
+        """
+        Moves the watermark (learned_through: every row read so far) past rows without
+        changing the model. Returns the version whose manifest now carries it.
+        """
+        fields = {"learned_through": self.position(rows[-1]), **fields}
+        if current.manifest["version"] == "joblib":
+            # No artifact to record the watermark in yet: the current model becomes the first one
+            return self.publish(current, current, fields)["version"]
+        update_manifest(self.artifact_dir, fields)
+        return current.manifest["version"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop", action="store_true", help=f"update every LEARNER_INTERVAL ({LEARNER_INTERVAL:g}s)")
+    args = parser.parse_args()
+    setup_logging()
+    learner = IncrementalLearner()
+    while True:
+        try:
+            result = learner.run_once()
+            # Catch up in batch-sized steps before sleeping
+            while result["status"] in ("published", "rejected", "advanced") and result["rows"] >= learner.batch_size:
+                result = learner.run_once()
+            logger.info("learner update done", extra=result)
+        except Exception:
+            logger.exception("learner update failed")
+        if not args.loop:
+            break
+        time.sleep(LEARNER_INTERVAL)
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,105 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+import asyncio
+import base64
+import json
+import logging
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-from core.model import classifier
-from core.llm import extract_symptoms, translate_diseases, generate_advice
+from core.log import setup_logging, start_log_listener, stop_log_listener
+setup_logging()
+logger = logging.getLogger(__name__)
 
+from core.cache import TTLCache
+from core.model import get_classifier
+from core.llm import coalescing_stats, generate_advice, generate_advice_stream, get_client
+from core.governor import LLMOverloaded, get_governor, llm_user
+from core.llm_cache import get_llm_cache
+from core.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, register_cache_stats, render_metrics, stage, timed, timed_iter
+from core.matcher import extract_symptoms_fast, get_symptom_matcher
+from core.retrieval import get_symptom_retriever
+from core.translations import get_translation_table, translate_disease_names
 
-from core.security import verify_supabase_token
-from database import engine, get_db, Base
+
+from core.security import verify_supabase_token, init_auth
+from core.alerts import get_alert_level
+from database import engine, async_engine, get_async_db, Base
 import models
 import schemas
-from datetime import timedelta
+from datetime import datetime, timedelta
+from migrations import schema_problems
+from persistence import DIAGNOSIS_WRITE_MODE, get_diagnosis_writer
+
+# --- Startup / Readiness ---
+# Nothing is loaded at import time; the lifespan warms each component in parallel and
+# a failing dependency only keeps /readyz red instead of crashing the worker.
+def init_database():
+    # Migrations run once per deployment (migrations.py), workers only check the schema
+    problems = schema_problems(engine)
+    if problems:
+        raise RuntimeError(f"database schema is out of date, run `python migrations.py` (missing: {', '.join(problems)})")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+def init_model():
+    classifier = get_classifier()
+    get_symptom_matcher(classifier.symptom_names)
+    get_symptom_retriever(classifier.symptom_names)
+    register_cache_stats("predictions", classifier.cache.stats)
+
+WARMUP_STEPS = {
+    "model": init_model,
+    "database": init_database,
+    "llm": get_client,
+    "auth": init_auth,
+}
+readiness = {name: False for name in WARMUP_STEPS}
+readiness_errors = {}
+_warmup_lock = asyncio.Lock()
 
-# Create Tables
-models.Base.metadata.create_all(bind=engine)
+async def warm_up():
+    """Runs the warm-up steps that have not succeeded yet, concurrently in threads."""
+    async with _warmup_lock:
+        pending = [name for name, ready in readiness.items() if not ready]
+        results = await asyncio.gather(
+            *(asyncio.to_thread(WARMUP_STEPS[name]) for name in pending), return_exceptions=True
+        )
+        for name, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning("warm-up failed", extra={"component": name, "error": str(result)})
+                readiness_errors[name] = str(result)
+            else:
+                readiness[name] = True
+                readiness_errors.pop(name, None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_log_listener()  # Per process: a preloaded worker does not inherit the master's thread
+    warmup_task = asyncio.create_task(warm_up())
+    get_diagnosis_writer().start()
+    yield
+    warmup_task.cancel()
+    await get_diagnosis_writer().stop()
+    await async_engine.dispose()
+    stop_log_listener()
 
 app = FastAPI(
     title="Medical Pre-Diagnosis API",
     description="AI-powered backend for symptom analysis and disease prediction.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -35,39 +109,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(MetricsMiddleware)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token") # Keep for Swagger UI compatibility, though not used directly
 
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "1000"))
+
+@app.get("/")
+def read_root():
+    return {"status": "online", "message": "Medical AI API is running."}
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: model, database and API clients are warm. Retries failed components."""
+    if not all(readiness.values()):
+        await warm_up()
+    ready = all(readiness.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": readiness, "errors": readiness_errors}
+    )
+
 # --- Auth Dependencies ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    # Verify token with Supabase
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+# email -> schemas.User snapshot, so authenticated requests skip the users query
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+async def get_or_create_user(db: AsyncSession, email: str) -> schemas.User:
+    """Loads the local user for an email, creating it race-free (upsert) on first login."""
+    query = select(models.User).where(models.User.email == email)
+    user = (await db.execute(query)).scalars().first()
+    if not user:
+        # Auto-create user in our DB if they exist in Supabase but not here
+        logger.info("creating local user", extra={"email": email})
+        insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+        # We use a dummy password since Supabase handles auth
+        await db.execute(
+            insert(models.User)
+            .values(email=email, hashed_password="supabase_managed")
+            .on_conflict_do_nothing(index_elements=["email"])
+        )
+        await db.commit()
+        user = (await db.execute(query)).scalars().one()
+    return schemas.User.model_validate(user, from_attributes=True)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.User:
+    with stage("auth"):
+        return await authenticate(token, db)
+
+async def authenticate(token: str, db: AsyncSession) -> schemas.User:
+    # Verify token (locally when possible, otherwise with Supabase)
     try:
-        supabase_user_response = verify_supabase_token(token)
-        supabase_user = supabase_user_response.user
+        supabase_user = await verify_supabase_token(token)
         
         if not supabase_user or not supabase_user.email:
             raise HTTPException(status_code=401, detail="Invalid token or missing email")
             
         email = supabase_user.email
         
-        # Check if user exists in our DB (synced)
-        user = db.query(models.User).filter(models.User.email == email).first()
-        
-        if not user:
-            # Auto-create user in our DB if they exist in Supabase but not here
-            print(f"🆕 Creating local user for {email}")
-            # We use a dummy password since Supabase handles auth
-            new_user = models.User(email=email, hashed_password="supabase_managed")
-            db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
-            user = new_user
+        # Check if user exists in our DB (synced), via the per-worker cache
+        user = user_cache.get(email)
+        if user is None:
+            user = await get_or_create_user(db, email)
+            user_cache.set(email, user)
             
+        # LLM calls made for this request count against this user's rate limit
+        llm_user.set(user.id)
         return user
         
     except Exception as e:
-        print(f"Auth Error: {e}")
+        logger.info("authentication failed", extra={"error": str(e)})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -76,88 +195,118 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
 
 # --- User Endpoints ---
 @app.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(get_current_user)):
     return current_user
 
 @app.put("/users/me", response_model=schemas.User)
-def update_user_profile(profile: schemas.UserUpdate, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if profile.age is not None: current_user.age = profile.age
-    if profile.gender is not None: current_user.gender = profile.gender
-    if profile.chronic_conditions is not None: current_user.chronic_conditions = profile.chronic_conditions
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+async def update_user_profile(profile: schemas.UserUpdate, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(models.User, current_user.id)
+    if profile.age is not None: user.age = profile.age
+    if profile.gender is not None: user.gender = profile.gender
+    if profile.chronic_conditions is not None: user.chronic_conditions = profile.chronic_conditions
+    await db.commit()
+    await db.refresh(user)
+    # Drop the cached profile so the next request sees the update
+    user_cache.pop(user.email)
+    return user
 
 # --- Diagnosis Endpoint (Protected) ---
+def advice_strings(advice_data: dict):
+    """(reasoning, advice) as strings; the LLM sometimes answers with lists."""
+    reasoning_val = advice_data.get("reasoning")
+    if isinstance(reasoning_val, list):
+        reasoning_val = " ".join(reasoning_val)
+    elif reasoning_val is not None:
+        reasoning_val = str(reasoning_val)
+        
+    advice_val = advice_data.get("advice")
+    if isinstance(advice_val, list):
+        advice_val = "\n".join(advice_val)
+    elif advice_val is not None:
+        advice_val = str(advice_val)
+    return reasoning_val, advice_val
+
+async def save_diagnosis(current_user: schemas.User, user_text: str, mapped_symptoms: List[str], predictions: List[dict],
+                         max_prob: float, alert_level: str, advice_data: dict, sync: bool) -> bool:
+    """Returns True if the diagnosis is already on /history, False if its insert was deferred."""
+    top_disease = predictions[0]['disease'] if predictions else "Unknown"
+    logger.debug("saving diagnosis", extra={"user_id": current_user.id, "disease": top_disease})
+    reasoning_val, advice_val = advice_strings(advice_data)
+    
+    # Add advice to full_result to persist it
+    full_result_data = [p for p in predictions]
+    full_result_data.append({"type": "advice", "data": advice_data})
+
+    # Queued for a batched insert unless the caller needs it on /history right away
+    saved = await get_diagnosis_writer().save(dict(
+        user_id=current_user.id,
+        symptoms=user_text,
+        predicted_disease=top_disease,
+        probability=max_prob,
+        created_at=datetime.utcnow(),
+        mapped_symptoms=mapped_symptoms,
+        alert_level=alert_level,
+        reasoning=reasoning_val,
+        advice=advice_val,
+        predictions=predictions,
+        full_result=full_result_data 
+    ), sync=sync or DIAGNOSIS_WRITE_MODE == "sync")
+    if sync and not saved:
+        logger.warning("synchronous diagnosis insert failed, it was deferred", extra={"user_id": current_user.id})
+    return saved
+
 @app.post("/diagnosis", response_model=schemas.DiagnosisResponse)
-async def diagnose(input_data: schemas.SymptomInput, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def diagnose(input_data: schemas.SymptomInput, sync: bool = False, current_user: schemas.User = Depends(get_current_user)):
     """
     Full pipeline: User Text -> LLM Extraction -> ML Prediction -> Result
-    Saves result to history.
+    Saves result to history (write-behind; ?sync=true waits for the insert). `saved` tells
+    whether the diagnosis is already on /history; it is false if a ?sync=true insert failed.
     """
     try:
         user_text = input_data.text
-        print(f"📩 Received input from {current_user.email}: {user_text}")
+        logger.debug("diagnosis request", extra={"user_id": current_user.id, "text": user_text})
 
-        # 1. Extract Symptoms using LLM
+        # 1. Extract Symptoms (local matcher, LLM if it is not confident)
+        classifier = get_classifier()
         valid_symptoms = classifier.symptom_names
-        mapped_symptoms = extract_symptoms(user_text, valid_symptoms)
+        with stage("extraction"):
+            mapped_symptoms, extraction_path, confidence = await extract_symptoms_fast(user_text, valid_symptoms)
+        logger.info("symptoms extracted", extra={"path": extraction_path, "confidence": round(confidence, 2),
+                                                 "symptoms": mapped_symptoms})
         
         if not mapped_symptoms:
             return schemas.DiagnosisResponse(
-                mapped_symptoms=[], predictions=[], max_probability=0.0, alert_level="Unknown"
+                mapped_symptoms=[], predictions=[], max_probability=0.0, alert_level="Unknown",
+                extraction_path=extraction_path
             )
 
         # 2. Predict Disease using ML Model
-        predictions, max_prob = classifier.predict(mapped_symptoms)
+        with stage("predict"):
+            predictions, max_prob = classifier.predict(mapped_symptoms)
 
-        # 3. Translate Disease Names to Turkish
+        # 3 + 5. Translate Disease Names to Turkish and Generate Advice concurrently
+        # (both only depend on the ML output)
         disease_names = [p['disease'] for p in predictions]
-        translated_names = translate_diseases(disease_names)
+        top_disease_en = disease_names[0] if disease_names else "Unknown"
+        translated_names, advice_data = await asyncio.gather(
+            timed("translate", translate_disease_names(disease_names)),
+            timed("advice", generate_advice(top_disease_en, user_text))
+        )
+        logger.debug("advice generated", extra={"disease": top_disease_en, "advice": advice_data})
         
         for i, p in enumerate(predictions):
             p['disease'] = translated_names[i]
 
         # 4. Determine Alert Level
-        alert_level = "Low"
-        if max_prob > 50: alert_level = "Medium"
-        if max_prob > 80: alert_level = "High"
-
-        # 5. Generate Advice (New Step)
-        top_disease = predictions[0]['disease'] if predictions else "Unknown"
-        print(f"🤔 Generating advice for: {top_disease}")
-        advice_data = generate_advice(top_disease, user_text)
-        print(f"💡 Advice Data: {advice_data}")
-        
+        alert_level = get_alert_level(max_prob)
+
         # Ensure reasoning and advice are strings
-        reasoning_val = advice_data.get("reasoning")
-        if isinstance(reasoning_val, list):
-            reasoning_val = " ".join(reasoning_val)
-        elif reasoning_val is not None:
-            reasoning_val = str(reasoning_val)
-            
-        advice_val = advice_data.get("advice")
-        if isinstance(advice_val, list):
-            advice_val = "\n".join(advice_val)
-        elif advice_val is not None:
-            advice_val = str(advice_val)
+        reasoning_val, advice_val = advice_strings(advice_data)
 
         # 6. Save to History
-        print(f"💾 Saving diagnosis for user {current_user.id}: {top_disease}")
-        
-        # Add advice to full_result to persist it
-        full_result_data = [p for p in predictions]
-        full_result_data.append({"type": "advice", "data": advice_data})
-
-        new_diagnosis = models.Diagnosis(
-            user_id=current_user.id,
-            symptoms=user_text,
-            predicted_disease=top_disease,
-            probability=max_prob,
-            full_result=full_result_data 
-        )
-        db.add(new_diagnosis)
-        db.commit()
+        with stage("db_write"):
+            saved = await save_diagnosis(current_user, user_text, mapped_symptoms, predictions, max_prob, alert_level,
+                                         advice_data, sync)
 
         return schemas.DiagnosisResponse(
             mapped_symptoms=mapped_symptoms,
@@ -165,66 +314,256 @@ async def diagnose(input_data: schemas.SymptomInput, current_user: models.User =
             max_probability=max_prob,
             alert_level=alert_level,
             reasoning=reasoning_val,
-            advice=advice_val
+            advice=advice_val,
+            extraction_path=extraction_path,
+            saved=saved
         )
+    except LLMOverloaded:
+        raise  # 429 with Retry-After
     except Exception as e:
-        import traceback
-        print(f"❌ CRITICAL ERROR in diagnose: {e}")
-        traceback.print_exc()
+        logger.exception("diagnosis failed")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/history", response_model=List[schemas.DiagnosisResponse])
-def get_history(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    diagnoses = db.query(models.Diagnosis).filter(models.Diagnosis.user_id == current_user.id).order_by(models.Diagnosis.created_at.desc()).all()
-    print(f"📜 Fetching history for user {current_user.id}. Found {len(diagnoses)} records.")
-    
-    history_response = []
-    for d in diagnoses:
-        # Determine alert level based on probability
-        alert_level = "Low"
-        if d.probability > 50: alert_level = "Medium"
-        if d.probability > 80: alert_level = "High"
-        
-        # Parse full_result (list of dicts)
-        predictions = []
-        reasoning = None
-        advice = None
-        
-        if d.full_result:
-            for item in d.full_result:
-                # Check if it's an advice item
-                if isinstance(item, dict) and item.get("type") == "advice":
-                    advice_data = item.get("data", {})
-                    
-                    # Safely extract and convert reasoning
-                    r_val = advice_data.get("reasoning")
-                    if isinstance(r_val, list):
-                        reasoning = " ".join(r_val)
-                    elif r_val is not None:
-                        reasoning = str(r_val)
-                        
-                    # Safely extract and convert advice
-                    a_val = advice_data.get("advice")
-                    if isinstance(a_val, list):
-                        advice = "\n".join(a_val)
-                    elif a_val is not None:
-                        advice = str(a_val)
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/diagnosis/stream")
+async def diagnose_stream(input_data: schemas.SymptomInput, sync: bool = False, current_user: schemas.User = Depends(get_current_user)):
+    """
+    Same pipeline as /diagnosis, streamed as server-sent events while the stages finish:
+    "predictions" (mapped symptoms + English predictions), "translations", "advice_delta"
+    (reasoning/advice text as it is generated), "advice", then "done" with the full
+    DiagnosisResponse. A failure after the stream started is sent as an "error" event.
+    """
+    async def events():
+        translation = None
+        try:
+            user_text = input_data.text
+            logger.debug("streaming diagnosis request", extra={"user_id": current_user.id, "text": user_text})
+
+            classifier = get_classifier()
+            with stage("extraction"):
+                mapped_symptoms, extraction_path, confidence = await extract_symptoms_fast(user_text, classifier.symptom_names)
+            logger.info("symptoms extracted", extra={"path": extraction_path, "confidence": round(confidence, 2),
+                                                     "symptoms": mapped_symptoms})
+            if not mapped_symptoms:
+                result = schemas.DiagnosisResponse(
+                    mapped_symptoms=[], predictions=[], max_probability=0.0, alert_level="Unknown",
+                    extraction_path=extraction_path
+                )
+                yield sse_event("done", result.model_dump())
+                return
+
+            with stage("predict"):
+                predictions, max_prob = classifier.predict(mapped_symptoms)
+            alert_level = get_alert_level(max_prob)
+            yield sse_event("predictions", {
+                "mapped_symptoms": mapped_symptoms, "extraction_path": extraction_path,
+                "predictions": predictions, "max_probability": max_prob, "alert_level": alert_level,
+            })
+
+            # Translation runs while the advice streams; it is sent as soon as it is ready
+            disease_names = [p['disease'] for p in predictions]
+            translation = asyncio.create_task(timed("translate", translate_disease_names(disease_names)))
+            translations_sent = False
+            advice_data = None
+            # Only the upstream call is timed, not how fast the client reads the deltas
+            async for kind, value in timed_iter("advice", generate_advice_stream(disease_names[0], user_text)):
+                if not translations_sent and translation.done():
+                    predictions = [{**p, "disease": name} for p, name in zip(predictions, translation.result())]
+                    yield sse_event("translations", {"predictions": predictions})
+                    translations_sent = True
+                if kind == "done":
+                    advice_data = value
                 else:
-                    # Assume it's a prediction
-                    try:
-                        predictions.append(schemas.DiseasePrediction(**item))
-                    except:
-                        pass # Skip invalid items
-        
-        history_response.append(schemas.DiagnosisResponse(
-            mapped_symptoms=[], 
-            predictions=predictions,
-            max_probability=d.probability,
-            alert_level=alert_level,
-            reasoning=reasoning,
-            advice=advice
-        ))
-    return history_response
+                    yield sse_event("advice_delta", {"field": kind, "delta": value})
+            if not translations_sent:
+                predictions = [{**p, "disease": name} for p, name in zip(predictions, await translation)]
+                yield sse_event("translations", {"predictions": predictions})
+
+            reasoning_val, advice_val = advice_strings(advice_data)
+            yield sse_event("advice", {"reasoning": reasoning_val, "advice": advice_val})
+
+            with stage("db_write"):
+                saved = await save_diagnosis(current_user, user_text, mapped_symptoms, predictions, max_prob, alert_level,
+                                             advice_data, sync)
+            result = schemas.DiagnosisResponse(
+                mapped_symptoms=mapped_symptoms,
+                predictions=[schemas.DiseasePrediction(**p) for p in predictions],
+                max_probability=max_prob,
+                alert_level=alert_level,
+                reasoning=reasoning_val,
+                advice=advice_val,
+                extraction_path=extraction_path,
+                saved=saved
+            )
+            yield sse_event("done", result.model_dump())
+        except LLMOverloaded as e:
+            yield sse_event("error", {"detail": e.detail, "status": e.status_code, "retry_after": e.retry_after})
+        except Exception as e:
+            logger.exception("streaming diagnosis failed")
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            if translation is not None and not translation.done():
+                translation.cancel()  # Client went away
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/diagnosis/batch")
+def diagnose_batch(input_data: schemas.BatchSymptomInput, current_user: schemas.User = Depends(get_current_user)):
+    """
+    ML-only scoring of pre-mapped symptom lists (no LLM calls, nothing saved).
+    Results are streamed back as newline-delimited JSON, one line per case, in input order.
+    """
+    classifier = get_classifier()
+
+    def generate():
+        cases = input_data.cases
+        for start in range(0, len(cases), BATCH_CHUNK_SIZE):
+            chunk = cases[start:start + BATCH_CHUNK_SIZE]
+            for offset, (predictions, max_prob) in enumerate(classifier.predict_batch(chunk, input_data.top_k)):
+                result = schemas.BatchDiagnosisResult(
+                    index=start + offset,
+                    mapped_symptoms=chunk[offset],
+                    predictions=predictions,
+                    max_probability=max_prob,
+                    alert_level=get_alert_level(max_prob)
+                )
+                yield result.model_dump_json() + "\n"
+
+    logger.info("batch scoring", extra={"user_id": current_user.id, "cases": len(input_data.cases)})
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/cache/stats")
+def cache_stats(current_user: schemas.User = Depends(get_current_user)):
+    """Hit/miss counters of the in-process caches of this worker (authenticated, unlike /metrics)."""
+    classifier = get_classifier()
+    return {
+        "predictions": classifier.cache.stats(),
+        "symptom_matcher": get_symptom_matcher(classifier.symptom_names).stats(),
+        "llm": get_llm_cache().stats(),
+        "llm_coalescing": coalescing_stats(),
+        "llm_governor": get_governor().stats(),
+        "users": user_cache.stats(),
+        "diagnosis_writer": get_diagnosis_writer().stats(),
+    }
+
+register_cache_stats("users", user_cache.stats)
+register_cache_stats("llm_memory", lambda: get_llm_cache().memory.stats())
+register_cache_stats("llm_disk", lambda: get_llm_cache().disk and get_llm_cache().disk.stats())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics: request counters, per-stage latency histograms, cache hit rates, LLM usage."""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 200
+
+def encode_history_cursor(created_at: datetime, diagnosis_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{diagnosis_id}".encode()).decode()
+
+def decode_history_cursor(cursor: str):
+    try:
+        created_at, diagnosis_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(diagnosis_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+def history_item(d) -> schemas.DiagnosisResponse:
+    return schemas.DiagnosisResponse(
+        mapped_symptoms=d.mapped_symptoms or [],
+        predictions=d.predictions or [],
+        max_probability=d.probability,
+        alert_level=d.alert_level,
+        reasoning=d.reasoning,
+        advice=d.advice,
+        id=d.id,
+        confirmed_disease=d.confirmed_disease
+    )
+
+@app.get("/history", response_model=Union[List[schemas.DiagnosisResponse], List[schemas.DiagnosisSummary]])
+async def get_history(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    summary: bool = False,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Newest diagnoses first. With `limit` or `before` the result is paged (keyset pagination
+    on created_at, id; `limit` defaults to HISTORY_PAGE_SIZE): the cursor for the next page
+    is returned in the X-Next-Cursor header, pass it back as `before`. Without either, the
+    whole history is returned, as clients that do not page (the mobile app) expect.
+    summary=true returns only predicted_disease, probability and created_at.
+    """
+    D = models.Diagnosis
+    if summary:
+        query = select(D.id, D.predicted_disease, D.probability, D.created_at)
+    else:
+        query = select(D.id, D.created_at, D.probability, D.mapped_symptoms, D.alert_level,
+                         D.reasoning, D.advice, D.predictions, D.confirmed_disease)
+    query = query.where(D.user_id == current_user.id)
+    if before:
+        created_at, diagnosis_id = decode_history_cursor(before)
+        query = query.where(tuple_(D.created_at, D.id) < tuple_(created_at, diagnosis_id))
+    query = query.order_by(D.created_at.desc(), D.id.desc())
+    paged = limit is not None or before is not None
+    if paged:
+        limit = limit or HISTORY_PAGE_SIZE
+        # One extra row tells whether there is a next page
+        query = query.limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    if paged and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_history_cursor(rows[-1].created_at, rows[-1].id)
+    logger.debug("history page", extra={"user_id": current_user.id, "rows": len(rows)})
+
+    if summary:
+        return [schemas.DiagnosisSummary(predicted_disease=r.predicted_disease, probability=r.probability,
+                                         created_at=r.created_at) for r in rows]
+    return [history_item(d) for d in rows]
+
+def resolve_disease_name(name: str) -> Optional[str]:
+    """Model class name for a confirmed disease given in English or as its Turkish translation."""
+    classes = get_classifier().classes
+    if name in classes:
+        return name
+    by_casefold = {c.casefold(): c for c in classes}
+    english = by_casefold.get(name.casefold()) or get_translation_table().source_name(name)
+    return english if english in classes else None
+
+@app.post("/history/{diagnosis_id}/confirm", response_model=schemas.DiagnosisResponse)
+async def confirm_diagnosis(
+    diagnosis_id: int,
+    confirmation: schemas.DiagnosisConfirmation,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Records which disease a diagnosis turned out to be. Only clinicians (users.is_clinician)
+    may confirm, for any user's diagnosis: confirmed diagnoses are folded into the shared
+    model by learner.py, so a confirmation is final (changing it returns 409).
+    """
+    if not current_user.is_clinician:
+        raise HTTPException(status_code=403, detail="Only clinicians can confirm diagnoses")
+    disease = resolve_disease_name(confirmation.disease)
+    if disease is None:
+        raise HTTPException(status_code=422, detail="Unknown disease")
+    diagnosis = await db.get(models.Diagnosis, diagnosis_id)
+    if diagnosis is None:
+        raise HTTPException(status_code=404, detail="Diagnosis not found")
+    if diagnosis.confirmed_disease is None:
+        diagnosis.confirmed_disease = disease
+        diagnosis.confirmed_at = datetime.utcnow()
+        diagnosis.confirmed_by = current_user.id
+        await db.commit()
+    elif diagnosis.confirmed_disease != disease:
+        raise HTTPException(status_code=409, detail="Diagnosis already confirmed")
+    logger.info("diagnosis confirmed", extra={"user_id": current_user.id, "diagnosis_id": diagnosis_id, "disease": disease})
+    return history_item(diagnosis)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,150 @@
+"""
+Schema migrations for existing databases (create_all never alters a table).
+
+    python migrations.py
+
+Run once per deployment before the workers start; gunicorn.conf.py does it in the master.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import inspect, or_, select, update
+from sqlalchemy.engine import Engine
+
+load_dotenv()
+
+from database import Base
+import models
+import schemas
+from core.alerts import get_alert_level
+
+logger = logging.getLogger(__name__)
+
+# Rows per transaction when backfilling existing diagnoses
+BACKFILL_BATCH_SIZE = 500
+
+def add_missing_columns(engine: Engine):
+    """
+    Adds columns declared on the models but missing from existing tables (nullable only),
+    with their foreign key. create_all() never alters a table that already exists.
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            logger.info("adding column", extra={"table": table.name, "column": column.name})
+            references = "".join(
+                f" REFERENCES {preparer.format_table(fk.column.table)} ({preparer.format_column(fk.column)})"
+                for fk in column.foreign_keys
+            )
+            with engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=engine.dialect)}{references}"
+                )
+
+def ensure_indexes(engine: Engine):
+    """
+    Creates indexes declared on the models but missing from existing tables.
+    create_all() only builds indexes together with new tables.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("creating index", extra={"table": table.name, "index": index.name})
+                index.create(bind=engine, checkfirst=True)
+
+def _as_text(value, separator: str) -> Optional[str]:
+    if isinstance(value, list):
+        return separator.join(str(v) for v in value)
+    return str(value) if value is not None else None
+
+def split_full_result(full_result) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    """Legacy full_result (predictions + trailing advice item) -> (predictions, reasoning, advice)."""
+    predictions, reasoning, advice = [], None, None
+    for item in full_result or []:
+        if isinstance(item, dict) and item.get("type") == "advice":
+            advice_data = item.get("data") or {}
+            reasoning = _as_text(advice_data.get("reasoning"), " ")
+            advice = _as_text(advice_data.get("advice"), "\n")
+        else:
+            try:
+                predictions.append(schemas.DiseasePrediction(**item).model_dump())
+            except Exception:
+                pass # Skip invalid items
+    return predictions, reasoning, advice
+
+def backfill_diagnoses(engine: Engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Fills the normalized diagnosis columns of rows written before they existed, in id order,
+    so /history reads every row as-is.
+    """
+    D = models.Diagnosis
+    done, last_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(D.id, D.full_result, D.predictions, D.probability)
+                .where(or_(D.predictions.is_(None), D.alert_level.is_(None)), D.id > last_id)
+                .order_by(D.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row in rows:
+                values = {"alert_level": get_alert_level(row.probability or 0.0)}
+                if row.predictions is None:
+                    predictions, reasoning, advice = split_full_result(row.full_result)
+                    values.update(predictions=predictions, reasoning=reasoning, advice=advice, mapped_symptoms=[])
+                conn.execute(update(D).where(D.id == row.id).values(**values))
+        done += len(rows)
+        last_id = rows[-1].id
+    if done:
+        logger.info("backfilled diagnoses", extra={"rows": done})
+    return done
+
+def run_migrations(engine: Engine):
+    add_missing_columns(engine)
+    ensure_indexes(engine)
+    backfill_diagnoses(engine)
+
+def migrate(engine: Engine):
+    """
+    Brings the database up to date: new tables, then columns, indexes and the backfill.
+    Runs once per deployment (gunicorn's master, or `python migrations.py`), never in
+    every worker, where concurrent ALTER TABLEs and backfills would race.
+    """
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+def schema_problems(engine: Engine) -> List[str]:
+    """Tables, columns and indexes declared on the models but missing from the database."""
+    inspector = inspect(engine)
+    problems = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            problems.append(f"table {table.name}")
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        problems += [f"column {table.name}.{c.name}" for c in table.columns if c.name not in existing]
+        indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        problems += [f"index {index.name}" for index in table.indexes if index.name not in indexes]
+    return problems
+
+if __name__ == "__main__":
+    from core.log import setup_logging
+    from database import engine
+
+    setup_logging()
+    migrate(engine)
+    print("✅ Database schema is up to date.")
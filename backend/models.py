@@ -1,8 +1,12 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, JSON
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Float, DateTime, JSON, Text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
 
+# JSONB on Postgres, plain JSON elsewhere (SQLite)
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 class User(Base):
     __tablename__ = "users"
 
@@ -15,7 +19,10 @@ class User(Base):
     gender = Column(String, nullable=True)
     chronic_conditions = Column(String, nullable=True) # Stored as comma-separated string or JSON
 
-    diagnoses = relationship("Diagnosis", back_populates="owner")
+    # May confirm diagnoses; set by an administrator, never through the API
+    is_clinician = Column(Boolean, nullable=True)
+
+    diagnoses = relationship("Diagnosis", back_populates="owner", foreign_keys="Diagnosis.user_id")
 
 class Diagnosis(Base):
     __tablename__ = "diagnoses"
@@ -28,7 +35,26 @@ class Diagnosis(Base):
     probability = Column(Float)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
-    # Store full result as JSON for details
+    # Normalized result, read by /history as-is
+    mapped_symptoms = Column(JSONType, nullable=True) # List of model symptom names
+    alert_level = Column(String, nullable=True)
+    reasoning = Column(Text, nullable=True)
+    advice = Column(Text, nullable=True)
+    predictions = Column(JSONType, nullable=True) # List of DiseasePrediction dicts
+
+    # Model class name (English) a clinician confirmed; learner.py folds these into the model
+    confirmed_disease = Column(String, nullable=True)
+    confirmed_at = Column(DateTime, nullable=True)
+    confirmed_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+    # Raw result (predictions + trailing advice item), kept for older readers
     full_result = Column(JSON)
 
-    owner = relationship("User", back_populates="diagnoses")
+    owner = relationship("User", back_populates="diagnoses", foreign_keys=[user_id])
+
+    __table_args__ = (
+        # Serves /history: a user's newest diagnoses first, id breaks created_at ties (keyset cursor)
+        Index("ix_diagnoses_user_id_created_at", user_id, created_at.desc(), id.desc()),
+        # Serves the learner: confirmations after its (confirmed_at, id) watermark
+        Index("ix_diagnoses_confirmed_at", confirmed_at, id),
+    )
@@ -0,0 +1,292 @@
+import asyncio
+import datetime
+import glob
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+
+from core.config import BASE_DIR
+from database import AsyncSessionLocal
+import models
+
+logger = logging.getLogger(__name__)
+
+# "behind": diagnoses are queued and inserted in batches after the response is sent,
+# "sync": every request waits for its own insert (read-your-writes on /history)
+DIAGNOSIS_WRITE_MODE = os.environ.get("DIAGNOSIS_WRITE_MODE", "behind")
+DIAGNOSIS_BATCH_SIZE = int(os.environ.get("DIAGNOSIS_BATCH_SIZE", "100"))
+# Longest time (seconds) a queued diagnosis waits for its batch to fill up
+DIAGNOSIS_FLUSH_INTERVAL = float(os.environ.get("DIAGNOSIS_FLUSH_INTERVAL", "0.5"))
+DIAGNOSIS_QUEUE_SIZE = int(os.environ.get("DIAGNOSIS_QUEUE_SIZE", "10000"))
+DIAGNOSIS_MAX_RETRIES = int(os.environ.get("DIAGNOSIS_MAX_RETRIES", "5"))
+# Batches that still fail after all retries (or are queued at shutdown) are appended here
+# and inserted again on the next start. Rows the database rejects (constraint or data errors)
+# go to dead-<pid>.jsonl in the same directory instead, which is never replayed.
+DIAGNOSIS_SPOOL_DIR = os.environ.get("DIAGNOSIS_SPOOL_DIR", os.path.join(BASE_DIR, "spool"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# A claimed spool file this old belongs to a worker that died while replaying it
+STALE_CLAIM_AGE = 600
+
+_STOP = object()
+
+def _to_json(values: Dict) -> str:
+    return json.dumps({k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in values.items()},
+                      ensure_ascii=False)
+
+def _is_row_error(e: Exception) -> bool:
+    """The rows themselves are rejected (retrying cannot help), as opposed to the database being unavailable."""
+    return isinstance(e, (IntegrityError, DataError)) or (isinstance(e, StatementError) and not isinstance(e, DBAPIError))
+
+def _from_json(line: str) -> Dict:
+    values = json.loads(line)
+    if values.get("created_at"):
+        values["created_at"] = datetime.datetime.fromisoformat(values["created_at"])
+    return values
+
+class DiagnosisWriter:
+    """
+    Write-behind queue for Diagnosis rows.
+
+    Rows are inserted in batches (when DIAGNOSIS_BATCH_SIZE rows are queued or after
+    DIAGNOSIS_FLUSH_INTERVAL), failed batches are retried with exponential backoff, and
+    whatever cannot be written is spooled to disk (fsync'd JSONL) and replayed later.
+    A batch the database rejects is bisected, so only the offending rows are dead-lettered.
+    """
+
+    def __init__(self, batch_size: int = DIAGNOSIS_BATCH_SIZE, flush_interval: float = DIAGNOSIS_FLUSH_INTERVAL,
+                 queue_size: int = DIAGNOSIS_QUEUE_SIZE, max_retries: int = DIAGNOSIS_MAX_RETRIES,
+                 spool_dir: str = DIAGNOSIS_SPOOL_DIR):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.spool_dir = spool_dir
+        self.spool_path = os.path.join(spool_dir, f"diagnoses-{os.getpid()}.jsonl")
+        self.dead_letter_path = os.path.join(spool_dir, f"dead-{os.getpid()}.jsonl")
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spool_pending = False
+        self.written = 0
+        self.retries = 0
+        self.failed_batches = 0
+        self.spooled = 0
+        self.dead_lettered = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        # Forked workers inherit the master's pid in the path otherwise
+        self.spool_path = os.path.join(self.spool_dir, f"diagnoses-{os.getpid()}.jsonl")
+        self.dead_letter_path = os.path.join(self.spool_dir, f"dead-{os.getpid()}.jsonl")
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Flushes everything queued; rows that cannot be written in time are spooled."""
+        if not self.running:
+            return
+        await self.queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except Exception as e:
+            logger.warning("diagnosis writer did not drain in time", extra={"error": str(e)})
+        leftover = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._spool(leftover)
+        self._task = None
+
+    async def save(self, values: Dict, sync: bool = False) -> bool:
+        """
+        Saves one diagnosis (column values). Returns True if the row is committed on return,
+        which is the read-your-writes guarantee `sync` asks for; False means it was deferred.
+        A failed write never raises: the row goes to the queue (or the spool) instead, or to
+        the dead-letter file if the database rejects it.
+        """
+        if sync or not self.running:
+            try:
+                await self._insert([values])
+                self.written += 1
+                return True
+            except Exception as e:
+                if _is_row_error(e):
+                    self._dead_letter([values], e)
+                    return False
+                logger.warning("diagnosis insert failed, deferring it", extra={"error": str(e)})
+                if not self.running:
+                    self._spool([values])
+                    return False
+        # Waits only when the queue is full (backpressure instead of unbounded memory)
+        await self.queue.put(values)
+        return False
+
+    async def _insert(self, batch: List[Dict]):
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(models.Diagnosis), batch)
+            await db.commit()
+
+    async def _run(self):
+        await self.replay_spool()
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                if await self._flush(batch) and self._spool_pending and not stopping:
+                    await self.replay_spool()
+            except asyncio.CancelledError:
+                self._spool(batch)
+                raise
+
+    async def _flush(self, batch: List[Dict]) -> bool:
+        """
+        Inserts a batch, retrying with exponential backoff. Spools it if every attempt fails.
+        A batch the database rejects is not retried but split up (_isolate).
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._insert(batch)
+                self.written += len(batch)
+                return True
+            except Exception as e:
+                if _is_row_error(e):
+                    logger.warning("diagnosis batch rejected, isolating the bad rows", extra={"rows": len(batch), "error": str(e)})
+                    return await self._isolate(batch, e)
+                if attempt == self.max_retries:
+                    logger.error("diagnosis batch failed", extra={"rows": len(batch), "attempts": attempt + 1, "error": str(e)})
+                    break
+                delay = min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+                logger.warning("diagnosis batch insert failed, retrying", extra={"delay": delay, "error": str(e)})
+                self.retries += 1
+                await asyncio.sleep(delay)
+        self.failed_batches += 1
+        self._spool(batch)
+        return False
+
+    async def _isolate(self, batch: List[Dict], error: Exception) -> bool:
+        """
+        Bisects a rejected batch: halves that insert are kept, a row rejected on its own is
+        dead-lettered. A half failing for another reason (database gone) is spooled as usual.
+        Returns True if every row was inserted or dead-lettered.
+        """
+        if len(batch) == 1:
+            self._dead_letter(batch, error)
+            return True
+        done = True
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            try:
+                await self._insert(half)
+                self.written += len(half)
+            except Exception as e:
+                if _is_row_error(e):
+                    done = await self._isolate(half, e) and done
+                else:
+                    self.failed_batches += 1
+                    self._spool(half)
+                    done = False
+        return done
+
+    def _append(self, path: str, batch: List[Dict]):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(_to_json(values) + "\n" for values in batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _dead_letter(self, batch: List[Dict], error: Exception):
+        try:
+            self._append(self.dead_letter_path, [{**values, "_error": str(error)} for values in batch])
+        except Exception as e:
+            logger.error("could not dead-letter diagnoses, they are lost", extra={"rows": len(batch), "error": str(e)})
+            return
+        self.dead_lettered += len(batch)
+        logger.error("diagnosis rejected by the database, dead-lettered",
+                     extra={"rows": len(batch), "path": self.dead_letter_path, "error": str(error)})
+
+    def _spool(self, batch: List[Dict]):
+        try:
+            self._append(self.spool_path, batch)
+        except Exception as e:
+            logger.error("could not spool diagnoses, they are lost", extra={"rows": len(batch), "error": str(e)})
+            return
+        self.spooled += len(batch)
+        self._spool_pending = True
+        logger.warning("spooled diagnoses", extra={"rows": len(batch), "path": self.spool_path})
+
+    def _claim_spool_files(self) -> List[str]:
+        """Renames spool files to claim them, so concurrent workers never replay the same file."""
+        claimed = []
+        now = time.time()
+        for path in glob.glob(os.path.join(self.spool_dir, "diagnoses-*")):
+            if path.endswith(".claimed") and now - os.path.getmtime(path) < STALE_CLAIM_AGE:
+                continue
+            target = f"{path.removesuffix('.claimed')}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, target)
+                os.utime(target)
+            except OSError:
+                continue  # Claimed by another worker
+            claimed.append(target)
+        return claimed
+
+    async def replay_spool(self):
+        """Inserts spooled diagnoses (this worker's and those left behind by earlier processes)."""
+        self._spool_pending = False
+        for path in await asyncio.to_thread(self._claim_spool_files):
+            with open(path, encoding="utf-8") as f:
+                rows = [_from_json(line) for line in f if line.strip()]
+            logger.info("replaying spooled diagnoses", extra={"rows": len(rows), "path": path})
+            for start in range(0, len(rows), self.batch_size):
+                # A failing chunk is spooled again by _flush
+                await self._flush(rows[start:start + self.batch_size])
+            os.remove(path)
+
+    def stats(self) -> Dict:
+        return {
+            "mode": DIAGNOSIS_WRITE_MODE,
+            "running": self.running,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "written": self.written,
+            "retries": self.retries,
+            "failed_batches": self.failed_batches,
+            "spooled": self.spooled,
+            "dead_lettered": self.dead_lettered,
+        }
+
+_writer: Optional[DiagnosisWriter] = None
+
+def get_diagnosis_writer() -> DiagnosisWriter:
+    global _writer
+    if _writer is None:
+        _writer = DiagnosisWriter()
+    return _writer
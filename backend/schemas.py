@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional
+from datetime import datetime
 
 class SymptomInput(BaseModel):
     text: str
@@ -19,6 +20,38 @@ class DiagnosisResponse(BaseModel):
     alert_level: str  # "Low", "Medium", "High"
     reasoning: Optional[str] = None
     advice: Optional[str] = None
+    extraction_path: Optional[str] = None  # "local" (symptom matcher) or "llm"
+    saved: Optional[bool] = None  # Already on /history (True) or queued for a deferred insert (False)
+    # Set on /history rows
+    id: Optional[int] = None
+    confirmed_disease: Optional[str] = None
+
+class DiagnosisConfirmation(BaseModel):
+    # Model class name (English) or its Turkish name as shown in predictions
+    disease: str
+
+class DiagnosisSummary(BaseModel):
+    # Lightweight /history row (?summary=true)
+    predicted_disease: Optional[str] = None
+    probability: Optional[float] = None
+    created_at: Optional[datetime] = None
+
+# Bounds on one /diagnosis/batch request, so a single call cannot ask for unbounded work
+BATCH_MAX_CASES = 10000
+BATCH_MAX_SYMPTOMS = 500  # Per case; the model knows fewer symptoms than this
+BATCH_MAX_TOP_K = 100
+
+class BatchSymptomInput(BaseModel):
+    # Symptom lists already mapped to model symptom names
+    cases: List[Annotated[List[str], Field(max_length=BATCH_MAX_SYMPTOMS)]] = Field(max_length=BATCH_MAX_CASES)
+    top_k: int = Field(5, ge=1, le=BATCH_MAX_TOP_K)
+
+class BatchDiagnosisResult(BaseModel):
+    index: int
+    mapped_symptoms: List[str]
+    predictions: List[DiseasePrediction]
+    max_probability: float
+    alert_level: str
 
 # --- Auth Schemas ---
 class UserBase(BaseModel):
@@ -40,6 +73,7 @@ class User(UserBase):
     age: Optional[int] = None
     gender: Optional[str] = None
     chronic_conditions: Optional[str] = None
+    is_clinician: Optional[bool] = None
     
     class Config:
         orm_mode = True
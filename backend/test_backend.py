@@ -1,44 +1,957 @@
-from fastapi.testclient import TestClient
-from main import app
 import os
+import tempfile
+
+# The tests run against a throwaway database, never the local sql_app.db
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+from fastapi.testclient import TestClient
+from main import app, init_database
+import main
+from database import SessionLocal
+from migrations import migrate, schema_problems, split_full_result
+from persistence import DiagnosisWriter
+from core.llm import SingleFlight, partial_json_strings
+from core.governor import LLMGovernor, LLMOverloaded, llm_user
+import asyncio
+import io
+import json
+import pytest
+import models
+import schemas
+import datetime
+from core.model import artifact_fingerprint, get_classifier, DiseaseClassifier, MODEL_PATH, SYMPTOMS_PATH
+from core.matcher import get_symptom_matcher
+from core.training import load_symptom_matrix, model_stats, train_naive_bayes
+from core.engine import load_artifact, save_artifact
+from learner import IncrementalLearner
+from database import Base, engine
+from sqlalchemy import create_engine, insert, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from scipy import sparse
+from sklearn.model_selection import GridSearchCV
+from sklearn.naive_bayes import MultinomialNB
+import joblib
+import numpy as np
+import subprocess
+import sys
+import threading
+import time
+from jose import jwt
+from core import llm, llm_cache, security, translations
+from core.alerts import get_alert_level
+from core.cache import TTLCache
+from core.metrics import timed_iter
+from prometheus_client import REGISTRY
+from types import SimpleNamespace
 
 # Ensure API Key is loaded (it should be from .env, but we check here)
 # os.environ["OPENAI_API_KEY"] = ... (loaded by dotenv in main)
 
 client = TestClient(app)
+migrate(engine)
+init_database()
+classifier = get_classifier()
+
+TEST_JWT_SECRET = "test-secret"
+
+def make_auth_headers(monkeypatch):
+    """Enables local verification of test tokens; returns headers(email) signing one in."""
+    monkeypatch.setattr(security, "SUPABASE_JWT_SECRET", TEST_JWT_SECRET)
+
+    def headers(email: str, secret: str = TEST_JWT_SECRET) -> dict:
+        claims = {"sub": email, "email": email, "aud": "authenticated", "exp": int(time.time()) + 600}
+        return {"Authorization": f"Bearer {jwt.encode(claims, secret, algorithm='HS256')}"}
+    return headers
+
+@pytest.fixture
+def auth_headers(monkeypatch):
+    return make_auth_headers(monkeypatch)
 
 def test_read_root():
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"status": "online", "message": "Medical AI API is running."}
 
-def test_diagnosis_flow():
-    # Test with a simple symptom description
-    payload = {"text": "I have a severe headache and nausea."}
-    
-    print(f"\nTesting with payload: {payload}")
-    response = client.post("/diagnosis", json=payload)
-    
-    print(f"Status Code: {response.status_code}")
-    print(f"Response: {response.json()}")
-    
+def test_metrics_endpoint():
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+    assert "diagnosis_stage_seconds" in response.text
+
+def test_health_endpoints(monkeypatch, auth_headers):
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+    # Not warmed up, and the database has not been migrated: not ready
+    monkeypatch.setenv("OPENAI_API_KEY", os.environ.get("OPENAI_API_KEY") or "test-key")
+    unmigrated = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'ready.db')}")
+    monkeypatch.setattr(main, "engine", unmigrated)
+    monkeypatch.setattr(main, "readiness", {name: False for name in main.WARMUP_STEPS})
+    monkeypatch.setattr(main, "readiness_errors", {})
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["components"] == {"model": True, "database": False, "llm": True, "auth": True}
+    assert "out of date" in response.json()["errors"]["database"]
+
+    # /readyz retries the failed step; once the schema is there it is ready
+    migrate(unmigrated)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json() == {"ready": True, "components": {name: True for name in main.WARMUP_STEPS}, "errors": {}}
+
+def test_diagnosis_flow(monkeypatch, auth_headers):
+    names = classifier.symptom_names
+    advice = {"reasoning": "Baş ağrısı ve bulantı migreni düşündürüyor.", "advice": ["Dinlenin.", "Bol su için."]}
+
+    def respond(kwargs):
+        system, user = (message["content"] for message in kwargs["messages"])
+        if '"symptoms"' in system:
+            return json.dumps({"symptoms": [n for n in names if n in ("headache", "nausea")]})
+        if '"translations"' in system:
+            return json.dumps({"translations": [f"TR {d}" for d in json.loads(user)]})
+        return json.dumps(advice, ensure_ascii=False)
+
+    use_fake_llm(monkeypatch, respond)
+    response = client.post("/diagnosis", json={"text": "I have a severe headache and nausea."},
+                           headers=auth_headers("flow-test@example.com"))
     assert response.status_code == 200
     data = response.json()
-    
-    # Check structure
-    assert "mapped_symptoms" in data
-    assert "predictions" in data
-    assert "max_probability" in data
-    assert "alert_level" in data
-    
-    # Check logic (assuming LLM works)
-    # We expect 'headache' and 'nausea' or similar to be mapped
-    if data["mapped_symptoms"]:
-        print("✅ Symptoms mapped successfully.")
-    else:
-        print("⚠️ No symptoms mapped (LLM might have failed or strict mapping issue).")
+
+    assert data["mapped_symptoms"] == ["headache", "nausea"]
+    expected, max_prob = classifier.predict(["headache", "nausea"])
+    assert [p["disease"] for p in data["predictions"]] == [f"TR {p['disease']}" for p in expected]
+    assert np.isclose(data["max_probability"], max_prob)
+    assert data["alert_level"] == get_alert_level(max_prob)
+    assert data["reasoning"] == advice["reasoning"] and data["advice"] == "Dinlenin.\nBol su için."
+
+def test_engine_matches_sklearn():
+    # The inference engine must reproduce MultinomialNB.predict_proba
+    selected = classifier.symptom_names[:3] + ["not a symptom"]
+    vector = np.zeros(len(classifier.symptom_names))
+    vector[:3] = 1
+    model = joblib.load(MODEL_PATH)
+    expected = model.predict_proba([vector])[0]
+
+    predictions, max_prob = classifier.predict(selected, top_k=5)
+
+    assert len(predictions) == 5
+    assert np.isclose(max_prob, expected.max() * 100)
+    for p in predictions:
+        idx = list(model.classes_).index(p['disease'])
+        assert np.isclose(p['probability'], expected[idx] * 100)
+
+def test_engine_ranking_matches_sklearn():
+    # Random symptom sets: same top-5 order as a stable sort of predict_proba. Classes tied in
+    # exact arithmetic only differ by float noise, so both sides are compared after rounding.
+    model = joblib.load(MODEL_PATH)
+    names = classifier.symptom_names
+    engine = classifier.engine
+    rng = np.random.RandomState(0)
+    cases = [list(rng.choice(len(names), rng.randint(1, 7), replace=False)) for _ in range(300)]
+    vectors = np.zeros((len(cases), len(names)))
+    for row, columns in enumerate(cases):
+        vectors[row, columns] = 1
+    expected = model.predict_proba(vectors)
+    symptom_lists = [[names[i] for i in columns] for columns in cases]
+
+    batch = engine.predict_batch(symptom_lists)
+    for proba, symptoms, (batch_predictions, _) in zip(expected, symptom_lists, batch):
+        order = [model.classes_[i] for i in np.argsort(-np.round(proba, 12), kind="stable")[:5]]
+        predictions, _ = engine.predict(symptoms)
+        assert [p['disease'] for p in predictions] == order
+        assert [p['disease'] for p in batch_predictions] == order
+        assert np.allclose([p['probability'] for p in predictions], np.sort(proba)[::-1][:5] * 100)
+
+def test_predict_batch_matches_predict():
+    cases = [classifier.symptom_names[:2], [], classifier.symptom_names[10:14]]
+    for symptoms, (predictions, max_prob) in zip(cases, classifier.predict_batch(cases)):
+        expected, expected_max = classifier.predict(symptoms)
+        assert [p['disease'] for p in predictions] == [p['disease'] for p in expected]
+        assert np.isclose(max_prob, expected_max)
+
+def test_artifact_round_trip():
+    # Exported arrays, memory-mapped back, must predict exactly like the joblib model
+    tmp = tempfile.mkdtemp()
+    model, names = joblib.load(MODEL_PATH), joblib.load(SYMPTOMS_PATH)
+    versions = [save_artifact(tmp, model, names)["version"] for _ in range(3)]
+    # Re-exports only keep the current and the replaced version's files
+    kept = {name[:-4].split("-", 1)[1] for name in os.listdir(tmp) if name.endswith(".npy")}
+    assert kept == set(versions[1:])
+
+    engine, manifest = load_artifact(tmp, mmap=True)
+    assert manifest["version"] == versions[-1]
+    assert isinstance(engine.feature_log_prob_t, np.memmap) or isinstance(engine.feature_log_prob_t.base, np.memmap)
+    rng = np.random.RandomState(1)
+    cases = [list(rng.choice(len(names), rng.randint(1, 7), replace=False)) for _ in range(50)]
+    vectors = np.zeros((len(cases), len(names)))
+    for row, columns in enumerate(cases):
+        vectors[row, columns] = 1
+    assert np.allclose(engine.predict_batch_proba([[names[i] for i in c] for c in cases]), model.predict_proba(vectors))
+
+def test_prediction_cache_key():
+    # Order, duplicates and unknown names all map to the same cache entry
+    served = DiseaseClassifier()
+    names = served.symptom_names
+    first, _ = served.predict([names[0], names[1]])
+    again, _ = served.predict([names[1], names[0], names[0], "not a symptom"])
+    assert again == first
+    assert len(served.cache) == 1 and served.cache.hits == 1 and served.cache.misses == 1
+    served.predict([names[0], names[1]], top_k=3)  # top_k is part of the key
+    assert len(served.cache) == 2
+
+def test_ttl_cache_expiry_and_eviction():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 1, "maxsize": 2, "ttl": 0.05, "hits": 3, "misses": 2, "evictions": 2, "hit_rate": 0.6}
+    disabled = TTLCache(maxsize=0)
+    disabled.set("a", 1)
+    assert len(disabled) == 0
+
+def test_cache_stats_endpoint(auth_headers):
+    headers = auth_headers("cache-stats-test@example.com")
+    assert client.get("/cache/stats").status_code == 401
+
+    symptoms = classifier.symptom_names[20:23]
+    before = client.get("/cache/stats", headers=headers).json()["predictions"]
+    classifier.cache.pop((tuple(sorted(symptoms)), 5))
+    classifier.predict(symptoms)
+    classifier.predict(list(reversed(symptoms)))
+    after = client.get("/cache/stats", headers=headers).json()
+    assert after["predictions"]["misses"] == before["misses"] + 1
+    assert after["predictions"]["hits"] == before["hits"] + 1
+    assert {"predictions", "symptom_matcher", "llm", "users", "diagnosis_writer"} <= set(after)
+
+def test_prediction_cache_invalidated_on_new_artifact():
+    tmp = tempfile.mkdtemp()
+    model, names = joblib.load(MODEL_PATH), joblib.load(SYMPTOMS_PATH)
+    save_artifact(tmp, model, names)
+    served = DiseaseClassifier(artifact_dir=tmp)
+    served.predict(names[:2])
+    version = served.version
+    time.sleep(0.01)  # A distinct manifest mtime
+    save_artifact(tmp, model, names)
+    served._next_check = 0.0
+    served.reload_if_changed()
+    assert served.version != version and len(served.cache) == 0
+    served.predict(names[:2])
+    assert served.cache.misses == 2
+
+def test_batch_endpoint(monkeypatch, auth_headers):
+    monkeypatch.setattr(main, "BATCH_CHUNK_SIZE", 2)  # Five cases span three chunks
+    reloads = []
+    monkeypatch.setattr(classifier, "reload_if_changed", lambda: reloads.append(1))
+    headers = auth_headers("batch-test@example.com")
+    names = classifier.symptom_names
+    cases = [names[:2], [], names[10:14], ["not a symptom"], names[5:6]]
+
+    response = client.post("/diagnosis/batch", json={"cases": cases, "top_k": 3}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    # Each chunk checks for a changed model on disk, like predict does
+    assert len(reloads) == 3
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == list(range(len(cases)))
+    for case, line in zip(cases, lines):
+        expected, expected_max = classifier.predict(case, top_k=3)
+        assert line["mapped_symptoms"] == case
+        assert [p["disease"] for p in line["predictions"]] == [p["disease"] for p in expected]
+        assert np.isclose(line["max_probability"], expected_max)
+        assert set(line) == {"index", "mapped_symptoms", "predictions", "max_probability", "alert_level"}
+
+def test_batch_endpoint_limits(auth_headers):
+    headers = auth_headers("batch-test@example.com")
+    case = classifier.symptom_names[:2]
+    too_large = [
+        {"cases": [case] * (schemas.BATCH_MAX_CASES + 1)},
+        {"cases": [classifier.symptom_names[:1] * (schemas.BATCH_MAX_SYMPTOMS + 1)]},
+        {"cases": [case], "top_k": 0},
+        {"cases": [case], "top_k": schemas.BATCH_MAX_TOP_K + 1},
+    ]
+    for payload in too_large:
+        assert client.post("/diagnosis/batch", json=payload, headers=headers).status_code == 422
+    payload = {"cases": [case], "top_k": schemas.BATCH_MAX_TOP_K}
+    assert client.post("/diagnosis/batch", json=payload, headers=headers).status_code == 200
+
+def test_training_matches_grid_search():
+    # The closed-form alpha sweep must pick the same model as GridSearchCV(cv=3)
+    rng = np.random.RandomState(0)
+    codes = np.repeat(np.arange(4), 30)
+    y = np.array(["a", "b", "c", "d"], dtype=object)[codes]
+    # Each class favours its own three symptoms
+    X = (rng.rand(len(y), 12) < np.where(np.arange(12) % 4 == codes[:, None], 0.4, 0.1)).astype(np.int64)
+    alphas = np.linspace(0.01, 1.0, 5)
+
+    grid = GridSearchCV(MultinomialNB(), {'alpha': alphas}, cv=3).fit(X, y)
+    model, best_alpha, scores = train_naive_bayes(sparse.csr_matrix(X), y, alphas, n_jobs=1)
+
+    assert best_alpha == grid.best_params_['alpha']
+    assert np.allclose(scores.mean(axis=0), grid.cv_results_['mean_test_score'])
+    assert np.allclose(model.feature_log_prob_, grid.best_estimator_.feature_log_prob_)
+    assert np.allclose(model.class_log_prior_, grid.best_estimator_.class_log_prior_)
+
+def test_load_symptom_matrix():
+    # The real training data: the stored pandas index must not become a symptom column
+    pytest.importorskip("pyarrow")  # Training-only dependency (root requirements.txt)
+    data_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cleaned_data.parquet")
+    X, y, symptom_names = load_symptom_matrix(data_path)
+
+    assert symptom_names == list(joblib.load(SYMPTOMS_PATH))
+    assert X.shape == (len(y), 377)
+    assert X.max() <= 1
+
+def test_model_stats():
+    X = sparse.csr_matrix(np.array([[1, 0], [1, 0], [0, 1], [0, 1], [1, 1]]))
+    y = np.array(["a", "a", "b", "b", "b"], dtype=object)
+    model, _, _ = train_naive_bayes(X, y, [1.0], n_splits=2, n_jobs=1)
+
+    stats = model_stats(model, y, X, y, alpha=1.0)
+    assert stats["accuracy"] == round(model.score(X, y), 4)
+    assert stats["classes"] == ["a", "b"] and stats["class_counts"] == [2, 3]
+    assert stats["alpha"] == 1.0 and stats["records"] == 5
+    # Non-zero confusion cells cover every test row
+    assert sum(count for _, _, count in stats["confusion"]) == len(y)
+    json.dumps(stats)
+
+def test_symptom_matcher():
+    matcher = get_symptom_matcher(classifier.symptom_names)
+
+    symptoms, confidence = matcher.match("Başım ağrıyor ve midem bulanıyor")
+    assert symptoms == ["headache", "nausea"]
+    assert confidence == 1.0
+
+    # Unknown wording leaves the decision to the LLM
+    symptoms, confidence = matcher.match("I feel weird")
+    assert confidence == 0.0
+
+    # A denied symptom must not be taken at face value ("I have no cough")
+    for text in ["öksürüğüm yok", "I don't have a cough", "no fever", "ateşsizim", "öksürük değil"]:
+        symptoms, confidence = matcher.match(text)
+        assert confidence == 0.0, text
+    # Synonyms that contain a negation are still matched locally
+    assert matcher.match("iştahım yok") == (["decreased appetite"], 1.0)
+
+def test_translation_table(monkeypatch):
+    tmp = tempfile.mkdtemp()
+    path, learned_path = os.path.join(tmp, "table.json"), os.path.join(tmp, "learned.db")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"format": "disease_translations/v1", "version": 3, "translations": {"flu": "grip"}}, f)
+    with open(path, "rb") as f:
+        shipped = f.read()
+    calls = []
+
+    async def fake_translate(names):
+        calls.append(list(names))
+        return [f"{name} (tr)" if name != "unknown" else name for name in names]
+
+    monkeypatch.setattr(translations, "translate_diseases", fake_translate)
+    monkeypatch.setattr(translations, "_table", translations.TranslationTable(path, learned_path))
+
+    # Table hits never reach the LLM
+    assert asyncio.run(translations.translate_disease_names(["flu"])) == ["grip"]
+    assert calls == []
+    # Misses go to the LLM; names it could not translate fall back to English and are not stored
+    result = asyncio.run(translations.translate_disease_names(["flu", "asthma", "unknown"]))
+    assert result == ["grip", "asthma (tr)", "unknown"]
+    assert calls == [["asthma", "unknown"]]
+    assert asyncio.run(translations.translate_disease_names(["asthma"])) == ["asthma (tr)"]
+    assert len(calls) == 1
+
+    # The shipped table is untouched; another worker finds the learned entry in the shared store
+    with open(path, "rb") as f:
+        assert f.read() == shipped
+    other = translations.TranslationTable(path, learned_path)
+    assert other.lookup(["asthma", "unknown"]) == ["asthma (tr)", None]
+    assert other.source_name("ASTHMA (TR)") == "asthma" and other.source_name("Grip") == "flu"
+
+def test_local_jwt_verification(auth_headers):
+    response = client.get("/users/me", headers=auth_headers("jwt-test@example.com"))
+    assert response.status_code == 200
+    assert response.json()["email"] == "jwt-test@example.com"
+
+    forged = auth_headers("jwt-test@example.com", secret="wrong-secret")
+    assert client.get("/users/me", headers=forged).status_code == 401
+
+def test_blocking_auth_calls_run_in_threads(monkeypatch):
+    # The JWKS fetch and the Supabase fallback must not run on the event loop
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from jose import jwk
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    jwks = {"keys": [{**jwk.construct(public_pem, "RS256").to_dict(), "kid": "key-1"}]}
+    blocking_threads = []
+
+    def fake_urlopen(url, timeout):
+        blocking_threads.append(threading.get_ident())
+        return io.BytesIO(json.dumps(jwks).encode())
+
+    def fake_remote(token):
+        blocking_threads.append(threading.get_ident())
+        return security.VerifiedUser(id="remote", email="remote@example.com")
+
+    monkeypatch.setenv("SUPABASE_URL", "https://example.supabase.co")
+    monkeypatch.setattr(security.urllib.request, "urlopen", fake_urlopen)
+    monkeypatch.setattr(security, "_verify_remotely", fake_remote)
+    monkeypatch.setattr(security, "_jwks", {})
+    monkeypatch.setattr(security, "_jwks_fetched_at", 0.0)
+    monkeypatch.setattr(security, "SUPABASE_JWT_SECRET", None)
+    monkeypatch.setattr(security, "AUTH_REMOTE_FALLBACK", True)
+
+    def token(sub, algorithm="RS256"):
+        claims = {"sub": sub, "email": f"{sub}@example.com", "aud": "authenticated", "exp": int(time.time()) + 600}
+        if algorithm == "RS256":
+            return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": "key-1"})
+        return jwt.encode(claims, "unknown-secret", algorithm="HS256")
+
+    async def run():
+        first = await security.verify_supabase_token(token("rs-1"))
+        second = await security.verify_supabase_token(token("rs-2"))  # Key already cached: no fetch
+        remote = await security.verify_supabase_token(token("hs-1", "HS256"))
+        return first, second, remote
+
+    first, second, remote = asyncio.run(run())
+    assert (first.id, second.id, remote.id) == ("rs-1", "rs-2", "remote")
+    assert len(blocking_threads) == 2 and threading.get_ident() not in blocking_threads
+
+def test_profile_update_refreshes_user_cache(auth_headers):
+    headers = auth_headers("cache-test@example.com")
+
+    first = client.get("/users/me", headers=headers).json()
+    assert client.get("/users/me", headers=headers).json()["id"] == first["id"]
+
+    age = (first.get("age") or 30) + 1
+    response = client.put("/users/me", json={"age": age}, headers=headers)
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=headers).json()["age"] == age
+
+def test_history_pagination(monkeypatch, auth_headers):
+    headers = auth_headers("history-test@example.com")
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+
+    db = SessionLocal()
+    db.query(models.Diagnosis).filter(models.Diagnosis.user_id == user_id).delete()
+    start = datetime.datetime(2025, 1, 1)
+    for i in range(7):
+        # Pairs share a timestamp, so the cursor has to break ties by id
+        db.add(models.Diagnosis(user_id=user_id, symptoms="test", predicted_disease=f"disease-{i}",
+                                probability=50.0, alert_level="Low", created_at=start + datetime.timedelta(minutes=i // 2)))
+    db.commit()
+    db.close()
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, "summary": "true", **({"before": cursor} if cursor else {})}
+        response = client.get("/history", params=params, headers=headers)
+        assert response.status_code == 200
+        seen += [row["predicted_disease"] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [f"disease-{i}" for i in reversed(range(7))]
+
+    # Without paging parameters the whole history comes back (clients that do not page)
+    monkeypatch.setattr(main, "HISTORY_PAGE_SIZE", 2)
+    response = client.get("/history", params={"summary": "true"}, headers=headers)
+    assert [row["predicted_disease"] for row in response.json()] == seen
+    assert "X-Next-Cursor" not in response.headers
+    # A cursor alone pages with the default page size
+    first = client.get("/history", params={"limit": 3}, headers=headers)
+    response = client.get("/history", params={"before": first.headers["X-Next-Cursor"]}, headers=headers)
+    assert len(response.json()) == 2 and "X-Next-Cursor" in response.headers
+
+def test_confirm_diagnosis(auth_headers):
+    headers = auth_headers("confirm-test@example.com")
+    clinician_headers = auth_headers("clinician-test@example.com")
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    clinician_id = client.get("/users/me", headers=clinician_headers).json()["id"]
+    with SessionLocal() as db:
+        db.get(models.User, clinician_id).is_clinician = True
+        db.commit()
+    main.user_cache.clear()
+
+    db = SessionLocal()
+    diagnosis = models.Diagnosis(user_id=user_id, symptoms="test", predicted_disease="x", probability=50.0,
+                                 alert_level="Low", mapped_symptoms=classifier.symptom_names[:2], predictions=[])
+    db.add(diagnosis)
+    db.commit()
+    diagnosis_id = diagnosis.id
+    db.close()
+    disease, other = classifier.classes[0], classifier.classes[1]
+
+    # Confirmations train the shared model, so patients cannot label their own diagnoses
+    assert client.post(f"/history/{diagnosis_id}/confirm", json={"disease": disease}, headers=headers).status_code == 403
+    assert client.post(f"/history/{diagnosis_id}/confirm", json={"disease": "not a disease"}, headers=clinician_headers).status_code == 422
+    response = client.post(f"/history/{diagnosis_id}/confirm", json={"disease": disease.upper()}, headers=clinician_headers)
+    assert response.status_code == 200
+    assert response.json()["confirmed_disease"] == disease
+    # Final once confirmed; repeating the same confirmation is fine
+    assert client.post(f"/history/{diagnosis_id}/confirm", json={"disease": disease}, headers=clinician_headers).status_code == 200
+    assert client.post(f"/history/{diagnosis_id}/confirm", json={"disease": other}, headers=clinician_headers).status_code == 409
+    assert client.post(f"/history/{diagnosis_id + 10**6}/confirm", json={"disease": disease}, headers=clinician_headers).status_code == 404
+    with SessionLocal() as db:
+        assert db.get(models.Diagnosis, diagnosis_id).confirmed_by == clinician_id
+
+    history = client.get("/history", headers=headers).json()
+    assert history[0]["id"] == diagnosis_id and history[0]["confirmed_disease"] == disease
+
+def test_incremental_learner():
+    # Own database and artifact directory, so confirmations from other tests don't leak in
+    tmp = tempfile.mkdtemp()
+    db_engine = create_engine(f"sqlite:///{os.path.join(tmp, 'learner.db')}")
+    Base.metadata.create_all(db_engine)
+    Session = sessionmaker(bind=db_engine)
+    save_artifact(tmp, joblib.load(MODEL_PATH), joblib.load(SYMPTOMS_PATH))
+    learner = IncrementalLearner(artifact_dir=tmp, session_factory=Session, min_holdout=1, settle_seconds=0)
+
+    symptoms = classifier.symptom_names[:3]
+    predicted = classifier.predict(symptoms)[0][0]["disease"]
+    other = next(c for c in classifier.classes if c != predicted)
+    start = datetime.datetime(2025, 1, 1)
+    with Session() as db:
+        db.add_all([models.User(id=1, email="clinician@example.com", is_clinician=True),
+                    models.User(id=2, email="patient@example.com")])
+        db.commit()
+
+    def confirm(ids, disease, confirmed_by=1, mapped_symptoms=symptoms):
+        with Session() as db:
+            db.execute(insert(models.Diagnosis), [
+                dict(id=i, user_id=2, symptoms="test", mapped_symptoms=mapped_symptoms, confirmed_disease=disease,
+                     confirmed_at=start + datetime.timedelta(seconds=i), confirmed_by=confirmed_by) for i in ids])
+            db.commit()
+
+    # Confirmations by a non-clinician are never learned (nor held out)
+    confirm(range(1000000, 1000030), other, confirmed_by=2)
+    assert learner.run_once()["status"] == "idle"
+
+    # ids 10 and 20 are held out; the other eighteen are learned
+    confirm(range(1, 21), predicted)
+    before = learner.load()
+    result = learner.run_once()
+    assert result["status"] == "published" and result["used"] == 18 and result["holdout"] == 2
+    after = learner.load()
+    row = before.classes.index(predicted)
+    assert after.class_count[row] == before.class_count[row] + 18
+    assert np.array_equal(after.feature_count[row] - before.feature_count[row],
+                          np.isin(before.symptom_names, symptoms) * 18.0)
+    assert after.manifest["learned_through"]["id"] == 19
+    assert learner.run_once()["status"] == "idle"
+
+    # Nothing usable: the watermark moves on, but no new version (or array file) is written
+    arrays = sorted(f for f in os.listdir(tmp) if f.endswith(".npy"))
+    served = DiseaseClassifier(artifact_dir=tmp)
+    served.cache.set("cached", 1)
+    confirm([21, 22], "not a disease")
+    result = learner.run_once()
+    assert result["status"] == "advanced" and result["used"] == 0
+    manifest = learner.load().manifest
+    assert manifest["version"] == after.manifest["version"] and manifest["learned_through"]["id"] == 22
+    assert sorted(f for f in os.listdir(tmp) if f.endswith(".npy")) == arrays
+    # Serving workers keep their loaded model and cached predictions
+    served._next_check = 0.0
+    served.reload_if_changed()
+    assert served.fingerprint == artifact_fingerprint(served.artifact_paths()) and served.cache.get("cached") == 1
+
+    # Relabelling the held-out symptoms as another disease must not be published
+    confirm([i for i in range(23, 2000) if i % 10], other)
+    result = learner.run_once()
+    assert result["status"] == "rejected" and result["reason"] == "regression"
+    manifest = learner.load().manifest
+    assert manifest["version"] == after.manifest["version"]
+    assert manifest["rejected_through"]["id"] == manifest["learned_through"]["id"] == 1999
+    assert manifest["rejected_rows"] == result["used"]
+
+    # The rejected batch is skipped, so the next good batch is still learned
+    confirm(range(2001, 2010), predicted)
+    result = learner.run_once()
+    assert result["status"] == "published" and result["used"] == 9
+    assert learner.load().manifest["learned_through"]["id"] == 2009
+
+FORKED_LOGGING = """
+import logging, os
+from core.log import setup_logging, start_log_listener, stop_log_listener
+setup_logging()
+pid = os.fork()
+if pid == 0:
+    logging.getLogger("child").warning("logged by the worker")
+    start_log_listener()  # What main.py's lifespan does in a preloaded gunicorn worker
+    stop_log_listener()
+    os._exit(0)
+os.waitpid(pid, 0)
+"""
+
+def test_log_listener_after_fork():
+    # A forked worker gets its own listener thread, so its records reach stdout
+    env = dict(os.environ, LOG_LEVEL="INFO", LOG_FORMAT="json")
+    output = subprocess.run([sys.executable, "-c", FORKED_LOGGING], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert [json.loads(line)["msg"] for line in output.stdout.splitlines()] == ["logged by the worker"]
+
+def test_schema_check():
+    db_engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'schema.db')}")
+    assert "table diagnoses" in schema_problems(db_engine)
+    migrate(db_engine)
+    assert schema_problems(db_engine) == []
+    with db_engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_diagnoses_confirmed_at")
+    assert schema_problems(db_engine) == ["index ix_diagnoses_confirmed_at"]
+    # Migrating again only adds what is missing
+    migrate(db_engine)
+    assert schema_problems(db_engine) == []
+
+def test_migrate_legacy_database():
+    # A database from before the normalized diagnosis columns
+    db_engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'legacy.db')}")
+    with db_engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, hashed_password VARCHAR)")
+        conn.exec_driver_sql("CREATE TABLE diagnoses (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id), "
+                             "symptoms VARCHAR, predicted_disease VARCHAR, probability FLOAT, created_at DATETIME, "
+                             "full_result JSON)")
+        conn.exec_driver_sql("INSERT INTO users (id, email) VALUES (1, 'legacy@example.com')")
+        for i, probability in enumerate([30.0, 65.0, 92.5], start=1):
+            full_result = [{"disease": "Grip", "probability": probability, "probability_str": f"%{probability}"},
+                           {"type": "advice", "data": {"reasoning": "r", "advice": ["a"]}}]
+            conn.exec_driver_sql("INSERT INTO diagnoses (id, user_id, probability, full_result) VALUES (?, 1, ?, ?)",
+                                 (i, probability, json.dumps(full_result)))
+
+    migrate(db_engine)
+    assert schema_problems(db_engine) == []
+    with sessionmaker(bind=db_engine)() as db:
+        rows = db.query(models.Diagnosis).order_by(models.Diagnosis.id).all()
+        assert [row.alert_level for row in rows] == ["Low", "Medium", "High"]
+        assert rows[0].predictions[0]["disease"] == "Grip" and rows[0].advice == "a"
+    foreign_keys = {(fk["constrained_columns"][0], fk["referred_table"]) for fk in inspect(db_engine).get_foreign_keys("diagnoses")}
+    assert ("confirmed_by", "users") in foreign_keys
+
+def test_split_legacy_full_result():
+    full_result = [
+        {"disease": "Grip", "probability": 62.5, "probability_str": "%62.5"},
+        {"unexpected": "item"},
+        {"type": "advice", "data": {"reasoning": ["a", "b"], "advice": ["x", "y"]}},
+    ]
+    predictions, reasoning, advice = split_full_result(full_result)
+    assert predictions == [{"disease": "Grip", "probability": 62.5, "probability_str": "%62.5"}]
+    assert reasoning == "a b"
+    assert advice == "x\ny"
+
+def test_diagnosis_writer_spools_and_replays():
+    writer = DiagnosisWriter(flush_interval=0.01, max_retries=0, spool_dir=tempfile.mkdtemp())
+    inserted = []
+
+    async def failing_insert(batch):
+        raise RuntimeError("database down")
+
+    async def recording_insert(batch):
+        inserted.extend(batch)
+
+    async def run():
+        writer._insert = failing_insert
+        writer.start()
+        assert await writer.save({"user_id": 1, "predicted_disease": "Grip"}) is False
+        await writer.stop()
+        assert writer.spooled == 1
+
+        writer._insert = recording_insert
+        await writer.replay_spool()
+
+    asyncio.run(run())
+    assert [row["predicted_disease"] for row in inserted] == ["Grip"]
+    assert os.listdir(writer.spool_dir) == []
+
+def test_diagnosis_writer_dead_letters_rejected_rows():
+    # One row the database rejects must not fail (or stall) the rest of its batch
+    writer = DiagnosisWriter(max_retries=5, spool_dir=tempfile.mkdtemp())
+    inserted = []
+
+    async def insert_unless_bad(batch):
+        if any(row.get("bad") for row in batch):
+            raise IntegrityError("INSERT INTO diagnoses", {}, Exception("FOREIGN KEY constraint failed"))
+        inserted.extend(batch)
+
+    async def run():
+        writer._insert = insert_unless_bad
+        batch = [{"user_id": 1, "predicted_disease": str(i), "bad": i == 3} for i in range(7)]
+        started = time.monotonic()
+        assert await writer._flush(batch) is True
+        assert time.monotonic() - started < 1  # No retry backoff for rejected rows
+        # A synchronous save reports that the row is not on /history
+        assert await writer.save({"user_id": 1, "predicted_disease": "x", "bad": True}, sync=True) is False
+
+    asyncio.run(run())
+    assert sorted(row["predicted_disease"] for row in inserted) == ["0", "1", "2", "4", "5", "6"]
+    assert writer.retries == 0 and writer.spooled == 0 and writer.dead_lettered == 2
+    # Dead letters are kept for inspection but never replayed
+    assert os.listdir(writer.spool_dir) == [os.path.basename(writer.dead_letter_path)]
+    with open(writer.dead_letter_path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["predicted_disease"] for row in rows] == ["3", "x"] and "FOREIGN KEY" in rows[0]["_error"]
+
+def test_partial_json_strings():
+    full = '{"reasoning": "Ba\\u015f ağrısı \\"migren\\" olabilir.", "advice": ["liste"]}'
+    seen = ""
+    for end in range(len(full) + 1):
+        value = partial_json_strings(full[:end], ("reasoning", "advice")).get("reasoning", "")
+        assert value.startswith(seen)  # Streamed text only ever grows
+        seen = value
+    assert seen == 'Baş ağrısı "migren" olabilir.'
+    assert "advice" not in partial_json_strings(full, ("reasoning", "advice"))
+
+def test_single_flight_coalesces_identical_calls():
+    flight = SingleFlight()
+    upstream_calls = []
+
+    async def call():
+        upstream_calls.append(1)
+        await asyncio.sleep(0.05)
+        return '{"ok": true}'
+
+    async def run():
+        return await asyncio.gather(*(flight.do("same-key", call) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert results == ['{"ok": true}'] * 10
+    assert len(upstream_calls) == 1
+    assert flight.stats()["coalesced"] == 9
+
+class FakeOpenAI:
+    """Stands in for AsyncOpenAI: respond(kwargs) gives each call's content (or raises)."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.respond(kwargs)
+        if kwargs.get("stream"):
+            return self._stream(content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+    @staticmethod
+    async def _stream(content, size=8):
+        for start in range(0, len(content), size):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[start:start + size]))],
+                                  usage=None)
+        yield SimpleNamespace(choices=[], usage=None)  # Usage-only last chunk
+
+def use_fake_llm(monkeypatch, respond) -> FakeOpenAI:
+    """Routes LLM calls to FakeOpenAI, with an empty LLM cache and translation table of their own."""
+    tmp = tempfile.mkdtemp()
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", os.path.join(tmp, "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_llm_cache", llm_cache.LLMResponseCache())
+    monkeypatch.setattr(translations, "_table", translations.TranslationTable(os.path.join(tmp, "table.json"),
+                                                                              os.path.join(tmp, "learned.db")))
+    fake = FakeOpenAI(respond)
+    monkeypatch.setattr(llm, "get_client", lambda: fake)
+    return fake
+
+def test_llm_cache_tiers(monkeypatch):
+    tmp = tempfile.mkdtemp()
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", os.path.join(tmp, "llm_cache.db"))
+    cache = llm_cache.LLMResponseCache()
+    monkeypatch.setattr(llm_cache, "_llm_cache", cache)
+
+    # A disk hit is promoted to the memory tier
+    cache.disk.set("shared-key", "value")
+    assert cache.memory.get("shared-key") is None
+    assert asyncio.run(cache.get("shared-key")) == "value"
+    assert cache.memory.get("shared-key") == "value"
+
+    # Both tiers expire entries after their TTL
+    memory = TTLCache(maxsize=4, ttl=0.05)
+    disk = llm_cache.SQLiteCacheTier(os.path.join(tmp, "ttl.db"), ttl=0.05, max_entries=10)
+    memory.set("k", "v")
+    disk.set("k", "v")
+    assert memory.get("k") == "v" and disk.get("k") == "v"
+    time.sleep(0.1)
+    assert memory.get("k") is None and disk.get("k") is None
+
+    # Hits refresh the access time only once per TOUCH_INTERVAL
+    disk = llm_cache.SQLiteCacheTier(os.path.join(tmp, "touch.db"), ttl=0, max_entries=10)
+    disk.set("k", "v")
+    accessed_at = lambda: disk._conn().execute("SELECT accessed_at FROM llm_cache WHERE key = 'k'").fetchone()[0]
+    written = accessed_at()
+    assert disk.get("k") == "v" and accessed_at() == written
+    monkeypatch.setattr(llm_cache, "TOUCH_INTERVAL", 0)
+    assert disk.get("k") == "v" and accessed_at() > written
+
+    # Only responses that parse as JSON are cached
+    answers = iter(["not json", '{"ok": 1}'])
+    fake = FakeOpenAI(lambda kwargs: next(answers))
+    monkeypatch.setattr(llm, "get_client", lambda: fake)
+    key = llm_cache.make_key(llm.LLM_MODEL, "system", "user", 0.0)
+    with pytest.raises(json.JSONDecodeError):
+        asyncio.run(llm._chat_json("system", "user", 0.0))
+    assert asyncio.run(cache.get(key)) is None
+    assert asyncio.run(llm._chat_json("system", "user", 0.0)) == {"ok": 1}
+    assert asyncio.run(llm._chat_json("system", "user", 0.0)) == {"ok": 1}
+    assert len(fake.calls) == 2
+    # Another worker (own memory tier) finds it on disk
+    assert asyncio.run(llm_cache.LLMResponseCache().get(key)) == '{"ok": 1}'
+
+def stream_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        name, data = block.split("\n", 1)
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+def test_diagnosis_stream(monkeypatch, auth_headers):
+    advice = {"reasoning": "Migren belirtileri olabilir.", "advice": "Karanlık bir odada dinlenin."}
+
+    def respond(kwargs):
+        if kwargs.get("stream"):
+            return json.dumps(advice, ensure_ascii=False)
+        return json.dumps({"translations": [f"TR {d}" for d in json.loads(kwargs["messages"][1]["content"])]})
+
+    use_fake_llm(monkeypatch, respond)
+    headers = auth_headers("stream-test@example.com")
+    # Matched locally, so only translation and advice reach the (fake) LLM
+    payload = {"text": "Başım ağrıyor ve midem bulanıyor"}
+
+    response = client.post("/diagnosis/stream", json=payload, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = stream_events(response)
+    names = [name for name, _ in events]
+    assert names[0] == "predictions" and names[-2:] == ["advice", "done"]
+    assert names.count("translations") == 1 and set(names[1:-2]) == {"translations", "advice_delta"}
+
+    predictions = events[0][1]
+    assert predictions["mapped_symptoms"] == ["headache", "nausea"] and predictions["extraction_path"] == "local"
+    english = [p["disease"] for p in predictions["predictions"]]
+    translated = dict(events)["translations"]["predictions"]
+    assert [p["disease"] for p in translated] == [f"TR {d}" for d in english]
+    # The deltas add up to the final advice
+    for field in ("reasoning", "advice"):
+        assert "".join(d["delta"] for name, d in events if name == "advice_delta" and d["field"] == field) == advice[field]
+    assert dict(events)["advice"] == advice
+    done = events[-1][1]
+    assert done["reasoning"] == advice["reasoning"] and [p["disease"] for p in done["predictions"]] == [f"TR {d}" for d in english]
+
+    # Advice cut off mid-stream: an error event follows the deltas, no fallback is appended
+    truncated = json.dumps(advice, ensure_ascii=False)[:30]
+    use_fake_llm(monkeypatch, lambda kwargs: truncated if kwargs.get("stream") else respond(kwargs))
+    events = stream_events(client.post("/diagnosis/stream", json=payload, headers=headers))
+    names = [name for name, _ in events]
+    assert "advice_delta" in names and "advice" not in names and "done" not in names
+    assert events[-1] == ("error", {"detail": "advice generation failed mid-stream"})
+    streamed = "".join(d["delta"] for name, d in events if name == "advice_delta")
+    assert advice["reasoning"].startswith(streamed)
+
+    # A failure after the stream started arrives as an error event
+    def broken_predict(symptoms, top_k=5):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(classifier, "predict", broken_predict)
+    response = client.post("/diagnosis/stream", json=payload, headers=headers)
+    assert response.status_code == 200
+    assert stream_events(response) == [("error", {"detail": "model unavailable"})]
+
+def test_timed_iter_excludes_consumer_time():
+    async def items():
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield i
+
+    async def consume():
+        received = []
+        async for item in timed_iter("timed_iter_test", items()):
+            received.append(item)
+            await asyncio.sleep(0.1)  # A slow client
+        return received
+
+    assert asyncio.run(consume()) == [0, 1, 2]
+    observed = REGISTRY.get_sample_value("diagnosis_stage_seconds_sum", {"stage": "timed_iter_test"})
+    assert 0.03 <= observed < 0.2
+
+def test_llm_governor_limits():
+    governor = LLMGovernor(max_concurrency=1, queue_size=1, queue_timeout=5, user_rate=0.01, user_burst=2)
+
+    token = llm_user.set(42)
+    try:
+        governor.check_user()
+        governor.check_user()
+        try:
+            governor.check_user()
+            assert False, "third call should exceed the burst"
+        except LLMOverloaded as e:
+            assert e.status_code == 429 and int(e.headers["Retry-After"]) >= 1
+    finally:
+        llm_user.reset(token)
+
+    async def hold(seconds):
+        async with governor.slot():
+            await asyncio.sleep(seconds)
+
+    async def run():
+        # One call running, one waiting: the third is rejected without waiting
+        return await asyncio.gather(hold(0.1), hold(0), hold(0), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[2], LLMOverloaded)
+    assert governor.stats()["rejected_queue"] == 1
 
 if __name__ == "__main__":
     test_read_root()
-    test_diagnosis_flow()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_health_endpoints(monkeypatch, make_auth_headers(monkeypatch))
+    test_metrics_endpoint()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_diagnosis_flow(monkeypatch, make_auth_headers(monkeypatch))
+    test_engine_matches_sklearn()
+    test_engine_ranking_matches_sklearn()
+    test_predict_batch_matches_predict()
+    test_artifact_round_trip()
+    test_prediction_cache_key()
+    test_ttl_cache_expiry_and_eviction()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_cache_stats_endpoint(make_auth_headers(monkeypatch))
+    test_prediction_cache_invalidated_on_new_artifact()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_batch_endpoint(monkeypatch, make_auth_headers(monkeypatch))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_batch_endpoint_limits(make_auth_headers(monkeypatch))
+    test_training_matches_grid_search()
+    test_load_symptom_matrix()
+    test_model_stats()
+    test_symptom_matcher()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_translation_table(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_local_jwt_verification(make_auth_headers(monkeypatch))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_blocking_auth_calls_run_in_threads(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_profile_update_refreshes_user_cache(make_auth_headers(monkeypatch))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_history_pagination(monkeypatch, make_auth_headers(monkeypatch))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_confirm_diagnosis(make_auth_headers(monkeypatch))
+    test_incremental_learner()
+    test_log_listener_after_fork()
+    test_schema_check()
+    test_migrate_legacy_database()
+    test_split_legacy_full_result()
+    test_diagnosis_writer_spools_and_replays()
+    test_diagnosis_writer_dead_letters_rejected_rows()
+    test_partial_json_strings()
+    test_single_flight_coalesces_identical_calls()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_llm_cache_tiers(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_diagnosis_stream(monkeypatch, make_auth_headers(monkeypatch))
+    test_timed_iter_excludes_consumer_time()
+    test_llm_governor_limits()
     print("\n✅ All tests passed!")
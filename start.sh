@@ -1,3 +1,3 @@
 #!/bin/bash
 cd backend
-gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:10000
+gunicorn -c gunicorn.conf.py main:app
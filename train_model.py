@@ -1,38 +1,40 @@
 # train_model.py
 
-import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.naive_bayes import MultinomialNB
+from sklearn.model_selection import train_test_split
 from imblearn.over_sampling import SMOTE
 import joblib # Modeli kaydetmek için
+import json
+import sys
+import os
+import time
 
-print("1. Veri yükleniyor...")
-df = pd.read_parquet('cleaned_data.parquet')
-diseases = df.iloc[:, 0]
-symptoms = df.iloc[:, 1:]
-symptom_names = symptoms.columns.tolist()
+# Pickle içermeyen model formatı ve eğitim motoru backend ile ortak (backend/core/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from core.engine import save_artifact
+from core.training import load_symptom_matrix, model_stats, train_naive_bayes
+
+# Paralel iş sayısı (-1: tüm çekirdekler)
+N_JOBS = int(os.environ.get("TRAIN_N_JOBS", "-1"))
+
+start = time.perf_counter()
+print("1. Veri yükleniyor (seyrek matris olarak)...")
+X, y, symptom_names = load_symptom_matrix('cleaned_data.parquet')
 
 print("2. Veri eğitim ve test olarak ayrılıyor...")
-X = symptoms.values
-y = diseases.values
 X_train, X_test, y_train, y_test = train_test_split(
     X, y, test_size=0.2, random_state=42, stratify=y
 )
 
-print("3. SMOTE ile eğitim verisi dengeleniyor (Bu işlem biraz sürebilir)...")
+print("3. SMOTE ile eğitim verisi dengeleniyor...")
 smote = SMOTE(random_state=42, k_neighbors=1)
 X_train_resampled, y_train_resampled = smote.fit_resample(X_train, y_train)
 
 print("4. Naive Bayes modeli en iyi hiperparametrelerle eğitiliyor...")
-param_grid = {'alpha': np.linspace(0.01, 1.0, 20)}
-nb_model = MultinomialNB()
-
-grid_search = GridSearchCV(nb_model, param_grid, cv=3, verbose=1)
-grid_search.fit(X_train_resampled, y_train_resampled)
-
-best_model = grid_search.best_estimator_
-print(f"En iyi alpha değeri bulundu: {grid_search.best_params_}")
+# Sayımlar her katman için bir kez hesaplanır; her alpha kapalı formdan türetilir (GridSearchCV(cv=3) ile aynı sonuç)
+alphas = np.linspace(0.01, 1.0, 20)
+best_model, best_alpha, cv_scores = train_naive_bayes(X_train_resampled, y_train_resampled, alphas, n_splits=3, n_jobs=N_JOBS)
+print(f"En iyi alpha değeri bulundu: {{'alpha': {best_alpha}}} (CV doğruluğu: %{cv_scores.mean(axis=0).max() * 100:.1f})")
 
 # Modelin doğruluğunu hesapla
 score = best_model.score(X_test, y_test)
@@ -45,4 +47,16 @@ joblib.dump(best_model, 'trained_model.joblib')
 # Semptom listesini kaydet (tahmin için gerekli)
 joblib.dump(symptom_names, 'symptom_names.joblib')
 
-print("\n🎉 İşlem tamamlandı! 'trained_model.joblib' ve 'symptom_names.joblib' dosyaları oluşturuldu.")
\ No newline at end of file
+print("6. Model parametreleri .npy + manifest olarak dışa aktarılıyor (mmap ile paylaşımlı yükleme için)...")
+manifest = save_artifact('nb_model', best_model, symptom_names)
+print(f"Model sürümü: {manifest['version']}")
+
+print("7. Veri seti ve performans istatistikleri 'model_stats.json' dosyasına yazılıyor (Streamlit arayüzü için)...")
+# Sayımlar, sınıf bazında metrikler ve karmaşıklık matrisi; arayüz veri setini yüklemeden bunları gösterir
+stats = model_stats(best_model, y, X_test, y_test, model_version=manifest['version'], alpha=best_alpha,
+                    cv_accuracy=round(float(cv_scores.mean(axis=0).max()), 4))
+with open('model_stats.json', 'w', encoding='utf-8') as f:
+    json.dump(stats, f, ensure_ascii=False)
+
+print(f"\n🎉 İşlem tamamlandı ({time.perf_counter() - start:.1f} sn)! 'trained_model.joblib', 'symptom_names.joblib', 'model_stats.json' ve 'nb_model/' oluşturuldu.")
+print("   Backend için 'nb_model/' klasörünü 'backend/assets/' altına kopyalayın.")